@@ -0,0 +1,104 @@
+"""
+Group spending analytics, served from the GroupDailyRollup table.
+
+Totals by payer, by member share, by day and by month are small GROUP BY
+queries over the rollups (one row per member per active day), never over
+the expenses themselves. Only the top-expenses list touches Expense, and
+that uses the (group, -total_amount) index. Results are cached in the cache
+shared by all workers (CACHES in settings) under the group's ledger version,
+like the timeline.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+
+from .ledger import from_cents, ledger_version
+
+
+def _money(cents):
+    return f"{from_cents(cents or 0):.2f}"
+
+
+def group_analytics(group, start=None, end=None, top=10):
+    """
+    Spending aggregates for a group, optionally limited to [start, end] days.
+    Amounts are in the group's currency (expenses are converted when written).
+
+    Returns:
+        {"currency", "total", "expense_count", "by_payer", "by_member_share",
+         "by_day", "by_month", "top_expenses"}
+    """
+    cache_key = f"group-analytics:{group.id}:{start}:{end}:{top}:{ledger_version(group.id)}"
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    rollups = group.daily_rollups.all()
+    expenses = group.expenses.all()
+    if start:
+        rollups = rollups.filter(day__gte=start)
+        expenses = expenses.filter(date__date__gte=start)
+    if end:
+        rollups = rollups.filter(day__lte=end)
+        expenses = expenses.filter(date__date__lte=end)
+
+    # 1. Per member: what they paid and what their share was
+    per_user = rollups.values('user__username').annotate(
+        paid=Sum('paid_cents'), share=Sum('owed_cents'), count=Sum('expense_count')
+    ).order_by()
+    per_user = list(per_user)
+
+    by_payer = [
+        {"username": row['user__username'], "paid": _money(row['paid']), "count": row['count']}
+        for row in sorted(per_user, key=lambda row: (-row['paid'], row['user__username']))
+        if row['count']
+    ]
+    by_member_share = [
+        {"username": row['user__username'], "share": _money(row['share'])}
+        for row in sorted(per_user, key=lambda row: (-row['share'], row['user__username']))
+        if row['share']
+    ]
+
+    # 2. Over time
+    by_day = [
+        {"day": row['day'].isoformat(), "total": _money(row['paid']), "count": row['count']}
+        for row in rollups.values('day').annotate(
+            paid=Sum('paid_cents'), count=Sum('expense_count')
+        ).order_by('day')
+    ]
+    by_month = [
+        {"month": row['month'].strftime('%Y-%m'), "total": _money(row['paid']), "count": row['count']}
+        for row in rollups.annotate(month=TruncMonth('day')).values('month').annotate(
+            paid=Sum('paid_cents'), count=Sum('expense_count')
+        ).order_by('month')
+    ]
+
+    # 3. Largest expenses
+    top_expenses = [
+        {
+            "id": expense['id'],
+            "description": expense['description'],
+            "total_amount": f"{expense['total_amount']:.2f}",
+            "date": expense['date'].isoformat(),
+            "payer_username": expense['payer__username'],
+            "currency": expense['currency'],
+            "original_amount": f"{expense['original_amount'] or expense['total_amount']:.2f}",
+        }
+        for expense in expenses.order_by('-total_amount', '-id').values(
+            'id', 'description', 'total_amount', 'date', 'payer__username', 'currency', 'original_amount'
+        )[:top]
+    ]
+
+    analytics = {
+        "currency": group.currency,
+        "total": _money(sum(row['paid'] or 0 for row in per_user)),
+        "expense_count": sum(row['count'] or 0 for row in per_user),
+        "by_payer": by_payer,
+        "by_member_share": by_member_share,
+        "by_day": by_day,
+        "by_month": by_month,
+        "top_expenses": top_expenses,
+    }
+    cache.set(cache_key, analytics, settings.TIMELINE_CACHE_SECONDS)
+    return analytics
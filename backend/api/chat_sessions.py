@@ -0,0 +1,192 @@
+"""
+Store for Gemini chat sessions used by itinerary refinement.
+
+Follow-up requests ("make day 2 cheaper") reuse the context established by
+the first refinement instead of re-sending the whole itinerary every time.
+
+There are two layers:
+- Each worker process keeps its live chat objects in a ChatSessionStore.
+- After every refinement the chat history and token totals are written to
+  the shared cache, keyed by itinerary id and `updated_at`. A worker that has
+  no live chat for the itinerary rebuilds one from that snapshot, so it does
+  not matter which gunicorn worker the follow-up lands on.
+
+Both layers are bounded:
+- Sessions idle for longer than `idle_seconds` are evicted (snapshots expire
+  after the same time).
+- When more than `max_sessions` are alive in a worker, the least recently
+  used is dropped.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+@dataclass
+class RefinementSession:
+    """
+    One chat session attached to an itinerary, plus its running token totals.
+    """
+    chat: Any
+    owner_id: int
+    # `Itinerary.updated_at` at the time the session last saw the itinerary.
+    # If the itinerary is edited elsewhere, the chat context is stale.
+    itinerary_version: Any = None
+    turns: int = 0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    total_tokens: int = 0
+    last_used: float = field(default_factory=time.monotonic)
+    # Chat objects keep their own history, so only one request may use a
+    # session at a time.
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record_usage(self, usage: Dict[str, int]):
+        """Add one refinement's token counts to the session totals."""
+        self.turns += 1
+        self.prompt_tokens += usage.get('prompt_tokens', 0)
+        self.output_tokens += usage.get('output_tokens', 0)
+        self.total_tokens += usage.get('total_tokens', 0)
+
+    def totals(self) -> Dict[str, int]:
+        return {
+            'turns': self.turns,
+            'prompt_tokens': self.prompt_tokens,
+            'output_tokens': self.output_tokens,
+            'total_tokens': self.total_tokens,
+        }
+
+    def restore_totals(self, totals: Dict[str, int]):
+        """Continue the token totals of a session rebuilt from a snapshot."""
+        self.turns = totals.get('turns', 0)
+        self.prompt_tokens = totals.get('prompt_tokens', 0)
+        self.output_tokens = totals.get('output_tokens', 0)
+        self.total_tokens = totals.get('total_tokens', 0)
+
+
+class ChatSessionStore:
+    """
+    Thread-safe LRU of RefinementSessions with idle eviction.
+    """
+
+    def __init__(self, max_sessions: int, idle_seconds: float,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._clock = clock
+        self._sessions: "OrderedDict[Any, RefinementSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def get(self, key) -> Optional[RefinementSession]:
+        """
+        Return the live session for `key` (marking it as recently used),
+        or None if there is none or it has gone idle.
+        """
+        now = self._clock()
+        with self._lock:
+            self._evict_idle(now)
+            session = self._sessions.get(key)
+            if session is None:
+                return None
+            session.last_used = now
+            self._sessions.move_to_end(key)
+            return session
+
+    def get_or_create(self, key, is_current: Callable[[RefinementSession], bool],
+                      create: Callable[[], RefinementSession]) -> Tuple[RefinementSession, bool]:
+        """
+        Return the live session for `key`, replacing it with `create()` if
+        there is none or `is_current` rejects it. Both happen under the store
+        lock, so concurrent requests for one itinerary share one session.
+
+        Returns (session, created).
+        """
+        now = self._clock()
+        with self._lock:
+            self._evict_idle(now)
+            session = self._sessions.get(key)
+            created = session is None or not is_current(session)
+            if created:
+                session = create()
+            session.last_used = now
+            self._sessions[key] = session
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session, created
+
+    def put(self, key, session: RefinementSession):
+        """Store a session, evicting the least recently used ones if full."""
+        now = self._clock()
+        with self._lock:
+            session.last_used = now
+            self._sessions[key] = session
+            self._sessions.move_to_end(key)
+            self._evict_idle(now)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def pop(self, key) -> Optional[RefinementSession]:
+        with self._lock:
+            return self._sessions.pop(key, None)
+
+    def _evict_idle(self, now: float):
+        # Sessions are kept in last-used order, so the idle ones are at the front.
+        while self._sessions:
+            key, oldest = next(iter(self._sessions.items()))
+            if now - oldest.last_used <= self.idle_seconds:
+                break
+            del self._sessions[key]
+
+
+def _snapshot_key(itinerary_id, itinerary_version) -> str:
+    return f"chat-session:{itinerary_id}:{itinerary_version.isoformat()}"
+
+
+def save_snapshot(itinerary_id, session: RefinementSession, history: List[Dict[str, str]]):
+    """
+    Share a session's history and token totals with the other workers.
+
+    The key includes `session.itinerary_version`, so an itinerary edited
+    outside the chat simply has no snapshot for its new version.
+    """
+    cache.set(
+        _snapshot_key(itinerary_id, session.itinerary_version),
+        {'owner_id': session.owner_id, 'history': history, 'totals': session.totals()},
+        timeout=settings.CHAT_SESSION_IDLE_SECONDS,
+    )
+
+
+def load_snapshot(itinerary_id, itinerary_version) -> Optional[Dict[str, Any]]:
+    """Return the shared snapshot for this version of the itinerary, or None."""
+    return cache.get(_snapshot_key(itinerary_id, itinerary_version))
+
+
+def drop_snapshot(itinerary_id, itinerary_version):
+    cache.delete(_snapshot_key(itinerary_id, itinerary_version))
+
+
+_store: Optional[ChatSessionStore] = None
+_store_lock = threading.Lock()
+
+
+def get_session_store() -> ChatSessionStore:
+    """Return the process-wide session store, creating it from settings."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ChatSessionStore(
+                    max_sessions=settings.CHAT_SESSION_MAX,
+                    idle_seconds=settings.CHAT_SESSION_IDLE_SECONDS,
+                )
+    return _store
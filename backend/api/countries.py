@@ -0,0 +1,141 @@
+"""
+Per-country travel ratings from static/countryratings.json, served from an
+in-memory index instead of the whole 400 KB file.
+
+The index is built once per worker on first use (ratings_index() is
+lru_cached): every country is keyed by its ISO 3166 alpha-2 code and by its
+normalised name, and its JSON is encoded and gzipped up front, so a request
+is two dict lookups and a write of ~1 KB of bytes. The files only change
+with a deploy, which restarts the workers.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+
+STATIC_DIR = Path(__file__).resolve().parent / 'static'
+RATINGS_PATH = STATIC_DIR / 'countryratings.json'
+CODES_PATH = STATIC_DIR / 'country_code.json'
+
+logger = logging.getLogger(__name__)
+
+# Most keys one bulk request may ask for (there are 249 countries)
+MAX_BULK_KEYS = 250
+
+# Ratings names that country_code.json spells differently
+CODE_ALIASES = {
+    'Cabo Verde': 'CV',
+    'Holy See': 'VA',
+    'North Macedonia': 'MK',
+    'Türkiye': 'TR',
+    'United Kingdom of Great Britain and Northern Ireland': 'GB',
+    'United States of America': 'US',
+}
+
+
+def normalise_name(name):
+    """
+    Name key that ignores case, accents, punctuation and word order:
+    'Bolivia (Plurinational State of)' and 'Bolivia, Plurinational State of'
+    are the same country, as are "Côte d’Ivoire" and "cote d'ivoire".
+    """
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode().lower()
+    name = re.sub(r"['’]", '', name.replace('&', ' and '))
+    return ' '.join(sorted(set(re.findall(r'[a-z0-9]+', name))))
+
+
+@dataclass
+class EncodedBody:
+    """A JSON response body, plain and gzipped, with an ETag for each."""
+    raw: bytes
+    gzipped: bytes
+    etag: str
+
+    @classmethod
+    def of(cls, payload, compresslevel=9):
+        raw = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        gzipped = gzip.compress(raw, compresslevel=compresslevel, mtime=0)
+        return cls(raw, gzipped, hashlib.sha256(raw).hexdigest()[:20])
+
+
+@dataclass
+class RatingsIndex:
+    countries: List[Dict]
+    by_code: Dict[str, Dict] = field(default_factory=dict)
+    by_name: Dict[str, Dict] = field(default_factory=dict)
+    bodies: Dict[str, EncodedBody] = field(default_factory=dict)  # by code
+    all_body: Optional[EncodedBody] = None
+
+    def find(self, key) -> Optional[Dict]:
+        """A country by ISO alpha-2 code or by name."""
+        key = (key or '').strip()
+        return self.by_code.get(key.upper()) or self.by_name.get(normalise_name(key))
+
+
+def build_ratings_index(ratings_path=RATINGS_PATH, codes_path=CODES_PATH) -> RatingsIndex:
+    ratings = json.loads(Path(ratings_path).read_text(encoding='utf-8'))
+    code_names = json.loads(Path(codes_path).read_text(encoding='utf-8'))
+    codes = {normalise_name(entry['Name']): entry['Code'] for entry in code_names}
+
+    index = RatingsIndex(countries=[])
+    for entry in ratings:
+        name = entry['destination_name']
+        code = CODE_ALIASES.get(name) or codes.get(normalise_name(name))
+        if code is None:
+            logger.warning("Country ratings: no ISO code for %r, only reachable by name", name)
+        # Same fields as the file, so clients reading it need no changes
+        country = {'code': code, **entry}
+        index.countries.append(country)
+        index.by_name[normalise_name(name)] = country
+        if code:
+            index.by_code[code] = country
+            index.bodies[code] = EncodedBody.of(country)
+
+    # country_code.json's spelling finds the country too ("United States", "Turkey")
+    for entry in code_names:
+        country = index.by_code.get(entry['Code'])
+        if country is not None:
+            index.by_name.setdefault(normalise_name(entry['Name']), country)
+
+    index.all_body = EncodedBody.of({"countries": index.countries, "missing": []})
+    return index
+
+
+@lru_cache(maxsize=None)
+def ratings_index() -> RatingsIndex:
+    """The index of this worker, built on first use."""
+    return build_ratings_index()
+
+
+def country_body(key) -> Optional[EncodedBody]:
+    """The precomputed body for one country (by code or name), or None."""
+    index = ratings_index()
+    country = index.find(key)
+    if country is None:
+        return None
+    if country['code']:
+        return index.bodies[country['code']]
+    return EncodedBody.of(country)
+
+
+def countries_body(keys=None) -> EncodedBody:
+    """{"countries": [...], "missing": [keys not found]} for `keys`, or every country."""
+    index = ratings_index()
+    if not keys:
+        return index.all_body
+    countries, missing, seen = [], [], set()
+    for key in keys:
+        country = index.find(key)
+        if country is None:
+            missing.append(key)
+        elif id(country) not in seen:
+            seen.add(id(country))
+            countries.append(country)
+    # Built per request: a faster compression level
+    return EncodedBody.of({"countries": countries, "missing": missing}, compresslevel=6)
@@ -0,0 +1,70 @@
+"""
+Streaming exports of a group's ledger.
+
+Rows come straight from a single joined query iterated in chunks, and are
+encoded a chunk at a time, so memory stays flat however long the history is.
+"""
+import csv
+import json
+
+from .models import ExpenseSplit
+
+# Amounts are in the group's currency; the original_* columns are in `currency`
+EXPORT_COLUMNS = [
+    'expense_id', 'date', 'description', 'total_amount', 'split_type',
+    'payer_id', 'payer_username', 'user_owed_id', 'user_owed_username', 'amount_owed',
+    'currency', 'fx_rate', 'original_total', 'original_amount_owed',
+]
+
+# Source field for each column, in the same order
+_FIELDS = [
+    'expense_id', 'expense__date', 'expense__description', 'expense__total_amount', 'expense__split_type',
+    'expense__payer_id', 'expense__payer__username', 'user_owed_id', 'user_owed__username', 'amount_owed',
+    'expense__currency', 'expense__fx_rate', 'expense__original_amount', 'original_amount',
+]
+
+
+def ledger_rows(group, chunk_size=2000):
+    """
+    Yield one tuple per ExpenseSplit of the group (in EXPORT_COLUMNS order),
+    oldest expense first. The expense columns repeat on each of its splits.
+    """
+    queryset = ExpenseSplit.objects.filter(expense__group=group).order_by(
+        'expense__date', 'expense_id', 'id'
+    ).values_list(*_FIELDS)
+
+    for row in queryset.iterator(chunk_size=chunk_size):
+        yield (row[0], row[1].isoformat(), *row[2:])
+
+
+class _Echo:
+    """File-like object whose write() just returns the line, for csv.writer."""
+    def write(self, value):
+        return value
+
+
+def _batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_csv(rows, batch_size=500):
+    """Encode rows as CSV (with a header), `batch_size` rows per chunk."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for batch in _batched(rows, batch_size):
+        yield ''.join(writer.writerow(row) for row in batch)
+
+
+def stream_ndjson(rows, batch_size=500):
+    """Encode rows as newline-delimited JSON objects, `batch_size` rows per chunk."""
+    for batch in _batched(rows, batch_size):
+        yield ''.join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=str) + '\n' for row in batch
+        )
@@ -0,0 +1,232 @@
+"""
+Foreign-exchange rates for receipt conversion.
+
+Rates are fetched from fxratesapi (through the GenAI transport, so record /
+replay / fake modes work) and kept in three layers:
+- in-process: the current rates, used without any I/O while fresh;
+- shared: Django's default cache, a database table every worker reads
+  (CACHES in settings), so workers share one fetch per TTL;
+- snapshot: a JSON file with the last known good rates, used when the
+  API is unreachable and after restarts.
+
+Requests never wait on the network once any rates are known: stale rates
+are served while a background thread refreshes them. Only a cold start
+with no snapshot has to fetch synchronously.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .genaifakes import fake_fx_payload
+from .genaitransport import get_transport
+
+CACHE_KEY = 'fx:rates'
+
+logger = logging.getLogger(__name__)
+
+
+class FXUnavailable(RuntimeError):
+    """No rates could be fetched and none are stored."""
+
+
+class FXService:
+    """
+    Thread-safe FX rate store with TTL, shared cache, snapshot fallback and
+    background refresh.
+    """
+
+    def __init__(self, url: str, ttl_seconds: float, snapshot_path: Optional[str],
+                 timeout: float = 5.0, clock=time.time):
+        self.url = url
+        self.ttl_seconds = ttl_seconds
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self.timeout = timeout
+        self.clock = clock
+
+        # {'base': 'USD', 'rates': {...}, 'fetched_at': epoch seconds}
+        self._rates: Optional[Dict] = None
+        self._lock = threading.Lock()
+        # Held by the background refresh thread while it runs
+        self._refreshing = threading.Lock()
+        self._session = requests.Session()
+
+    # --- FETCHING ---
+
+    def _fetch(self) -> Dict:
+        payload = get_transport().call(
+            'fx', {"url": self.url},
+            live=lambda: self._session.get(self.url, timeout=self.timeout).json(),
+            fake=fake_fx_payload
+        )
+        rates = payload.get('rates') if isinstance(payload, dict) else None
+        if not rates:
+            raise FXUnavailable(f"FX API returned no rates: {str(payload)[:200]}")
+        return {'base': payload.get('base', 'USD'), 'rates': rates, 'fetched_at': self.clock()}
+
+    def refresh(self) -> Dict:
+        """Fetch new rates now and store them in every layer."""
+        snapshot = self._fetch()
+        with self._lock:
+            self._rates = snapshot
+        cache.set(CACHE_KEY, snapshot, timeout=None)
+        self._write_snapshot(snapshot)
+        return snapshot
+
+    def refresh_in_background(self):
+        """Start one background refresh unless one is already running."""
+        if not self._refreshing.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                # Keep serving the previous rates
+                logger.warning("FX refresh failed: %s", e)
+            finally:
+                # The shared cache is a database table: release this thread's connection
+                connection.close()
+                self._refreshing.release()
+
+        try:
+            threading.Thread(target=run, name='fx-refresh', daemon=True).start()
+        except RuntimeError:
+            self._refreshing.release()
+            raise
+
+    def prefetch(self):
+        """
+        Make sure fresh rates will be ready soon, without waiting.
+        Called at the start of a receipt request so any fetch overlaps the OCR call.
+        """
+        if not self._is_fresh(self._current()):
+            self.refresh_in_background()
+
+    # --- SNAPSHOT ---
+
+    def _write_snapshot(self, snapshot: Dict):
+        if not self.snapshot_path:
+            return
+        try:
+            self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.snapshot_path.parent, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp, self.snapshot_path)
+        except OSError as e:
+            logger.warning("Could not write FX snapshot: %s", e)
+
+    def _read_snapshot(self) -> Optional[Dict]:
+        if not self.snapshot_path or not self.snapshot_path.exists():
+            return None
+        try:
+            return json.loads(self.snapshot_path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    # --- READING ---
+
+    def _is_fresh(self, snapshot: Optional[Dict]) -> bool:
+        return bool(snapshot) and self.clock() - snapshot['fetched_at'] < self.ttl_seconds
+
+    def _current(self) -> Optional[Dict]:
+        """The newest rates known without touching the network."""
+        with self._lock:
+            local = self._rates
+        if self._is_fresh(local):
+            return local
+
+        # Another worker may have refreshed already
+        shared = cache.get(CACHE_KEY)
+        if shared and (not local or shared['fetched_at'] > local['fetched_at']):
+            local = shared
+        if not local:
+            local = self._read_snapshot()
+        if local:
+            with self._lock:
+                if not self._rates or local['fetched_at'] > self._rates['fetched_at']:
+                    self._rates = local
+        return local
+
+    def get_rates(self) -> Dict:
+        """
+        Current rates: {'base', 'rates', 'fetched_at', 'stale'}.
+        Stale rates are returned immediately and refreshed in the background.
+        """
+        snapshot = self._current()
+        if snapshot is None:
+            # Cold start with nothing stored: this one time we have to wait
+            try:
+                snapshot = self.refresh()
+            except Exception as e:
+                raise FXUnavailable(f"No FX rates available: {e}")
+        elif not self._is_fresh(snapshot):
+            self.refresh_in_background()
+        return {**snapshot, 'stale': not self._is_fresh(snapshot)}
+
+    def rate(self, source: str, target: str) -> float:
+        """Units of `target` per one unit of `source`."""
+        source, target = source.upper(), target.upper()
+        if source == target:
+            return 1.0
+        rates = self.get_rates()['rates']
+        if not rates.get(source) or not rates.get(target):
+            raise FXUnavailable(f"No exchange rate between {source} and {target}.")
+        return rates[target] / rates[source]
+
+    def convert_many(self, amounts: Iterable[Tuple[float, str]], target: str = 'CAD') -> List[Optional[float]]:
+        """
+        Convert many (amount, currency) pairs to `target` in one pass.
+        Each currency's factor is computed once; unknown currencies give None.
+        """
+        rates = self.get_rates()['rates']
+        target_rate = rates.get(target)
+        if not target_rate:
+            raise FXUnavailable(f"No rate for target currency {target}.")
+
+        factors = {}
+        converted = []
+        for amount, currency in amounts:
+            currency = (currency or '').upper()
+            if currency not in factors:
+                rate = rates.get(currency)
+                factors[currency] = target_rate / rate if rate else None
+            factor = factors[currency]
+            converted.append(round(amount * factor, 2) if factor is not None else None)
+        return converted
+
+
+_service: Optional[FXService] = None
+_service_lock = threading.Lock()
+
+
+def get_fx_service() -> FXService:
+    """Return the process-wide FX service, created from settings."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = FXService(
+                    url=settings.FX_RATES_URL,
+                    ttl_seconds=settings.FX_CACHE_SECONDS,
+                    snapshot_path=settings.FX_SNAPSHOT_PATH,
+                    timeout=settings.FX_TIMEOUT_SECONDS,
+                )
+    return _service
+
+
+def set_fx_service(service: Optional[FXService]):
+    """Replace the process-wide FX service (None re-reads the settings)."""
+    global _service
+    with _service_lock:
+        _service = service
@@ -0,0 +1,210 @@
+"""
+Plausible offline stand-ins for Gemini and fxratesapi responses.
+
+Used by the 'fake' transport mode (see genaitransport.py). Every generator
+is seeded from its input, so the same request always gets the same answer.
+Payloads have the same shape as the ones the live calls record.
+"""
+import hashlib
+import json
+import random
+import re
+from typing import Any, Dict, List
+
+ACTIVITY_NAMES = [
+    "Old Town Walking Tour", "City Art Museum", "Central Market Food Hall",
+    "Harbourfront Boardwalk", "Botanical Gardens", "Historic Cathedral",
+    "Riverside Park", "Observation Tower", "Night Market", "Local Brewery",
+    "Science Centre", "Waterfront Seafood Grill",
+]
+
+TRANSPORT_TYPES = ["walk", "metro", "bus", "taxi", "tram"]
+
+RECEIPT_ITEMS = [
+    ("Margherita Pizza", 16.0), ("Caesar Salad", 11.5), ("Craft Beer", 8.0),
+    ("Sparkling Water", 3.5), ("Pad Thai", 14.25), ("Green Tea", 2.75),
+    ("Ramen", 13.0), ("Gyoza (6 pcs)", 7.5), ("House Red Wine", 10.0),
+    ("Tiramisu", 8.5), ("Espresso", 3.25), ("Fish and Chips", 17.0),
+]
+
+# Rough rates against USD, enough for conversions to look realistic
+FX_RATES = {
+    "USD": 1.0, "CAD": 1.37, "EUR": 0.92, "GBP": 0.79, "JPY": 150.2,
+    "CNY": 7.24, "KRW": 1370.0, "MXN": 17.1, "AUD": 1.52, "INR": 83.3,
+}
+
+RECEIPT_CURRENCY_SCALE = {"JPY": 100, "KRW": 1000, "INR": 50, "MXN": 15, "CNY": 6}
+
+
+def _rng(*parts: Any) -> random.Random:
+    """Random generator seeded from the given values (stable across runs)."""
+    seed = hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return random.Random(int(seed[:16], 16))
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _usage(prompt: str, output: str) -> Dict[str, int]:
+    prompt_tokens = _estimate_tokens(prompt)
+    output_tokens = _estimate_tokens(output)
+    return {
+        'prompt_token_count': prompt_tokens,
+        'candidates_token_count': output_tokens,
+        'total_token_count': prompt_tokens + output_tokens,
+    }
+
+
+def fake_from_schema(schema: Dict[str, Any], rng: random.Random) -> Any:
+    """
+    Build a value matching a (Gemini-style) JSON schema.
+
+    Supports the subset used in this repo: object, array, string (with enum),
+    integer (with minimum/maximum), number and boolean.
+    """
+    schema_type = schema.get('type')
+
+    if 'enum' in schema:
+        return rng.choice(schema['enum'])
+    if schema_type == 'object':
+        return {
+            name: fake_from_schema(prop, rng)
+            for name, prop in schema.get('properties', {}).items()
+        }
+    if schema_type == 'array':
+        return [fake_from_schema(schema.get('items', {}), rng) for _ in range(rng.randint(1, 3))]
+    if schema_type == 'integer':
+        return rng.randint(schema.get('minimum', 0), schema.get('maximum', 100))
+    if schema_type == 'number':
+        return round(rng.uniform(schema.get('minimum', 0), schema.get('maximum', 100)), 2)
+    if schema_type == 'boolean':
+        return rng.random() < 0.5
+    return schema.get('description', 'Lorem ipsum').split('.')[0][:80]
+
+
+# Longest trip a fake itinerary answers with; like a real model, it won't plan a 90-day trip
+MAX_TRIP_DAYS = 14
+
+
+def _trip_days(trip_length: Any, max_days: int = MAX_TRIP_DAYS) -> int:
+    match = re.search(r'\d+', str(trip_length))
+    return max(1, min(int(match.group()) if match else 1, max_days))
+
+
+def fake_itinerary(preferences: Dict[str, Any], max_days: int = MAX_TRIP_DAYS) -> Dict[str, Any]:
+    """
+    Build an itinerary with the structure requested by build_itinerary_prompt(),
+    including transport segments whose coordinates chain correctly.
+    Trips are capped at `max_days` (scale-data generation raises the cap).
+    """
+    rng = _rng('itinerary', preferences)
+    destination = preferences.get('destination', 'Somewhere')
+    origin = preferences.get('currentLocation') or {'latitude': 43.0, 'longitude': -79.0}
+    center_lat = float(origin.get('latitude', 43.0)) + rng.uniform(-0.2, 0.2)
+    center_lng = float(origin.get('longitude', -79.0)) + rng.uniform(-0.2, 0.2)
+
+    daily_plan = []
+    for day in range(1, _trip_days(preferences.get('tripLength'), max_days) + 1):
+        activities = []
+        prev = None
+        for name in rng.sample(ACTIVITY_NAMES, 3):
+            coords = {
+                'latitude': round(center_lat + rng.uniform(-0.05, 0.05), 5),
+                'longitude': round(center_lng + rng.uniform(-0.05, 0.05), 5),
+            }
+            if prev is not None:
+                transport_type = rng.choice(TRANSPORT_TYPES)
+                activities.append({
+                    'type': 'transport',
+                    'transportationType': transport_type,
+                    'startPoint': prev['name'],
+                    'endPoint': f"{name}, {destination}",
+                    'startCoordinates': prev['coordinates'],
+                    'endCoordinates': coords,
+                    'duration': round(rng.uniform(0.1, 0.75), 2),
+                    'price': 0 if transport_type == 'walk' else rng.randint(3, 25),
+                    'description': f"{transport_type.title()} to {name}",
+                })
+            activity = {
+                'duration': round(rng.uniform(1.0, 3.0), 1),
+                'description': f"Spend some time at {name}.",
+                'name': f"{name}, {destination}",
+                'coordinates': coords,
+                'price': rng.randint(0, 60),
+                'bookingLink': None,
+            }
+            activities.append(activity)
+            prev = activity
+        daily_plan.append({'day': day, 'activities': activities})
+
+    return {
+        'tripTitle': f"Discovering {destination}",
+        'summary': f"A {len(daily_plan)}-day trip through the highlights of {destination}.",
+        'flightInfo': None,
+        'dailyPlan': daily_plan,
+    }
+
+
+def fake_itinerary_payload(preferences: Dict[str, Any], prompt: str = '') -> Dict[str, Any]:
+    """Payload for the 'itinerary' call kind."""
+    text = json.dumps(fake_itinerary(preferences))
+    return {'text': text, 'groundingChunks': [], 'usage': _usage(prompt, text)}
+
+
+def fake_refinement_payload(system_instruction: str, history: List[Dict[str, str]],
+                            message: str) -> Dict[str, Any]:
+    """
+    Payload for the 'refine' call kind: the latest itinerary with the request
+    noted in its summary. Budget requests lower the activity prices.
+    """
+    from .genaiitinerary import extract_and_parse_json
+
+    source = history[-1]['reply'] if history else system_instruction
+    itinerary = extract_and_parse_json(source)
+
+    if re.search(r'cheap|budget|less expensive', message, re.IGNORECASE):
+        for day_plan in itinerary.get('dailyPlan', []):
+            for activity in day_plan.get('activities', []):
+                if isinstance(activity.get('price'), (int, float)):
+                    activity['price'] = int(activity['price'] * 0.7)
+    itinerary['summary'] = f"{itinerary.get('summary', '')} (Refined: {message})".strip()
+
+    text = json.dumps(itinerary)
+    return {'text': text, 'usage': _usage(message, text)}
+
+
+def fake_rating_payload(destination: str, schema: Dict[str, Any],
+                        fenced: bool = True) -> Dict[str, Any]:
+    """
+    Payload for the 'ratings' call kind, following TRAVEL_RATING_SCHEMA.
+    `fenced` wraps the JSON in a markdown block like the grounded prompt asks.
+    """
+    rating = fake_from_schema(schema, _rng('ratings', destination))
+    rating['destination_name'] = destination
+    text = json.dumps(rating, indent=2)
+    if fenced:
+        text = f"```json\n{text}\n```"
+    return {'text': text, 'attributions': []}
+
+
+def fake_receipt_payload(image_digest: str) -> Dict[str, Any]:
+    """Payload for the 'receipt' call kind, following the Receipt schema."""
+    rng = _rng('receipt', image_digest)
+    currency = rng.choice(['CAD', 'CAD', 'USD', 'EUR', 'JPY'])
+    scale = RECEIPT_CURRENCY_SCALE.get(currency, 1)
+    items = []
+    for name, price in rng.sample(RECEIPT_ITEMS, rng.randint(2, 6)):
+        local_price = round(price * scale * rng.uniform(0.9, 1.1), 2)
+        items.append({
+            'item_en': name,
+            'price': local_price,
+            'currency': currency,
+            'price_in_cad': local_price,
+        })
+    return {'text': json.dumps({'items': items})}
+
+
+def fake_fx_payload() -> Dict[str, Any]:
+    """Payload for the 'fx' call kind, shaped like fxratesapi's /latest."""
+    return {'success': True, 'base': 'USD', 'rates': dict(FX_RATES)}
@@ -7,13 +7,24 @@ from dotenv import load_dotenv
 from google import genai
 from google.genai import types
 
+try:
+    from .genaitransport import TransportChat, get_transport
+    from .genaifakes import fake_itinerary_payload, fake_refinement_payload
+except ImportError:
+    # Run as a standalone script (python api/genaiitinerary.py)
+    from genaitransport import TransportChat, get_transport
+    from genaifakes import fake_itinerary_payload, fake_refinement_payload
+
 # Type definitions (you'll need to define these based on your types module)
 # from types import TravelPreferences, Itinerary, Geolocation, GroundingChunk
 load_dotenv()
-if not os.getenv("GEMINI_API_KEY"):
+# Replay/fake transports never reach Gemini, so they can run without a key
+if get_transport().offline:
+    client = None
+elif not os.getenv("GEMINI_API_KEY"):
     raise ValueError("GEMINI_API_KEY environment variable not set")
-
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+else:
+    client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
 
 
 def build_itinerary_prompt(preferences: Dict[str, Any]) -> str:
@@ -242,60 +253,17 @@ def validate_itinerary(itinerary: Dict[str, Any]) -> bool:
     return True
 
 
-def generate_itinerary(
-        preferences: Dict[str, Any],
-        location: Optional[Dict[str, float]] = None
-) -> Dict[str, Any]:
+def _extract_grounding_chunks(response) -> List[Dict[str, Any]]:
     """
-    Generate a travel itinerary based on preferences.
+    Extract grounding chunks from a response and convert them to
+    JSON-serializable dictionaries.
 
     Args:
-        preferences: Dictionary with destination, currentLocation, tripLength, budget
-        location: Optional dictionary with 'latitude' and 'longitude' keys
+        response: The GenerateContentResponse from Gemini
 
     Returns:
-        Dictionary with 'itinerary' and 'groundingChunks' keys
-        The itinerary JSON will use double quotes for proper parsing
+        List of source dictionaries (web, maps or search snippets)
     """
-    prompt = build_itinerary_prompt(preferences)
-
-    # Build tools configuration
-    tools = [
-        types.Tool(google_search=types.GoogleSearch()),
-        types.Tool(google_maps=types.GoogleMaps())
-    ]
-
-    # Build tool config with location if provided
-    tool_config = None
-    if location:
-        tool_config = types.ToolConfig(
-            retrieval_config=types.RetrievalConfig(
-                lat_lng=types.LatLng(
-                    latitude=location['latitude'],
-                    longitude=location['longitude']
-                )
-            )
-        )
-
-    # Generate content
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=prompt,
-        config=types.GenerateContentConfig(
-            tools=tools,
-            tool_config=tool_config
-        )
-    )
-
-    itinerary = extract_and_parse_json(response.text)
-
-    # Validate the itinerary structure
-    try:
-        validate_itinerary(itinerary)
-    except ValueError as e:
-        print(f"Warning: Itinerary validation failed: {e}")
-
-    # Extract grounding chunks and convert to JSON-serializable format
     grounding_chunks = []
     if response.candidates and len(response.candidates) > 0:
         candidate = response.candidates[0]
@@ -336,6 +304,77 @@ def generate_itinerary(
                 if chunk_dict and any(chunk_dict.get(k) for k in ['uri', 'title', 'text']):
                     grounding_chunks.append(chunk_dict)
 
+    return grounding_chunks
+
+
+def generate_itinerary(
+        preferences: Dict[str, Any],
+        location: Optional[Dict[str, float]] = None
+) -> Dict[str, Any]:
+    """
+    Generate a travel itinerary based on preferences.
+
+    Args:
+        preferences: Dictionary with destination, currentLocation, tripLength, budget
+        location: Optional dictionary with 'latitude' and 'longitude' keys
+
+    Returns:
+        Dictionary with 'itinerary' and 'groundingChunks' keys
+        The itinerary JSON will use double quotes for proper parsing
+    """
+    prompt = build_itinerary_prompt(preferences)
+
+    # Build tools configuration
+    tools = [
+        types.Tool(google_search=types.GoogleSearch()),
+        types.Tool(google_maps=types.GoogleMaps())
+    ]
+
+    # Build tool config with location if provided
+    tool_config = None
+    if location:
+        tool_config = types.ToolConfig(
+            retrieval_config=types.RetrievalConfig(
+                lat_lng=types.LatLng(
+                    latitude=location['latitude'],
+                    longitude=location['longitude']
+                )
+            )
+        )
+
+    def _call_gemini():
+        response = client.models.generate_content(
+            model="gemini-2.5-flash",
+            contents=prompt,
+            config=types.GenerateContentConfig(
+                tools=tools,
+                tool_config=tool_config
+            )
+        )
+        return {
+            'text': response.text,
+            'groundingChunks': _extract_grounding_chunks(response),
+            'usage': _usage_to_dict(response.usage_metadata)
+        }
+
+    # Generate content (through the transport, so it can be recorded/replayed)
+    payload = get_transport().call(
+        'itinerary',
+        {'model': 'gemini-2.5-flash', 'prompt': prompt, 'location': location},
+        live=_call_gemini,
+        fake=lambda: fake_itinerary_payload(preferences, prompt)
+    )
+
+    itinerary = extract_and_parse_json(payload['text'])
+
+    # Validate the itinerary structure
+    try:
+        validate_itinerary(itinerary)
+    except ValueError as e:
+        print(f"Warning: Itinerary validation failed: {e}")
+
+    grounding_chunks = payload.get('groundingChunks', [])
+
     # Ensure the returned itinerary is properly formatted with double quotes
     # By re-serializing with json.dumps and ensure_ascii=False
     itinerary_json_str = json.dumps(itinerary, ensure_ascii=False, indent=2)
@@ -347,24 +386,133 @@ def generate_itinerary(
     }
 
 
-def start_chat(initial_context: str):
+def start_chat(initial_context: str, history: Optional[List[Dict[str, str]]] = None):
     """
     Start a chat session with the given initial context.
 
     Args:
         initial_context: System instruction for the chat
+        history: Earlier turns ({'message', 'reply'}) to continue from,
+            as returned by chat_history()
 
     Returns:
         Chat session object
     """
-    return client.chats.create(
-        model='gemini-2.5-flash',
-        config=types.GenerateContentConfig(
-            system_instruction=initial_context
+    transport = get_transport()
+    history = history or []
+
+    live_chat = None
+    if not transport.offline:
+        live_chat = client.chats.create(
+            model='gemini-2.5-flash',
+            config=types.GenerateContentConfig(
+                system_instruction=initial_context
+            ),
+            history=[
+                types.Content(role=role, parts=[types.Part(text=text)])
+                for turn in history
+                for role, text in (('user', turn['message']), ('model', turn['reply']))
+            ]
         )
+
+    if transport.mode == 'live':
+        return live_chat
+
+    # Record/replay/fake: route each message through the transport
+    return TransportChat(
+        transport, initial_context,
+        live_chat=live_chat,
+        fake_reply=fake_refinement_payload,
+        history=history
     )
 
 
+def chat_history(chat) -> List[Dict[str, str]]:
+    """
+    The turns of a chat session as plain {'message', 'reply'} dicts, so they
+    can be cached and passed back to start_chat() in another process.
+    """
+    if isinstance(chat, TransportChat):
+        return list(chat.history)
+
+    turns = []
+    for content in chat.get_history():
+        text = ''.join(part.text for part in content.parts or [] if part.text and not part.thought)
+        if content.role == 'user':
+            turns.append({'message': text, 'reply': ''})
+        elif turns:
+            turns[-1]['reply'] += text
+    return turns
+
+
+def build_refinement_context(itinerary: Dict[str, Any]) -> str:
+    """
+    Build the system instruction for a refinement chat session.
+
+    The full itinerary is sent once here; follow-up messages in the same
+    session only carry the user's change request.
+
+    Args:
+        itinerary: The current itinerary dictionary
+    """
+    itinerary_json = json.dumps(itinerary, ensure_ascii=False)
+    return f"""
+    You are an expert travel planner helping a traveller refine an existing itinerary.
+
+    The current itinerary is:
+    {itinerary_json}
+
+    The traveller will send change requests such as "make day 2 cheaper" or
+    "swap the museum for something outdoors". For EVERY request:
+    1. Apply the change to the most recent version of the itinerary, keeping everything else as-is.
+    2. Respond with the COMPLETE updated itinerary as a single, valid JSON object with the same structure.
+    3. Keep the transport segment rules: a transport segment between every activity, with "type": "transport".
+    4. USE DOUBLE QUOTES FOR ALL JSON STRINGS and do not include any text before or after the JSON object.
+  """
+
+
+def _usage_to_dict(usage_metadata) -> Dict[str, int]:
+    """
+    Convert a response's usage metadata into plain token counts.
+    """
+    if not usage_metadata:
+        return {'prompt_tokens': 0, 'output_tokens': 0, 'total_tokens': 0}
+
+    return {
+        'prompt_tokens': getattr(usage_metadata, 'prompt_token_count', None) or 0,
+        'output_tokens': getattr(usage_metadata, 'candidates_token_count', None) or 0,
+        'total_tokens': getattr(usage_metadata, 'total_token_count', None) or 0,
+    }
+
+
+def refine_itinerary(chat, message: str) -> Dict[str, Any]:
+    """
+    Send one refinement request through an existing chat session.
+
+    Args:
+        chat: Chat session created by start_chat()
+        message: The traveller's change request
+
+    Returns:
+        Dictionary with the updated 'itinerary', its 'itineraryJson' string
+        and the token 'usage' of this refinement
+    """
+    response = chat.send_message(message)
+
+    itinerary = extract_and_parse_json(response.text)
+
+    try:
+        validate_itinerary(itinerary)
+    except ValueError as e:
+        print(f"Warning: Refined itinerary validation failed: {e}")
+
+    return {
+        'itinerary': itinerary,
+        'itineraryJson': json.dumps(itinerary, ensure_ascii=False, indent=2),
+        'usage': _usage_to_dict(response.usage_metadata)
+    }
+
+
 def calculate_total_transport_cost(itinerary: Dict[str, Any]) -> Dict[str, Any]:
     """
     Calculate total transportation costs and breakdown by type.
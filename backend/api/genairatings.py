@@ -6,6 +6,14 @@ from dotenv import load_dotenv
 from google import genai
 from google.genai import types
 
+try:
+    from .genaitransport import get_transport
+    from .genaifakes import fake_rating_payload
+except ImportError:
+    # Run as a standalone script (python api/genairatings.py)
+    from genaitransport import get_transport
+    from genaifakes import fake_rating_payload
+
 # --- 1. SCHEMAS (Updated ITINERARY_SCHEMA to match user's request) ---
 
 ITINERARY_SCHEMA = {
@@ -350,15 +358,20 @@ def get_travel_ratings_list(destinations: list[str], location: dict = None):
     Generates structured travel ratings for multiple destinations using
     flexible text output (JSON in markdown) to encourage grounding.
     """
-    if not os.getenv("GEMINI_API_KEY"):
-        print("FATAL ERROR: GEMINI_API_KEY environment variable not found. Cannot run API call.")
-        return []
+    transport = get_transport()
+    client = None
 
-    try:
-        client = genai.Client()
-    except Exception as e:
-        print(f"Error initializing Gemini client: {e}")
-        return []
+    # Replay/fake transports never reach Gemini, so they need no key or client
+    if not transport.offline:
+        if not os.getenv("GEMINI_API_KEY"):
+            print("FATAL ERROR: GEMINI_API_KEY environment variable not found. Cannot run API call.")
+            return []
+
+        try:
+            client = genai.Client()
+        except Exception as e:
+            print(f"Error initializing Gemini client: {e}")
+            return []
 
     all_ratings = []
 
@@ -405,16 +418,28 @@ def get_travel_ratings_list(destinations: list[str], location: dict = None):
 
         print(f"\n--- API Call: Travel Ratings for {destination} (Now using flexible JSON output) ---")
 
-        try:
+        def _call_gemini():
             response = client.models.generate_content(
                 model='gemini-2.5-flash',
                 contents=prompt_text,
                 config=config,
             )
+            return {
+                "text": response.text,
+                "attributions": _extract_attributions(response)
+            }
+
+        try:
+            payload = transport.call(
+                'ratings',
+                {"model": 'gemini-2.5-flash', "prompt": prompt_text, "location": location},
+                live=_call_gemini,
+                fake=lambda: fake_rating_payload(destination, TRAVEL_RATING_SCHEMA)
+            )
 
             # Use the new flexible extractor
-            parsed_json = _extract_and_parse_json(response.text, "Travel Rating")
-            attributions = _extract_attributions(response)
+            parsed_json = _extract_and_parse_json(payload["text"], "Travel Rating")
+            attributions = payload["attributions"]
 
             print(f"\n--- Structured Travel Rating Response (JSON) for {destination} ---")
             print(json.dumps(parsed_json, indent=2))
@@ -443,15 +468,20 @@ def get_travel_ratings(destination: str):
     Args:
         destination: The country or sub-national area to rate.
     """
-    if not os.getenv("GEMINI_API_KEY"):
-        print("FATAL ERROR: GEMINI_API_KEY environment variable not found. Cannot run API call.")
-        return
+    transport = get_transport()
+    client = None
 
-    try:
-        client = genai.Client()
-    except Exception as e:
-        print(f"Error initializing Gemini client: {e}")
-        return
+    # Replay/fake transports never reach Gemini, so they need no key or client
+    if not transport.offline:
+        if not os.getenv("GEMINI_API_KEY"):
+            print("FATAL ERROR: GEMINI_API_KEY environment variable not found. Cannot run API call.")
+            return
+
+        try:
+            client = genai.Client()
+        except Exception as e:
+            print(f"Error initializing Gemini client: {e}")
+            return
 
     # 2. Define the Prompt with all constraints and grounding instructions embedded
     prompt_text = f"""
@@ -483,16 +513,25 @@ def get_travel_ratings(destination: str):
     # print(f"\n--- API Call: Travel Ratings for {destination} ---")
 
     # 6. Make the API call
-    try:
+    def _call_gemini():
         response = client.models.generate_content(
             model='gemini-2.5-flash',
             contents=prompt_text,
             config=config,
         )
+        return {"text": response.text, "attributions": []}
+
+    try:
+        payload = transport.call(
+            'ratings',
+            {"model": 'gemini-2.5-flash', "prompt": prompt_text, "schema": True},
+            live=_call_gemini,
+            fake=lambda: fake_rating_payload(destination, TRAVEL_RATING_SCHEMA, fenced=False)
+        )
 
         # 6. Process and display the structured response
         # print("\n--- Structured Travel Rating Response (JSON) ---")
-        parsed_json = json.loads(response.text)
+        parsed_json = json.loads(payload["text"])
         print(json.dumps(parsed_json, indent=2) + ",")
         # print("------------------------------------------")
 
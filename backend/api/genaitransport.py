@@ -0,0 +1,231 @@
+"""
+Pluggable transport for the external calls made by the backend
+(Gemini generation and the fxratesapi rate fetch).
+
+Every external call goes through `get_transport().call(...)` with a
+JSON-serializable description of the request, a `live` callable that
+performs the real call and returns a JSON-serializable payload, and a
+`fake` callable that builds a plausible payload offline.
+
+Modes (GENAI_TRANSPORT):
+- live:   call the real API (default).
+- record: call the real API and save each payload to the cassette directory.
+- replay: return saved payloads, keyed by a hash of the request, after a
+          synthetic delay. Nothing leaves the machine.
+- fake:   return generated payloads after a synthetic delay. Nothing leaves
+          the machine and no cassettes are needed.
+
+Synthetic latency (GENAI_TRANSPORT_LATENCY_MS) is either one number of
+milliseconds for every call, or per-kind values such as
+"itinerary=8000,receipt=3000,fx=150,default=0". The jitter
+(GENAI_TRANSPORT_JITTER, a fraction of the latency) is derived from the
+request hash, so a replay run is deterministic.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+MODES = ('live', 'record', 'replay', 'fake')
+
+
+class CassetteMissError(LookupError):
+    """Raised in replay mode when no recording exists for a request."""
+
+
+def _setting(name: str, default: str) -> str:
+    """
+    Read a setting from Django settings when configured, else from the
+    environment (the genai modules can also run as standalone scripts).
+    """
+    try:
+        from django.conf import settings
+        if settings.configured:
+            return str(getattr(settings, name, default))
+    except ImportError:
+        pass
+    return os.getenv(name, default)
+
+
+def _parse_latency(spec: str) -> Dict[str, float]:
+    """Parse "250" or "itinerary=8000,fx=150,default=0" into seconds per kind."""
+    latency = {'default': 0.0}
+    for part in str(spec).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '=' in part:
+            kind, ms = part.split('=', 1)
+            latency[kind.strip()] = float(ms) / 1000.0
+        else:
+            latency['default'] = float(part) / 1000.0
+    return latency
+
+
+def request_fingerprint(kind: str, request: Dict[str, Any]) -> str:
+    """Stable hash of a request description, used as the cassette key."""
+    canonical = json.dumps({'kind': kind, 'request': request}, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class GenAITransport:
+    """
+    Routes external calls according to the configured mode.
+    """
+
+    def __init__(self, mode: str = 'live', cassette_dir: str = 'cassettes',
+                 latency: Optional[Dict[str, float]] = None, jitter: float = 0.0,
+                 sleep: Callable[[float], None] = time.sleep):
+        if mode not in MODES:
+            raise ValueError(f"Unknown GENAI_TRANSPORT mode '{mode}'. Expected one of {MODES}.")
+        self.mode = mode
+        self.cassette_dir = Path(cassette_dir)
+        self.latency = latency or {'default': 0.0}
+        self.jitter = jitter
+        self._sleep = sleep
+
+    @property
+    def offline(self) -> bool:
+        """True when no real API calls (and no API keys) are needed."""
+        return self.mode in ('replay', 'fake')
+
+    def call(self, kind: str, request: Dict[str, Any],
+             live: Callable[[], Dict[str, Any]],
+             fake: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Perform (or simulate) one external call and return its payload.
+
+        Args:
+            kind: Call category, e.g. 'itinerary', 'ratings', 'receipt', 'fx'
+            request: JSON-serializable description of the request
+            live: Performs the real call, returns a JSON-serializable payload
+            fake: Builds a plausible payload without any network access
+        """
+        if self.mode == 'live':
+            return live()
+
+        key = request_fingerprint(kind, request)
+
+        if self.mode == 'record':
+            payload = live()
+            self._write(kind, key, request, payload)
+            return payload
+
+        self._simulate_latency(kind, key)
+        if self.mode == 'replay':
+            return self._read(kind, key)
+        return fake()
+
+    def _cassette_path(self, kind: str, key: str) -> Path:
+        return self.cassette_dir / kind / f"{key}.json"
+
+    def _write(self, kind: str, key: str, request: Dict[str, Any], payload: Dict[str, Any]):
+        path = self._cassette_path(kind, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file first so a concurrent replay never sees half a cassette
+        with tempfile.NamedTemporaryFile('w', dir=path.parent, delete=False,
+                                         suffix='.tmp', encoding='utf-8') as tmp:
+            json.dump({'kind': kind, 'request': request, 'response': payload},
+                      tmp, ensure_ascii=False, default=str)
+        os.replace(tmp.name, path)
+
+    def _read(self, kind: str, key: str) -> Dict[str, Any]:
+        path = self._cassette_path(kind, key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)['response']
+        except FileNotFoundError:
+            raise CassetteMissError(
+                f"No recorded '{kind}' response for request {key[:12]} in {self.cassette_dir}. "
+                f"Record it first with GENAI_TRANSPORT=record."
+            )
+
+    def _simulate_latency(self, kind: str, key: str):
+        base = self.latency.get(kind, self.latency.get('default', 0.0))
+        if base <= 0:
+            return
+        # Deterministic jitter in [-jitter, +jitter] derived from the request hash
+        unit = int(key[:8], 16) / 0xFFFFFFFF
+        self._sleep(max(0.0, base * (1 + self.jitter * (2 * unit - 1))))
+
+
+class TransportChat:
+    """
+    Chat session wrapper used when the transport is not 'live'.
+
+    It keeps the system instruction and the conversation so far, so each
+    message can be fingerprinted for record/replay. In record mode the real
+    chat session does the work; in replay and fake modes there is none.
+    """
+
+    def __init__(self, transport: GenAITransport, system_instruction: str,
+                 live_chat=None,
+                 fake_reply: Optional[Callable[[str, List[Dict[str, str]], str], Dict[str, Any]]] = None,
+                 history: Optional[List[Dict[str, str]]] = None):
+        self.transport = transport
+        self.system_instruction = system_instruction
+        self.live_chat = live_chat
+        self.fake_reply = fake_reply
+        self.history: List[Dict[str, str]] = list(history or [])
+
+    def send_message(self, message: str):
+        request = {
+            'system_instruction': self.system_instruction,
+            'history': self.history,
+            'message': message,
+        }
+
+        def _live():
+            response = self.live_chat.send_message(message)
+            usage = response.usage_metadata
+            return {
+                'text': response.text,
+                'usage': {
+                    'prompt_token_count': getattr(usage, 'prompt_token_count', None) or 0,
+                    'candidates_token_count': getattr(usage, 'candidates_token_count', None) or 0,
+                    'total_token_count': getattr(usage, 'total_token_count', None) or 0,
+                },
+            }
+
+        payload = self.transport.call(
+            'refine', request, _live,
+            fake=lambda: self.fake_reply(self.system_instruction, self.history, message)
+        )
+        self.history = self.history + [{'message': message, 'reply': payload['text']}]
+
+        # Same shape as a GenerateContentResponse for the fields callers use
+        return SimpleNamespace(
+            text=payload['text'],
+            usage_metadata=SimpleNamespace(**payload.get('usage', {}))
+        )
+
+
+_transport: Optional[GenAITransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> GenAITransport:
+    """Return the process-wide transport, created from settings/environment."""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = GenAITransport(
+                    mode=_setting('GENAI_TRANSPORT', 'live').strip().lower(),
+                    cassette_dir=_setting('GENAI_CASSETTE_DIR', 'cassettes'),
+                    latency=_parse_latency(_setting('GENAI_TRANSPORT_LATENCY_MS', '0')),
+                    jitter=float(_setting('GENAI_TRANSPORT_JITTER', '0')),
+                )
+    return _transport
+
+
+def set_transport(transport: Optional[GenAITransport]):
+    """Replace the process-wide transport (None re-reads the settings)."""
+    global _transport
+    with _transport_lock:
+        _transport = transport
@@ -0,0 +1,518 @@
+"""
+Ledger calculations shared by the BillGroup endpoints.
+
+Net balances are materialised per (group, member) in GroupBalance as integer
+cents. Every code path that writes expenses or settlements calls the
+record_*() / reverse_*() helpers in the same transaction, so reading balances
+is O(members) instead of re-aggregating the whole history.
+
+compute_net_cents() recomputes balances from the history for the consistency
+checker and rebuilds. It starts from the group's latest BalanceCheckpoint and
+only aggregates what happened after it, so it stays fast for long-lived groups.
+"""
+import decimal
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, Count, F, Max, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import (
+    BalanceCheckpoint, BalanceCheckpointEntry, BillGroup, Expense, ExpenseSplit, GroupBalance,
+    GroupDailyRollup, Settlement
+)
+
+CENT = decimal.Decimal('0.01')
+
+
+def to_cents(amount):
+    """Convert a Decimal money amount to integer cents."""
+    return int(decimal.Decimal(amount).quantize(CENT, rounding=decimal.ROUND_HALF_UP) * 100)
+
+
+def from_cents(cents):
+    """Convert integer cents back to a 2-place Decimal."""
+    return (decimal.Decimal(cents) / 100).quantize(CENT)
+
+
+# --- LEDGER VERSION (CACHE INVALIDATION) ---
+
+def _version_key(group_id):
+    return f"ledger-version:{group_id}"
+
+
+def ledger_version(group_id):
+    """
+    Opaque token that changes after every committed write to a group's
+    ledger. Cache keys that include it go stale on the next write.
+    """
+    return cache.get_or_set(_version_key(group_id), lambda: uuid.uuid4().hex, timeout=None)
+
+
+def bump_ledger_version(group_id):
+    """
+    Give the group a new ledger version once the current transaction
+    commits, so readers never cache uncommitted data under the new token.
+    A random token (not a counter) stays safe if the cache evicts the key.
+    """
+    transaction.on_commit(
+        lambda: cache.set(_version_key(group_id), uuid.uuid4().hex, timeout=None)
+    )
+
+
+# --- INCREMENTAL MAINTENANCE ---
+
+def expense_deltas(expense, splits=None):
+    """
+    How much `expense` changes each user's net balance, in cents.
+    The payer is credited the total, every split debits its user.
+
+    Args:
+        expense: A saved Expense
+        splits: Its ExpenseSplits, if already loaded (otherwise queried)
+
+    Returns:
+        Dict of user_id -> cents
+    """
+    if splits is None:
+        splits = expense.splits.all()
+
+    deltas = defaultdict(int)
+    deltas[expense.payer_id] += to_cents(expense.total_amount)
+    for split in splits:
+        deltas[split.user_owed_id] -= to_cents(split.amount_owed)
+    return deltas
+
+
+def apply_balance_deltas(group_id, deltas, sign=1):
+    """
+    Add `deltas` (user_id -> cents) to the stored GroupBalance rows of a group.
+
+    Always two queries regardless of the number of users: missing rows are
+    inserted with ignore_conflicts, then one UPDATE adds each user's delta.
+    Call inside the transaction that writes the expense.
+    """
+    bump_ledger_version(group_id)
+
+    deltas = {user_id: sign * cents for user_id, cents in deltas.items() if cents}
+    if not deltas:
+        return
+
+    GroupBalance.objects.bulk_create(
+        [GroupBalance(group_id=group_id, user_id=user_id) for user_id in deltas],
+        ignore_conflicts=True,
+    )
+    GroupBalance.objects.filter(group_id=group_id, user_id__in=deltas).update(
+        net_cents=F('net_cents') + Case(
+            *[When(user_id=user_id, then=Value(cents)) for user_id, cents in deltas.items()],
+            default=Value(0),
+            output_field=BigIntegerField(),
+        )
+    )
+
+
+def expense_rollup_deltas(expense, splits):
+    """
+    How `expense` changes its day's GroupDailyRollup rows.
+
+    Returns:
+        Dict of user_id -> [paid_cents, owed_cents, expense_count]
+    """
+    rows = defaultdict(lambda: [0, 0, 0])
+    rows[expense.payer_id][0] += to_cents(expense.total_amount)
+    rows[expense.payer_id][2] += 1
+    for split in splits:
+        rows[split.user_owed_id][1] += to_cents(split.amount_owed)
+    return rows
+
+
+def apply_rollup_deltas(group_id, day, rows, sign=1):
+    """
+    Add `rows` (user_id -> [paid, owed, count]) to one day's rollups.
+    Two queries, like apply_balance_deltas().
+    """
+    if not rows:
+        return
+
+    GroupDailyRollup.objects.bulk_create(
+        [GroupDailyRollup(group_id=group_id, day=day, user_id=user_id) for user_id in rows],
+        ignore_conflicts=True,
+    )
+
+    def increments(column):
+        return Case(
+            *[When(user_id=user_id, then=Value(sign * values[column])) for user_id, values in rows.items()],
+            default=Value(0),
+            output_field=BigIntegerField(),
+        )
+
+    GroupDailyRollup.objects.filter(group_id=group_id, day=day, user_id__in=rows).update(
+        paid_cents=F('paid_cents') + increments(0),
+        owed_cents=F('owed_cents') + increments(1),
+        expense_count=F('expense_count') + increments(2),
+    )
+
+
+def expense_day(expense):
+    """The rollup day of an expense (in the project time zone)."""
+    return timezone.localdate(expense.date)
+
+
+def record_expense(expense, splits=None):
+    """Add a newly saved expense (and its splits) to the group balances and rollups."""
+    splits = list(expense.splits.all()) if splits is None else splits
+    apply_balance_deltas(expense.group_id, expense_deltas(expense, splits))
+    apply_rollup_deltas(expense.group_id, expense_day(expense), expense_rollup_deltas(expense, splits))
+
+
+def record_expenses(group_id, expenses_with_splits):
+    """
+    Add many new expenses of one group to its balances with a single update
+    (and one rollup update per day).
+
+    Args:
+        expenses_with_splits: Iterable of (expense, splits) pairs
+    """
+    deltas = defaultdict(int)
+    days = defaultdict(lambda: defaultdict(lambda: [0, 0, 0]))
+    for expense, splits in expenses_with_splits:
+        for user_id, cents in expense_deltas(expense, splits).items():
+            deltas[user_id] += cents
+        day_rows = days[expense_day(expense)]
+        for user_id, values in expense_rollup_deltas(expense, splits).items():
+            for column, value in enumerate(values):
+                day_rows[user_id][column] += value
+
+    apply_balance_deltas(group_id, deltas)
+    for day, rows in days.items():
+        apply_rollup_deltas(group_id, day, rows)
+
+
+def reverse_expense(expense, splits=None):
+    """Take an expense out of the group balances and rollups (before it is changed or deleted)."""
+    splits = list(expense.splits.all()) if splits is None else splits
+    apply_balance_deltas(expense.group_id, expense_deltas(expense, splits), sign=-1)
+    apply_rollup_deltas(expense.group_id, expense_day(expense), expense_rollup_deltas(expense, splits), sign=-1)
+
+
+# --- READS ---
+
+def group_net_cents(group):
+    """
+    Net balance of every member of a BillGroup in cents, read from GroupBalance.
+
+    Returns:
+        Dict of username -> cents (positive = is owed money)
+    """
+    balances = {}
+    for username in group.members.values_list('username', flat=True):
+        balances[username] = 0
+
+    # Former members keep their row, include them only while they are not settled
+    for username, cents in group.member_balances.values_list('user__username', 'net_cents'):
+        if cents or username in balances:
+            balances[username] = cents
+
+    return balances
+
+
+def group_balances(group):
+    """
+    Net balance of every member of a BillGroup.
+
+    Returns:
+        Dict of username -> net balance as Decimal (positive = is owed money)
+    """
+    return {username: from_cents(cents) for username, cents in group_net_cents(group).items()}
+
+
+# --- CROSS-GROUP POSITIONS ---
+
+def user_positions(user):
+    """
+    Pairwise position of `user` against every counterparty, per group,
+    across all of the user's groups.
+
+    Pairwise debts follow who paid for whom: a split of an expense paid by
+    someone else is owed to that payer, recorded payments reduce it.
+
+    Returns:
+        Dict of (counterparty_id, group_id) -> cents
+        (positive = the counterparty owes `user`)
+    """
+    group_ids = user.bill_groups.values('id')
+
+    # 1. Every split between the user and someone else, in one aggregate query
+    splits = ExpenseSplit.objects.filter(
+        Q(expense__payer=user) | Q(user_owed=user),
+        expense__group_id__in=group_ids,
+    ).exclude(
+        user_owed_id=F('expense__payer_id')
+    ).annotate(
+        counterparty=Case(
+            When(expense__payer=user, then=F('user_owed_id')),
+            default=F('expense__payer_id'),
+        ),
+        signed=Case(
+            When(expense__payer=user, then=F('amount_owed')),
+            default=-F('amount_owed'),
+        ),
+    ).values('counterparty', 'expense__group_id').annotate(net=Sum('signed')).order_by()
+
+    positions = defaultdict(int)
+    for row in splits:
+        positions[(row['counterparty'], row['expense__group_id'])] += to_cents(row['net'])
+
+    # 2. Payments between the user and someone else
+    payments = Settlement.objects.filter(
+        Q(from_user=user) | Q(to_user=user),
+        group_id__in=group_ids,
+    ).annotate(
+        counterparty=Case(
+            When(from_user=user, then=F('to_user_id')),
+            default=F('from_user_id'),
+        ),
+        signed=Case(
+            When(from_user=user, then=F('amount')),
+            default=-F('amount'),
+        ),
+    ).values('counterparty', 'group_id').annotate(net=Sum('signed')).order_by()
+
+    for row in payments:
+        positions[(row['counterparty'], row['group_id'])] += to_cents(row['net'])
+
+    return {key: cents for key, cents in positions.items() if cents}
+
+
+# --- SETTLEMENTS (PAYMENTS) ---
+
+def settlement_deltas(payment):
+    """Paying someone back raises the payer's balance and lowers the payee's."""
+    cents = to_cents(payment.amount)
+    deltas = defaultdict(int)
+    deltas[payment.from_user_id] += cents
+    deltas[payment.to_user_id] -= cents
+    return deltas
+
+
+def record_settlement(payment):
+    apply_balance_deltas(payment.group_id, settlement_deltas(payment))
+
+
+def reverse_settlement(payment):
+    apply_balance_deltas(payment.group_id, settlement_deltas(payment), sign=-1)
+
+
+# --- CHECKPOINTS ---
+
+def checkpoint_watermark(group_path, field):
+    """
+    SQL expression for `field` of the latest checkpoint of the row's group
+    (0 when the group has none), so one query can filter every group by
+    its own watermark.
+    """
+    latest = BalanceCheckpoint.objects.filter(
+        group_id=OuterRef(group_path)
+    ).order_by('-id').values(field)[:1]
+    return Coalesce(Subquery(latest), Value(0))
+
+
+def latest_checkpoints(group_ids=None):
+    """Dict of group_id -> id of its latest BalanceCheckpoint."""
+    checkpoints = BalanceCheckpoint.objects.all()
+    if group_ids is not None:
+        checkpoints = checkpoints.filter(group_id__in=group_ids)
+
+    latest = {}
+    for group_id, checkpoint_id in checkpoints.order_by('group_id', '-id').values_list('group_id', 'id'):
+        latest.setdefault(group_id, checkpoint_id)
+    return latest
+
+
+@transaction.atomic
+def create_checkpoint(group_id):
+    """
+    Snapshot a group's balances as of its latest expense and settlement.
+    Only the newest settings.BALANCE_CHECKPOINTS_KEPT checkpoints are kept.
+
+    The watermark and the sums are read in one transaction with the group row
+    locked, so two checkpoint runs for a group cannot interleave and the sums
+    cover exactly the rows up to the watermark.
+    """
+    with transaction.atomic():
+        BillGroup.objects.select_for_update().get(id=group_id)
+        last_expense_id = Expense.objects.filter(group_id=group_id).aggregate(last=Max('id'))['last'] or 0
+        last_settlement_id = Settlement.objects.filter(group_id=group_id).aggregate(last=Max('id'))['last'] or 0
+        net = compute_net_cents([group_id], until=(last_expense_id, last_settlement_id))
+
+        checkpoint = BalanceCheckpoint.objects.create(
+            group_id=group_id, last_expense_id=last_expense_id, last_settlement_id=last_settlement_id
+        )
+        BalanceCheckpointEntry.objects.bulk_create([
+            BalanceCheckpointEntry(checkpoint=checkpoint, user_id=user_id, net_cents=cents)
+            for (_, user_id), cents in net.items() if cents
+        ], batch_size=1000)
+
+        keep = BalanceCheckpoint.objects.filter(group_id=group_id).order_by('-id').values_list(
+            'id', flat=True)[:settings.BALANCE_CHECKPOINTS_KEPT]
+        BalanceCheckpoint.objects.filter(group_id=group_id).exclude(id__in=list(keep)).delete()
+    return checkpoint
+
+
+def invalidate_checkpoints(group_id, expense_id=None, settlement_id=None):
+    """
+    Drop checkpoints that already include an expense or settlement which is
+    being changed or deleted; their snapshot no longer matches the history.
+    """
+    stale = Q()
+    if expense_id is not None:
+        stale |= Q(last_expense_id__gte=expense_id)
+    if settlement_id is not None:
+        stale |= Q(last_settlement_id__gte=settlement_id)
+    if stale:
+        BalanceCheckpoint.objects.filter(stale, group_id=group_id).delete()
+
+
+# --- FULL RECOMPUTATION ---
+
+def compute_net_cents(group_ids=None, use_checkpoints=True, until=None):
+    """
+    Recompute balances from the expense and settlement history, ignoring
+    GroupBalance. By default this starts from each group's latest checkpoint
+    and only aggregates the activity after it.
+
+    Args:
+        group_ids: Restrict to these groups (default: every group)
+        use_checkpoints: False to aggregate the entire history
+        until: Optional (last_expense_id, last_settlement_id) upper bounds
+
+    Returns:
+        Dict of (group_id, user_id) -> cents
+    """
+    expenses = Expense.objects.all()
+    splits = ExpenseSplit.objects.all()
+    payments = Settlement.objects.all()
+    if group_ids is not None:
+        expenses = expenses.filter(group_id__in=group_ids)
+        splits = splits.filter(expense__group_id__in=group_ids)
+        payments = payments.filter(group_id__in=group_ids)
+    if until is not None:
+        expenses = expenses.filter(id__lte=until[0])
+        splits = splits.filter(expense_id__lte=until[0])
+        payments = payments.filter(id__lte=until[1])
+
+    net = defaultdict(int)
+
+    with transaction.atomic():
+        # 0. Start from the latest checkpoints, and skip what they cover
+        if use_checkpoints:
+            entries = BalanceCheckpointEntry.objects.filter(
+                checkpoint_id__in=latest_checkpoints(group_ids).values()
+            ).values_list('checkpoint__group_id', 'user_id', 'net_cents')
+            for group_id, user_id, cents in entries:
+                net[(group_id, user_id)] += cents
+
+            expenses = expenses.filter(id__gt=checkpoint_watermark('group_id', 'last_expense_id'))
+            splits = splits.filter(expense_id__gt=checkpoint_watermark('expense__group_id', 'last_expense_id'))
+            payments = payments.filter(id__gt=checkpoint_watermark('group_id', 'last_settlement_id'))
+
+        # 1. Total amount *paid* by each user in each group
+        for row in expenses.values('group_id', 'payer_id').annotate(paid=Sum('total_amount')).order_by():
+            net[(row['group_id'], row['payer_id'])] += to_cents(row['paid'])
+
+        # 2. Total amount *owed* by each user in each group
+        for row in splits.values('expense__group_id', 'user_owed_id').annotate(owed=Sum('amount_owed')).order_by():
+            net[(row['expense__group_id'], row['user_owed_id'])] -= to_cents(row['owed'])
+
+        # 3. Settlements paid and received
+        for row in payments.values('group_id', 'from_user_id').annotate(sent=Sum('amount')).order_by():
+            net[(row['group_id'], row['from_user_id'])] += to_cents(row['sent'])
+        for row in payments.values('group_id', 'to_user_id').annotate(received=Sum('amount')).order_by():
+            net[(row['group_id'], row['to_user_id'])] -= to_cents(row['received'])
+
+    return net
+
+
+def find_balance_drift(group_ids=None, use_checkpoints=True):
+    """
+    Compare stored GroupBalance rows with a recomputation from the history.
+
+    Returns:
+        List of (group_id, user_id, stored_cents, expected_cents) that differ
+    """
+    expected = compute_net_cents(group_ids, use_checkpoints)
+
+    stored_rows = GroupBalance.objects.all()
+    if group_ids is not None:
+        stored_rows = stored_rows.filter(group_id__in=group_ids)
+    stored = {(g, u): cents for g, u, cents in stored_rows.values_list('group_id', 'user_id', 'net_cents')}
+
+    drift = []
+    for key in sorted(set(expected) | set(stored)):
+        if stored.get(key, 0) != expected.get(key, 0):
+            drift.append((key[0], key[1], stored.get(key, 0), expected.get(key, 0)))
+    return drift
+
+
+@transaction.atomic
+def rebuild_group_balances(group_ids=None, use_checkpoints=True):
+    """
+    Replace stored GroupBalance rows with a recomputation from the history.
+    Used after bulk imports that bypass the serializers, and to repair drift.
+    """
+    net = compute_net_cents(group_ids, use_checkpoints)
+
+    stale = GroupBalance.objects.all()
+    if group_ids is not None:
+        stale = stale.filter(group_id__in=group_ids)
+    stale.delete()
+
+    for group_id in (group_ids if group_ids is not None else {key[0] for key in net}):
+        bump_ledger_version(group_id)
+
+    GroupBalance.objects.bulk_create([
+        GroupBalance(group_id=group_id, user_id=user_id, net_cents=cents)
+        for (group_id, user_id), cents in net.items()
+    ], batch_size=1000)
+    return len(net)
+
+
+@transaction.atomic
+def rebuild_daily_rollups(group_ids=None):
+    """
+    Replace GroupDailyRollup rows with a recomputation from all expenses.
+    Used after bulk inserts that bypass the serializers.
+    """
+    expenses = Expense.objects.all()
+    splits = ExpenseSplit.objects.all()
+    stale = GroupDailyRollup.objects.all()
+    if group_ids is not None:
+        expenses = expenses.filter(group_id__in=group_ids)
+        splits = splits.filter(expense__group_id__in=group_ids)
+        stale = stale.filter(group_id__in=group_ids)
+    stale.delete()
+
+    tz = timezone.get_current_timezone()
+    rows = defaultdict(lambda: [0, 0, 0])
+    paid = expenses.annotate(day=TruncDate('date', tzinfo=tz)).values('group_id', 'day', 'payer_id').annotate(
+        paid=Sum('total_amount'), count=Count('id')).order_by()
+    for row in paid:
+        values = rows[(row['group_id'], row['day'], row['payer_id'])]
+        values[0] += to_cents(row['paid'])
+        values[2] += row['count']
+
+    owed = splits.annotate(day=TruncDate('expense__date', tzinfo=tz)).values(
+        'expense__group_id', 'day', 'user_owed_id').annotate(owed=Sum('amount_owed')).order_by()
+    for row in owed:
+        rows[(row['expense__group_id'], row['day'], row['user_owed_id'])][1] += to_cents(row['owed'])
+
+    GroupDailyRollup.objects.bulk_create([
+        GroupDailyRollup(group_id=group_id, day=day, user_id=user_id,
+                         paid_cents=values[0], owed_cents=values[1], expense_count=values[2])
+        for (group_id, day, user_id), values in rows.items()
+    ], batch_size=1000)
+    return len(rows)
@@ -0,0 +1,94 @@
+"""
+Receipt line items of itemized expenses, stored in ExpenseLineItem /
+ExpenseLineItemShare instead of being re-parsed from item_data_json.
+
+Writes are two bulk INSERTs however many expenses and items there are;
+reads are GROUP BY queries on the (group, category) and
+(user, group, category) indexes.
+"""
+from django.db.models import Count, Sum
+
+from .ledger import from_cents
+from .models import ExpenseLineItem, ExpenseLineItemShare
+from .splits import SplitError, line_item_rows
+
+
+def build_line_items(expense):
+    """
+    Unsaved line items and shares of one expense (none unless it is itemized
+    with item data in the itemized format). Migration 0009 keeps its own copy
+    of this logic, as migrations must not import app code.
+
+    Returns:
+        (items, shares): shares reference their items, so save items first
+    """
+    if expense.split_type != 'I' or not expense.item_data_json:
+        return [], []
+    try:
+        rows = line_item_rows(expense.item_data_json, expense.fx_rate, expense.currency)
+    except SplitError:
+        # Older itemized expenses may hold free-form item data
+        return [], []
+
+    items, shares = [], []
+    for row in rows:
+        item = ExpenseLineItem(
+            expense_id=expense.id, group_id=expense.group_id, position=row['position'],
+            name=row['name'], category=row['category'], currency=row['currency'],
+            price=from_cents(row['price_cents']), amount=from_cents(row['amount_cents']),
+        )
+        items.append(item)
+        shares.extend(
+            ExpenseLineItemShare(
+                line_item=item, user_id=user_id, group_id=expense.group_id,
+                category=row['category'], amount=from_cents(cents),
+            )
+            for user_id, cents in row['shares'].items()
+        )
+    return items, shares
+
+
+def write_line_items(expenses, batch_size=500):
+    """Store the line items of newly written expenses: one INSERT per table."""
+    items, shares = [], []
+    for expense in expenses:
+        expense_items, expense_shares = build_line_items(expense)
+        items.extend(expense_items)
+        shares.extend(expense_shares)
+    if not items:
+        return 0
+
+    ExpenseLineItem.objects.bulk_create(items, batch_size=batch_size)
+    for share in shares:
+        # The items have primary keys now
+        share.line_item_id = share.line_item.id
+    ExpenseLineItemShare.objects.bulk_create(shares, batch_size=batch_size)
+    return len(items)
+
+
+def replace_line_items(expense):
+    """Rewrite an edited expense's line items."""
+    ExpenseLineItem.objects.filter(expense_id=expense.id).delete()
+    return write_line_items([expense])
+
+
+def item_spending(group, user=None, category=None):
+    """
+    Item spending per category in a group, in the group's currency.
+    With `user`, only that member's shares of the items.
+
+    Returns:
+        [{"category": "drinks", "total": "42.50", "items": 7}, ...], largest first
+    """
+    if user is not None:
+        rows = ExpenseLineItemShare.objects.filter(user=user, group=group)
+    else:
+        rows = ExpenseLineItem.objects.filter(group=group)
+    if category:
+        rows = rows.filter(category=category)
+
+    totals = rows.values('category').annotate(total=Sum('amount'), items=Count('id')).order_by('-total', 'category')
+    return [
+        {"category": row['category'], "total": f"{row['total']:.2f}", "items": row['items']}
+        for row in totals
+    ]
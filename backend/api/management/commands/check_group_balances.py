@@ -0,0 +1,53 @@
+"""
+Recompute group balances from the expense and settlement history (starting
+from the latest checkpoints) and report drift against the materialised
+GroupBalance rows.
+
+Usage:
+    python manage.py check_group_balances              # report only, exit 1 on drift
+    python manage.py check_group_balances --group 3 7  # only these groups
+    python manage.py check_group_balances --fix        # rebuild the drifted groups
+    python manage.py check_group_balances --full       # ignore checkpoints, scan all history
+"""
+import sys
+
+from django.core.management.base import BaseCommand
+
+from api.ledger import find_balance_drift, from_cents, rebuild_group_balances
+
+
+class Command(BaseCommand):
+    help = "Check the materialised group balances against a full recomputation."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--group', type=int, nargs='+', dest='group_ids',
+                            help="Only check these group IDs")
+        parser.add_argument('--fix', action='store_true',
+                            help="Rebuild the balances of every group with drift")
+        parser.add_argument('--full', action='store_true',
+                            help="Recompute from the entire history instead of the latest checkpoints")
+
+    def handle(self, *args, **options):
+        use_checkpoints = not options['full']
+        drift = find_balance_drift(options['group_ids'], use_checkpoints)
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("No drift: stored balances match the expense history."))
+            return
+
+        for group_id, user_id, stored, expected in drift:
+            self.stdout.write(
+                f"group {group_id} user {user_id}: stored {from_cents(stored)} "
+                f"expected {from_cents(expected)} (off by {from_cents(stored - expected)})"
+            )
+
+        drifted_groups = sorted({row[0] for row in drift})
+        self.stdout.write(self.style.WARNING(
+            f"{len(drift)} balance(s) drifted in {len(drifted_groups)} group(s)."
+        ))
+
+        if options['fix']:
+            rebuild_group_balances(drifted_groups, use_checkpoints)
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt balances for groups {drifted_groups}."))
+        else:
+            sys.exit(1)
@@ -0,0 +1,53 @@
+"""
+Take balance checkpoints for groups with enough new activity.
+
+Meant to run periodically (e.g. from cron). Recomputing a group's balances
+then only aggregates the expenses and settlements after its checkpoint.
+
+Usage:
+    python manage.py checkpoint_balances                     # groups with >= BALANCE_CHECKPOINT_MIN_ACTIVITY new rows
+    python manage.py checkpoint_balances --min-activity 1    # every group with any new activity
+    python manage.py checkpoint_balances --group 3 7         # only these groups
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from api.ledger import checkpoint_watermark, create_checkpoint
+from api.models import Expense, Settlement
+
+
+class Command(BaseCommand):
+    help = "Snapshot group balances for groups with enough activity since their last checkpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--group', type=int, nargs='+', dest='group_ids',
+                            help="Only consider these group IDs")
+        parser.add_argument('--min-activity', type=int, default=None,
+                            help="New expenses + settlements needed (default BALANCE_CHECKPOINT_MIN_ACTIVITY)")
+
+    def handle(self, *args, **options):
+        min_activity = options['min_activity']
+        if min_activity is None:
+            min_activity = settings.BALANCE_CHECKPOINT_MIN_ACTIVITY
+
+        # Count the rows after each group's own watermark, one query per table
+        activity = Counter()
+        for model, field in ((Expense, 'last_expense_id'), (Settlement, 'last_settlement_id')):
+            rows = model.objects.filter(id__gt=checkpoint_watermark('group_id', field))
+            if options['group_ids']:
+                rows = rows.filter(group_id__in=options['group_ids'])
+            for row in rows.values('group_id').annotate(n=Count('id')).order_by():
+                activity[row['group_id']] += row['n']
+
+        due = sorted(group_id for group_id, n in activity.items() if n >= min_activity)
+        for group_id in due:
+            checkpoint = create_checkpoint(group_id)
+            self.stdout.write(
+                f"group {group_id}: checkpoint {checkpoint.id} after {activity[group_id]} new rows "
+                f"(expense {checkpoint.last_expense_id}, settlement {checkpoint.last_settlement_id})"
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"Checkpointed {len(due)} group(s)."))
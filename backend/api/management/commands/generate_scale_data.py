@@ -0,0 +1,235 @@
+"""
+Bulk-generate synthetic users, bill groups, expenses and itineraries.
+
+Usage:
+    python manage.py generate_scale_data --users 2000 --groups 400 --expenses 2000000
+    python manage.py generate_scale_data --seed 7 --prefix run7 --itineraries 1000 --itinerary-days 14
+
+The output is deterministic for a given --seed (apart from auto-increment
+ids), so performance work can be measured against the same data volumes.
+All generated users share the password given by --password.
+"""
+import datetime
+import decimal
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from api.genaifakes import fake_itinerary
+from api.ledger import rebuild_daily_rollups, rebuild_group_balances
+from api.models import BillGroup, Expense, ExpenseSplit, Itinerary, ItineraryItem
+
+GROUP_NAMES = [
+    "NYC Trip Crew", "Apartment Roommates", "Ski Weekend", "Book Club",
+    "Europe Backpacking", "Office Lunch", "Cottage Trip", "Wedding Party",
+]
+
+EXPENSE_DESCRIPTIONS = [
+    "Dinner", "Groceries", "Taxi", "Hotel", "Museum tickets", "Drinks",
+    "Rent", "Utilities", "Gas", "Breakfast", "Concert", "Train tickets",
+]
+
+DESTINATIONS = [
+    "Toronto", "Montreal", "Vancouver", "Paris", "Tokyo", "Lisbon",
+    "New York", "Mexico City", "Seoul", "Barcelona",
+]
+
+# Most groups are small, a few are large
+GROUP_SIZE_WEIGHTS = {2: 20, 3: 25, 4: 25, 5: 12, 6: 8, 8: 5, 12: 3, 20: 2}
+
+
+class Command(BaseCommand):
+    help = "Bulk-generate synthetic users, groups, expenses/splits and itineraries for scale testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=200)
+        parser.add_argument('--expenses', type=int, default=100000)
+        parser.add_argument('--itineraries', type=int, default=200)
+        parser.add_argument('--itinerary-days', type=int, default=7,
+                            help="Days per AI itinerary (controls the ai_generated_data blob size)")
+        parser.add_argument('--items-per-itinerary', type=int, default=10)
+        parser.add_argument('--days-of-history', type=int, default=730,
+                            help="Spread expense dates over this many past days")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--prefix', default='scale', help="Username/group name prefix")
+        parser.add_argument('--password', default='scale-pass-123')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        prefix = options['prefix']
+        batch_size = options['batch_size']
+
+        if options['itinerary_days'] < 1:
+            raise CommandError("--itinerary-days must be at least 1.")
+        if User.objects.filter(username__startswith=f"{prefix}_user_").exists():
+            raise CommandError(
+                f"Users with prefix '{prefix}' already exist. Use a different --prefix."
+            )
+
+        users = self.create_users(options['users'], prefix, options['password'], batch_size)
+        groups = self.create_groups(options['groups'], users, prefix, rng, batch_size)
+        self.create_expenses(options['expenses'], groups, rng, batch_size, options['days_of_history'])
+        self.create_itineraries(options['itineraries'], users, rng, batch_size,
+                                options['itinerary_days'], options['items_per_itinerary'])
+
+        self.stdout.write(self.style.SUCCESS("Done."))
+
+    def log(self, message):
+        self.stdout.write(message)
+        self.stdout.flush()
+
+    # --- USERS ---
+
+    def create_users(self, count, prefix, password, batch_size):
+        # Hashing is deliberately slow, so hash once and share it
+        password_hash = make_password(password)
+        for start in range(0, count, batch_size):
+            User.objects.bulk_create([
+                User(username=f"{prefix}_user_{i}", password=password_hash)
+                for i in range(start, min(start + batch_size, count))
+            ], batch_size=batch_size)
+        self.log(f"Created {count} users.")
+        return list(User.objects.filter(username__startswith=f"{prefix}_user_")
+                    .order_by('id').values_list('id', flat=True))
+
+    # --- GROUPS ---
+
+    def create_groups(self, count, user_ids, prefix, rng, batch_size):
+        if not user_ids:
+            return []
+
+        sizes = list(GROUP_SIZE_WEIGHTS)
+        weights = list(GROUP_SIZE_WEIGHTS.values())
+        Membership = BillGroup.members.through
+
+        groups = []
+        for start in range(0, count, batch_size):
+            with transaction.atomic():
+                batch = BillGroup.objects.bulk_create([
+                    BillGroup(name=f"{prefix} {rng.choice(GROUP_NAMES)} #{i}")
+                    for i in range(start, min(start + batch_size, count))
+                ])
+                memberships = []
+                for group in batch:
+                    size = min(rng.choices(sizes, weights=weights)[0], len(user_ids))
+                    member_ids = rng.sample(user_ids, size)
+                    memberships.extend(Membership(billgroup_id=group.id, user_id=user_id)
+                                       for user_id in member_ids)
+                    # Activity is skewed: a few groups get most of the expenses
+                    groups.append({'id': group.id, 'members': member_ids,
+                                   'activity': rng.paretovariate(1.2)})
+                Membership.objects.bulk_create(memberships, batch_size=batch_size)
+        self.log(f"Created {count} groups.")
+        return groups
+
+    # --- EXPENSES ---
+
+    def create_expenses(self, count, groups, rng, batch_size, days_of_history):
+        if not groups or not count:
+            return
+
+        weights = [group['activity'] for group in groups]
+        now = timezone.now()
+        created = 0
+
+        while created < count:
+            n = min(batch_size, count - created)
+            expenses = []
+            planned_splits = []
+            for _ in range(n):
+                group = rng.choices(groups, weights=weights)[0]
+                expense, splits = self.make_expense(group, rng, now, days_of_history)
+                expenses.append(expense)
+                planned_splits.append(splits)
+
+            with transaction.atomic():
+                Expense.objects.bulk_create(expenses, batch_size=batch_size)
+                ExpenseSplit.objects.bulk_create([
+                    ExpenseSplit(expense_id=expense.id, user_owed_id=user_id,
+                                 amount_owed=amount, original_amount=amount)
+                    for expense, splits in zip(expenses, planned_splits)
+                    for user_id, amount in splits
+                ], batch_size=batch_size)
+
+            created += n
+            self.log(f"  expenses: {created}/{count}")
+        self.log(f"Created {count} expenses.")
+
+        # bulk_create bypasses the serializers, so materialise balances and rollups once at the end
+        group_ids = [group['id'] for group in groups]
+        rebuild_group_balances(group_ids)
+        rebuild_daily_rollups(group_ids)
+        self.log("Rebuilt group balances and daily rollups.")
+
+    def make_expense(self, group, rng, now, days_of_history):
+        """Build one unsaved Expense and its (user_id, amount) splits."""
+        members = group['members']
+        total_cents = int(rng.lognormvariate(8.0, 1.0))  # median around $30
+        total_cents = max(100, min(total_cents, 500000))
+
+        participants = members if rng.random() < 0.6 else rng.sample(members, rng.randint(1, len(members)))
+        split_type = rng.choices(['E', 'M', 'I'], weights=[70, 20, 10])[0]
+
+        if split_type == 'E':
+            shares = [1] * len(participants)
+        else:
+            shares = [rng.randint(1, 5) for _ in participants]
+
+        # Integer cents, with rounding leftovers going to the first participants
+        share_total = sum(shares)
+        amounts = [total_cents * s // share_total for s in shares]
+        for i in range(total_cents - sum(amounts)):
+            amounts[i % len(amounts)] += 1
+
+        # Entered in the group currency (the default), so the rate is 1
+        expense = Expense(
+            group_id=group['id'],
+            description=rng.choice(EXPENSE_DESCRIPTIONS),
+            total_amount=decimal.Decimal(total_cents) / 100,
+            original_amount=decimal.Decimal(total_cents) / 100,
+            payer_id=rng.choice(members),
+            date=now - datetime.timedelta(seconds=rng.randint(0, days_of_history * 86400)),
+            split_type=split_type,
+        )
+        splits = [(user_id, decimal.Decimal(cents) / 100) for user_id, cents in zip(participants, amounts)]
+        return expense, splits
+
+    # --- ITINERARIES ---
+
+    def create_itineraries(self, count, user_ids, rng, batch_size, days, items_per_itinerary):
+        if not user_ids or not count:
+            return
+
+        # Blobs are as large as a real multi-day AI response
+        batch_size = max(1, min(batch_size, 500))
+        for start in range(0, count, batch_size):
+            itineraries = []
+            for i in range(start, min(start + batch_size, count)):
+                destination = rng.choice(DESTINATIONS)
+                # Exactly `days` days, however long (the API's fakes stop at 14)
+                plan = fake_itinerary({'destination': destination, 'tripLength': f"{days} days",
+                                       'seed': i}, max_days=days)
+                itineraries.append(Itinerary(
+                    owner_id=rng.choice(user_ids),
+                    title=plan['tripTitle'],
+                    region=destination,
+                    ai_generated_data={'itinerary': plan, 'groundingChunks': []},
+                ))
+
+            with transaction.atomic():
+                Itinerary.objects.bulk_create(itineraries)
+                ItineraryItem.objects.bulk_create([
+                    ItineraryItem(itinerary_id=itinerary.id, order=order,
+                                  description=f"Stop {order + 1} in {itinerary.region}",
+                                  location_name=f"{itinerary.region} stop {order + 1}")
+                    for itinerary in itineraries
+                    for order in range(items_per_itinerary)
+                ], batch_size=batch_size * items_per_itinerary)
+            self.log(f"  itineraries: {min(start + batch_size, count)}/{count}")
+        self.log(f"Created {count} itineraries.")
@@ -0,0 +1,22 @@
+"""
+Delete cached receipt parses older than RECEIPT_CACHE_DAYS.
+
+Usage:
+    python manage.py prune_receipt_cache             # older than RECEIPT_CACHE_DAYS
+    python manage.py prune_receipt_cache --days 7
+"""
+from django.core.management.base import BaseCommand
+
+from api.receiptcache import prune
+
+
+class Command(BaseCommand):
+    help = "Delete expired entries from the receipt parse cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help="Delete entries older than this many days (default RECEIPT_CACHE_DAYS)")
+
+    def handle(self, *args, **options):
+        deleted = prune(options['days'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} cached receipt parses."))
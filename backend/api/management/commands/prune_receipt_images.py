@@ -0,0 +1,22 @@
+"""
+Delete stored receipt photos that no expense uses, with their thumbnails.
+
+Usage:
+    python manage.py prune_receipt_images             # uploaded over RECEIPT_CACHE_DAYS ago
+    python manage.py prune_receipt_images --days 7
+"""
+from django.core.management.base import BaseCommand
+
+from api.receiptstore import prune
+
+
+class Command(BaseCommand):
+    help = "Delete stored receipt photos that are not attached to any expense."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help="Only photos uploaded more than this many days ago (default RECEIPT_CACHE_DAYS)")
+
+    def handle(self, *args, **options):
+        deleted = prune(options['days'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} unused receipt images."))
@@ -0,0 +1,54 @@
+# Generated by Django 5.1.2 on 2026-10-19 03:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_group_balances(apps, schema_editor):
+    """Compute every existing (group, member) balance from the full history."""
+    Expense = apps.get_model('api', 'Expense')
+    ExpenseSplit = apps.get_model('api', 'ExpenseSplit')
+    GroupBalance = apps.get_model('api', 'GroupBalance')
+
+    net = {}
+    paid = Expense.objects.values('group_id', 'payer_id').annotate(total=Sum('total_amount')).order_by()
+    for row in paid:
+        key = (row['group_id'], row['payer_id'])
+        net[key] = net.get(key, 0) + round(row['total'] * 100)
+
+    owed = ExpenseSplit.objects.values('expense__group_id', 'user_owed_id').annotate(
+        total=Sum('amount_owed')).order_by()
+    for row in owed:
+        key = (row['expense__group_id'], row['user_owed_id'])
+        net[key] = net.get(key, 0) - round(row['total'] * 100)
+
+    GroupBalance.objects.bulk_create([
+        GroupBalance(group_id=group_id, user_id=user_id, net_cents=cents)
+        for (group_id, user_id), cents in net.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_itinerary_ai_generated_data'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('net_cents', models.BigIntegerField(default=0)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='member_balances', to='api.billgroup')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='group_balances', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('group', 'user')},
+            },
+        ),
+        migrations.RunPython(backfill_group_balances, migrations.RunPython.noop),
+    ]
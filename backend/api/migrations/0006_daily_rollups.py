@@ -0,0 +1,80 @@
+# Generated by Django 5.1.2 on 2026-10-19 03:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def backfill_daily_rollups(apps, schema_editor):
+    """Aggregate existing expenses into per (group, day, member) rollups."""
+    Expense = apps.get_model('api', 'Expense')
+    ExpenseSplit = apps.get_model('api', 'ExpenseSplit')
+    GroupDailyRollup = apps.get_model('api', 'GroupDailyRollup')
+    tz = timezone.get_current_timezone()
+
+    rows = {}
+    paid = Expense.objects.annotate(day=TruncDate('date', tzinfo=tz)).values(
+        'group_id', 'day', 'payer_id').annotate(paid=Sum('total_amount'), count=Count('id')).order_by()
+    for row in paid:
+        values = rows.setdefault((row['group_id'], row['day'], row['payer_id']), [0, 0, 0])
+        values[0] += round(row['paid'] * 100)
+        values[2] += row['count']
+
+    owed = ExpenseSplit.objects.annotate(day=TruncDate('expense__date', tzinfo=tz)).values(
+        'expense__group_id', 'day', 'user_owed_id').annotate(owed=Sum('amount_owed')).order_by()
+    for row in owed:
+        values = rows.setdefault((row['expense__group_id'], row['day'], row['user_owed_id']), [0, 0, 0])
+        values[1] += round(row['owed'] * 100)
+
+    GroupDailyRollup.objects.bulk_create([
+        GroupDailyRollup(group_id=group_id, day=day, user_id=user_id,
+                         paid_cents=values[0], owed_cents=values[1], expense_count=values[2])
+        for (group_id, day, user_id), values in rows.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_settlement_checkpoints'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('paid_cents', models.BigIntegerField(default=0)),
+                ('owed_cents', models.BigIntegerField(default=0)),
+                ('expense_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['group', 'date'], name='expense_group_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['group', '-total_amount'], name='expense_group_amount_idx'),
+        ),
+        migrations.AddField(
+            model_name='groupdailyrollup',
+            name='group',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='api.billgroup'),
+        ),
+        migrations.AddField(
+            model_name='groupdailyrollup',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='groupdailyrollup',
+            unique_together={('group', 'day', 'user')},
+        ),
+        migrations.RunPython(backfill_daily_rollups, migrations.RunPython.noop),
+    ]
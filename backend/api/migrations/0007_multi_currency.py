@@ -0,0 +1,48 @@
+# Generated by Django 5.1.2 on 2026-10-19 03:35
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_original_amounts(apps, schema_editor):
+    """Existing expenses were entered in the group currency at a rate of 1."""
+    Expense = apps.get_model('api', 'Expense')
+    ExpenseSplit = apps.get_model('api', 'ExpenseSplit')
+    Expense.objects.filter(original_amount__isnull=True).update(original_amount=F('total_amount'))
+    ExpenseSplit.objects.filter(original_amount__isnull=True).update(original_amount=F('amount_owed'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='billgroup',
+            name='currency',
+            field=models.CharField(default='CAD', max_length=3),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='currency',
+            field=models.CharField(default='CAD', max_length=3),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='fx_rate',
+            field=models.DecimalField(decimal_places=10, default=1, max_digits=20),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='original_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='expensesplit',
+            name='original_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(backfill_original_amounts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,187 @@
+# Generated by Django 5.1.2 on 2026-10-19 03:44
+
+import decimal
+import json
+import re
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Copied from api/splits.py as of this migration: migrations must not import app code
+ITEM_CATEGORIES = [
+    ('drinks', ('beer', 'wine', 'cocktail', 'coffee', 'espresso', 'latte', 'cappuccino', 'tea', 'juice',
+                'soda', 'cola', 'water', 'lemonade', 'smoothie', 'milkshake', 'sake', 'soju', 'whisky',
+                'vodka', 'gin', 'rum', 'cider', 'drink')),
+    ('desserts', ('tiramisu', 'cake', 'cheesecake', 'cupcake', 'ice cream', 'gelato', 'dessert', 'pie',
+                  'brownie', 'cookie', 'mochi', 'pudding', 'crepe')),
+    ('food', ('pizza', 'salad', 'ramen', 'noodle', 'pad thai', 'gyoza', 'dumpling', 'fish', 'chips', 'fries',
+              'burger', 'sandwich', 'rice', 'soup', 'taco', 'sushi', 'steak', 'chicken', 'pasta', 'curry',
+              'bread', 'egg', 'pancake', 'breakfast', 'lunch', 'dinner', 'meal')),
+    ('fees', ('tax', 'service', 'tip', 'gratuity', 'fee', 'charge', 'deposit')),
+]
+CATEGORY_PATTERNS = [
+    (category, re.compile(r'\b(?:%s)(?:e?s)?\b' % '|'.join(map(re.escape, keywords)), re.IGNORECASE))
+    for category, keywords in ITEM_CATEGORIES
+]
+CENT = decimal.Decimal('0.01')
+
+
+class SkipExpense(Exception):
+    """Item data not in the itemized format: the expense gets no line items."""
+
+
+def _cents(value):
+    try:
+        amount = decimal.Decimal(str(value))
+        if not amount.is_finite():
+            raise SkipExpense()
+        return int(amount.quantize(CENT, rounding=decimal.ROUND_HALF_UP) * 100)
+    except decimal.InvalidOperation:
+        raise SkipExpense()
+
+
+def _money(cents):
+    return (decimal.Decimal(cents) / 100).quantize(CENT)
+
+
+def _even_split(cents, user_ids):
+    """Equal shares, the leftover cents to the first users."""
+    user_ids = list(dict.fromkeys(user_ids))
+    sign = -1 if cents < 0 else 1
+    share, left = divmod(abs(cents), len(user_ids))
+    return {user_id: sign * (share + (index < left)) for index, user_id in enumerate(user_ids)}
+
+
+def _category(name):
+    for category, pattern in CATEGORY_PATTERNS:
+        if pattern.search(name):
+            return category
+    return 'other'
+
+
+def _line_items(expense, ExpenseLineItem, ExpenseLineItemShare):
+    """Unsaved line items and shares of one itemized expense."""
+    data = expense.item_data_json
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except json.JSONDecodeError:
+            raise SkipExpense()
+    if isinstance(data, list):
+        data = {'items': data}
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list):
+        raise SkipExpense()
+
+    rate = decimal.Decimal(str(expense.fx_rate))
+    items, shares = [], []
+    for position, item in enumerate(data['items']):
+        if not isinstance(item, dict):
+            raise SkipExpense()
+        name = str(item.get('item_en') or item.get('name') or '')[:255]
+        category = str(item.get('category') or _category(name))[:32]
+        price_cents = _cents(item.get('price', 0))
+        amount_cents = int((price_cents * rate).quantize(decimal.Decimal('1'), rounding=decimal.ROUND_HALF_UP))
+        try:
+            assigned = [int(user_id) for user_id in item.get('assigned_to') or []]
+        except (TypeError, ValueError):
+            raise SkipExpense()
+
+        line_item = ExpenseLineItem(
+            expense_id=expense.id, group_id=expense.group_id, position=position, name=name,
+            category=category, currency=str(item.get('currency') or expense.currency).upper()[:3],
+            price=_money(price_cents), amount=_money(amount_cents),
+        )
+        items.append(line_item)
+        if assigned:
+            shares.extend(
+                ExpenseLineItemShare(line_item=line_item, user_id=user_id, group_id=expense.group_id,
+                                     category=category, amount=_money(cents))
+                for user_id, cents in _even_split(amount_cents, assigned).items()
+            )
+    return items, shares
+
+
+def backfill_line_items(apps, schema_editor):
+    """Normalise the item_data_json of existing itemized expenses, 500 expenses at a time."""
+    Expense = apps.get_model('api', 'Expense')
+    ExpenseLineItem = apps.get_model('api', 'ExpenseLineItem')
+    ExpenseLineItemShare = apps.get_model('api', 'ExpenseLineItemShare')
+
+    itemized = Expense.objects.filter(split_type='I', item_data_json__isnull=False).order_by('id')
+    last_id = 0
+    while True:
+        batch = list(itemized.filter(id__gt=last_id)[:500])
+        if not batch:
+            break
+        last_id = batch[-1].id
+
+        items, shares = [], []
+        for expense in batch:
+            try:
+                expense_items, expense_shares = _line_items(expense, ExpenseLineItem, ExpenseLineItemShare)
+            except SkipExpense:
+                # Older itemized expenses may hold free-form item data
+                continue
+            items.extend(expense_items)
+            shares.extend(expense_shares)
+        ExpenseLineItem.objects.bulk_create(items, batch_size=1000)
+        for share in shares:
+            share.line_item_id = share.line_item.id
+        ExpenseLineItemShare.objects.bulk_create(shares, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_receipt_parse_cache'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenseLineItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('name', models.CharField(max_length=255)),
+                ('category', models.CharField(default='other', max_length=32)),
+                ('currency', models.CharField(blank=True, max_length=3)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('expense', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='line_items', to='api.expense')),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.billgroup')),
+            ],
+            options={
+                'ordering': ['expense', 'position'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ExpenseLineItemShare',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(default='other', max_length=32)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.billgroup')),
+                ('line_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shares', to='api.expenselineitem')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='line_item_shares', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='expenselineitem',
+            index=models.Index(fields=['group', 'category'], name='line_item_group_category_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='expenselineitem',
+            unique_together={('expense', 'position')},
+        ),
+        migrations.AddIndex(
+            model_name='expenselineitemshare',
+            index=models.Index(fields=['user', 'group', 'category'], name='line_share_user_group_cat_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='expenselineitemshare',
+            unique_together={('line_item', 'user')},
+        ),
+        migrations.RunPython(backfill_line_items, migrations.RunPython.noop),
+    ]
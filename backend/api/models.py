@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 
 class Itinerary(models.Model):
@@ -152,12 +153,19 @@ class ItineraryItem(models.Model):
                 order__lte=new_order
             ).update(order=models.F('order') - 1)
         else:
-            # Moving up: shift items between new and old position down
+            # Moving up: shift items between new and old position down.
+            # The database checks (itinerary, order) uniqueness row by row, so
+            # order + 1 would collide with the next item. Park the items above
+            # temp_order first, then bring them back one position lower.
             ItineraryItem.objects.filter(
                 itinerary=self.itinerary,
                 order__gte=new_order,
                 order__lt=old_order
-            ).update(order=models.F('order') + 1)
+            ).update(order=models.F('order') + temp_order + 1)
+            ItineraryItem.objects.filter(
+                itinerary=self.itinerary,
+                order__gt=temp_order
+            ).update(order=models.F('order') - temp_order)
         
         # Now set this item to its final position
         self.order = new_order
@@ -192,6 +200,8 @@ class BillGroup(models.Model):
     """
     name = models.CharField(max_length=100)
     members = models.ManyToManyField(User, related_name="bill_groups")
+    # Every balance, settlement and total of the group is in this currency
+    currency = models.CharField(max_length=3, default='CAD')
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -210,20 +220,40 @@ class Expense(models.Model):
 
     group = models.ForeignKey(BillGroup, on_delete=models.CASCADE, related_name="expenses")
     description = models.CharField(max_length=255)
+    # In the group's currency, converted when the expense is written,
+    # so every aggregate over expenses is a plain SUM
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+
+    # --- Multi-currency ---
+    # What was actually paid, and the rate used: total_amount = original_amount * fx_rate
+    currency = models.CharField(max_length=3, default='CAD')
+    original_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    fx_rate = models.DecimalField(max_digits=20, decimal_places=10, default=1)
     
     # The user who paid the bill
     payer = models.ForeignKey(User, on_delete=models.PROTECT, related_name="paid_expenses")
     
-    date = models.DateTimeField(auto_now_add=True)
+    # When it was paid; defaults to when it was recorded (imports send their own)
+    date = models.DateTimeField(default=timezone.now)
     split_type = models.CharField(max_length=1, choices=SPLIT_TYPES, default='E')
 
     # --- For the OCR / Itemized Flow ---
     # The backend just *stores* this data for proof. 
     # The Android app will do the OCR and calculation.
     receipt_image = models.URLField(blank=True, null=True) # Optional: URL to receipt image
+    # The photo stored on this server (see api/receiptstore.py), shared by every expense using it
+    receipt = models.ForeignKey('ReceiptImage', on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name="expenses")
     item_data_json = models.TextField(blank=True, null=True) # Optional: JSON string of items
 
+    class Meta:
+        indexes = [
+            # Date-range scans of one group (timeline, analytics, exports)
+            models.Index(fields=['group', 'date'], name='expense_group_date_idx'),
+            # Largest expenses of a group
+            models.Index(fields=['group', '-total_amount'], name='expense_group_amount_idx'),
+        ]
+
     def __str__(self):
         return f"{self.description} (${self.total_amount})"
 
@@ -234,11 +264,188 @@ class ExpenseSplit(models.Model):
     """
     expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name="splits")
     user_owed = models.ForeignKey(User, on_delete=models.PROTECT, related_name="owed_splits")
+    # In the group's currency; original_amount is the share in the expense's currency
     amount_owed = models.DecimalField(max_digits=10, decimal_places=2)
+    original_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
 
     class Meta:
         # A user can only have one split entry per expense
         unique_together = ('expense', 'user_owed')
 
     def __str__(self):
-        return f"{self.user_owed.username} owes ${self.amount_owed} for {self.expense.description}"
\ No newline at end of file
+        return f"{self.user_owed.username} owes ${self.amount_owed} for {self.expense.description}"
+
+class ExpenseLineItem(models.Model):
+    """
+    One line of an itemized expense's receipt, normalised out of
+    item_data_json so item spending can be filtered and summed in SQL
+    (e.g. "what did I spend on drinks this trip").
+    - price: as printed, in `currency`
+    - amount: converted to the group's currency with the expense's fx_rate
+    """
+    expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name="line_items")
+    # Copied from the expense so group-wide item queries need no join
+    group = models.ForeignKey(BillGroup, on_delete=models.CASCADE, related_name="+")
+    position = models.PositiveIntegerField()
+    name = models.CharField(max_length=255)
+    category = models.CharField(max_length=32, default='other')
+    currency = models.CharField(max_length=3, blank=True)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        ordering = ['expense', 'position']
+        unique_together = ('expense', 'position')
+        indexes = [
+            models.Index(fields=['group', 'category'], name='line_item_group_category_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.amount})"
+
+
+class ExpenseLineItemShare(models.Model):
+    """
+    A member's share of one line item, in the group's currency.
+    `group` and `category` are copied from the line item so one index
+    answers "this member's spending per category in this group".
+    """
+    line_item = models.ForeignKey(ExpenseLineItem, on_delete=models.CASCADE, related_name="shares")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="line_item_shares")
+    group = models.ForeignKey(BillGroup, on_delete=models.CASCADE, related_name="+")
+    category = models.CharField(max_length=32, default='other')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        unique_together = ('line_item', 'user')
+        indexes = [
+            models.Index(fields=['user', 'group', 'category'], name='line_share_user_group_cat_idx'),
+        ]
+
+
+class GroupBalance(models.Model):
+    """
+    Materialised net balance of one member in one BillGroup, in integer cents.
+    Positive = the member is owed money. Kept up to date by api/ledger.py
+    whenever expenses or settlements are written, so reading a group's
+    balances never has to scan its expense history.
+    """
+    group = models.ForeignKey(BillGroup, on_delete=models.CASCADE, related_name="member_balances")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="group_balances")
+    net_cents = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('group', 'user')
+
+    def __str__(self):
+        return f"{self.user.username} in {self.group.name}: {self.net_cents / 100:.2f}"
+
+
+class Settlement(models.Model):
+    """
+    A recorded payment between two members, e.g. Bob paying Alice back $30.
+    Moves from_user's balance up and to_user's balance down by `amount`.
+    """
+    group = models.ForeignKey(BillGroup, on_delete=models.CASCADE, related_name="payments")
+    from_user = models.ForeignKey(User, on_delete=models.PROTECT, related_name="settlements_paid")
+    to_user = models.ForeignKey(User, on_delete=models.PROTECT, related_name="settlements_received")
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    note = models.CharField(max_length=255, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name="settlements_created")
+    date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-date']
+
+    def __str__(self):
+        return f"{self.from_user.username} paid {self.to_user.username} ${self.amount}"
+
+
+class BalanceCheckpoint(models.Model):
+    """
+    Snapshot of a group's balances covering every expense with
+    id <= last_expense_id and every settlement with id <= last_settlement_id.
+    Recomputing balances starts from the latest checkpoint and only
+    aggregates the activity after it.
+    """
+    group = models.ForeignKey(BillGroup, on_delete=models.CASCADE, related_name="checkpoints")
+    last_expense_id = models.BigIntegerField(default=0)
+    last_settlement_id = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Checkpoint of {self.group.name} at expense {self.last_expense_id}"
+
+
+class BalanceCheckpointEntry(models.Model):
+    """
+    One member's net balance (in cents) in a BalanceCheckpoint.
+    Members with a zero balance have no entry.
+    """
+    checkpoint = models.ForeignKey(BalanceCheckpoint, on_delete=models.CASCADE, related_name="entries")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    net_cents = models.BigIntegerField()
+
+    class Meta:
+        unique_together = ('checkpoint', 'user')
+
+
+class GroupDailyRollup(models.Model):
+    """
+    Per (group, day, member) spending totals in cents, maintained by
+    api/ledger.py on every expense write. Group analytics read these
+    instead of scanning expenses.
+    - paid_cents / expense_count: expenses this member paid that day
+    - owed_cents: this member's share of that day's expenses
+    """
+    group = models.ForeignKey(BillGroup, on_delete=models.CASCADE, related_name="daily_rollups")
+    day = models.DateField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    paid_cents = models.BigIntegerField(default=0)
+    owed_cents = models.BigIntegerField(default=0)
+    expense_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('group', 'day', 'user')
+
+    def __str__(self):
+        return f"{self.group.name} {self.day} {self.user.username}"
+
+
+class ReceiptParseCache(models.Model):
+    """
+    A parsed receipt, so the same photo is never sent to Gemini twice.
+    Looked up by the SHA-256 of the preprocessed image (exact resubmits, any user).
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    model_name = models.CharField(max_length=64)
+    image_sha256 = models.CharField(max_length=64)
+    # Receipt.model_dump(), before currency conversion
+    result = models.JSONField()
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_hit_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('image_sha256', 'model_name')
+
+    def __str__(self):
+        return f"Receipt {self.image_sha256[:12]} ({self.hits} hits)"
+
+
+class ReceiptImage(models.Model):
+    """
+    An uploaded receipt photo, stored once on disk under the SHA-256 of its
+    bytes (see api/receiptstore.py). The same photo parsed again, attached
+    to several expenses or uploaded by several members is one row and one file.
+    """
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    content_type = models.CharField(max_length=64)
+    size = models.PositiveIntegerField()
+    # Everyone who uploaded it may view it, attached to an expense or not
+    uploaded_by = models.ManyToManyField(User, related_name="receipt_images")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Receipt image {self.sha256[:12]} ({self.size} bytes)"
@@ -0,0 +1,71 @@
+"""
+Persistent cache of parsed receipts (see ReceiptParseCache).
+
+Entries are keyed by the SHA-256 of the preprocessed image: the same photo
+uploaded again after a network glitch, by anyone, costs one indexed lookup.
+Near-identical photos are not matched. Two receipts printed from the same
+template differ only in a few glyphs, less than a re-encode of one photo
+changes its pixels, so a perceptual hash or thumbnail cannot tell a
+re-shot from a different bill; a wrong hit would fill an expense with
+another receipt's amounts.
+
+Entries older than RECEIPT_CACHE_DAYS are ignored, and removed by
+`manage.py prune_receipt_cache`.
+"""
+import datetime
+from dataclasses import dataclass
+from typing import Optional
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ReceiptParseCache
+
+
+@dataclass
+class CacheHit:
+    result: dict
+    kind: str = 'exact'
+
+
+def _cutoff():
+    return timezone.now() - datetime.timedelta(days=settings.RECEIPT_CACHE_DAYS)
+
+
+def _fresh():
+    return ReceiptParseCache.objects.filter(created_at__gte=_cutoff())
+
+
+def lookup(model_name, image_sha256) -> Optional[CacheHit]:
+    """Find a cached parse of exactly this image."""
+    entry = _fresh().filter(model_name=model_name, image_sha256=image_sha256).values('id', 'result').first()
+    if entry is None:
+        return None
+    _record_hit(entry['id'])
+    return CacheHit(entry['result'])
+
+
+def store(user, model_name, image_sha256, result):
+    """Cache a parse result. A concurrent store of the same image is ignored."""
+    # An expired entry for the same image would block the insert
+    ReceiptParseCache.objects.filter(
+        image_sha256=image_sha256, model_name=model_name, created_at__lt=_cutoff()
+    ).delete()
+    ReceiptParseCache.objects.bulk_create([
+        ReceiptParseCache(
+            user=user, model_name=model_name, image_sha256=image_sha256, result=result,
+        )
+    ], ignore_conflicts=True)
+
+
+def _record_hit(entry_id):
+    ReceiptParseCache.objects.filter(id=entry_id).update(hits=F('hits') + 1, last_hit_at=timezone.now())
+
+
+def prune(days=None):
+    """Delete entries older than `days` (default RECEIPT_CACHE_DAYS). Returns how many."""
+    days = settings.RECEIPT_CACHE_DAYS if days is None else days
+    cutoff = timezone.now() - datetime.timedelta(days=days)
+    deleted, _ = ReceiptParseCache.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
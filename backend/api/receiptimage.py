@@ -0,0 +1,148 @@
+"""
+Receipt photo preprocessing before it is sent to Gemini.
+
+Phone photos are 4-12 MB; the text on a receipt reads just as well from a
+~1600px grayscale JPEG of a few hundred KB. The pipeline:
+1. JPEG draft mode: libjpeg decodes directly at 1/2, 1/4 or 1/8 scale,
+   so a 12 MP photo is never fully decoded.
+2. EXIF orientation is applied, so the text is upright.
+3. Grayscale, downscaled to RECEIPT_MAX_DIMENSION.
+4. Autocontrast to normalise faded or dim receipts, re-encoded as JPEG.
+
+Uploads larger than RECEIPT_MAX_UPLOAD_BYTES are refused before they are
+buffered: by Content-Length up front, and by LimitedUploadHandler while
+the multipart body streams in.
+"""
+import io
+import time
+from dataclasses import dataclass
+
+import PIL.Image
+import PIL.ImageOps
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+
+
+class ImageRejected(ValueError):
+    """The upload is not an image we can process."""
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    original_bytes: int
+    duration_ms: float
+
+    @property
+    def sent_bytes(self):
+        return len(self.data)
+
+
+def preprocess_receipt(raw, max_dimension=None, quality=None):
+    """
+    Turn an uploaded photo into a small grayscale JPEG for OCR.
+
+    Returns:
+        PreparedImage
+    Raises:
+        ImageRejected if the bytes are not a readable image or too many pixels
+    """
+    max_dimension = max_dimension or settings.RECEIPT_MAX_DIMENSION
+    quality = quality or settings.RECEIPT_JPEG_QUALITY
+    started = time.perf_counter()
+
+    try:
+        img = PIL.Image.open(io.BytesIO(raw))
+    except (PIL.Image.DecompressionBombError, PIL.Image.DecompressionBombWarning):
+        # Pillow's own bomb check (the warning only raises under -W error)
+        raise ImageRejected("The image is too large.")
+    except (PIL.UnidentifiedImageError, OSError):
+        raise ImageRejected("The uploaded file is not a supported image.")
+
+    # The header is parsed, the pixels are not: refuse decompression bombs here
+    if img.width * img.height > settings.RECEIPT_MAX_PIXELS:
+        raise ImageRejected(f"The image is too large ({img.width}x{img.height}).")
+
+    try:
+        # Step 1: Decode JPEGs at the smallest scale still >= the target size
+        # (the requested box keeps the aspect ratio, or the short side would block any reduction)
+        if img.format == 'JPEG':
+            scale = min(1.0, max_dimension / max(img.size))
+            img.draft('L', (int(img.width * scale), int(img.height * scale)))
+
+        # Step 2: Upright, whatever way the phone was held
+        img = PIL.ImageOps.exif_transpose(img)
+
+        # Step 3: Grayscale, downscaled
+        img = img.convert('L')
+        img.thumbnail((max_dimension, max_dimension), PIL.Image.LANCZOS)
+
+        # Step 4: Stretch the contrast (ignoring 1% outliers) and re-encode
+        img = PIL.ImageOps.autocontrast(img, cutoff=1)
+        out = io.BytesIO()
+        img.save(out, format='JPEG', quality=quality, optimize=True)
+    except (OSError, ValueError) as e:
+        raise ImageRejected(f"The image could not be decoded: {e}")
+
+    return PreparedImage(
+        data=out.getvalue(),
+        mime_type='image/jpeg',
+        width=img.width,
+        height=img.height,
+        original_bytes=len(raw),
+        duration_ms=(time.perf_counter() - started) * 1000,
+    )
+
+
+
+class LimitedUploadHandler(FileUploadHandler):
+    """
+    Upload handler that stops reading a multipart body once a file passes
+    `max_bytes`. Put it first so nothing past the limit is buffered by the
+    memory / temporary-file handlers behind it.
+    """
+
+    def __init__(self, request=None, max_bytes=None):
+        super().__init__(request)
+        self.max_bytes = max_bytes or settings.RECEIPT_MAX_UPLOAD_BYTES
+        self.exceeded = False
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.max_bytes:
+            self.exceeded = True
+            # The rest of the body is read and discarded, so the client still gets a response
+            raise StopUpload(connection_reset=False)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+def limit_upload_size(request, max_bytes=None, max_files=1):
+    """
+    Enforce the upload limit on a DRF request before its body is parsed.
+    `max_bytes` applies to each file; the whole body may hold `max_files` of them.
+
+    Returns:
+        (handler, too_large): too_large is True when Content-Length is already over the limit;
+        otherwise check handler.exceeded after reading request.data
+    """
+    max_bytes = max_bytes or settings.RECEIPT_MAX_UPLOAD_BYTES
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        content_length = 0
+
+    handler = LimitedUploadHandler(request._request, max_bytes)
+    if content_length > max_bytes * max_files:
+        return handler, True
+    request._request.upload_handlers.insert(0, handler)
+    return handler, False
+
+
+def server_timing(timings):
+    """Format {"name": milliseconds} as a Server-Timing header value."""
+    return ', '.join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
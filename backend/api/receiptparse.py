@@ -0,0 +1,133 @@
+"""
+The receipt parsing pipeline shared by the single, batch and
+receipt-to-expense endpoints:
+
+    preprocess (api/receiptimage.py) -> parse cache (api/receiptcache.py)
+    -> Gemini (through the GenAI transport) -> FX conversion (api/fx.py)
+
+Everything here is safe to run from worker threads; callers running it in
+a thread must close that thread's database connection when done.
+"""
+import hashlib
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+import google.generativeai as genai
+from django.conf import settings
+
+from . import receiptcache
+from .fx import get_fx_service
+from .genaifakes import fake_receipt_payload
+from .genaitransport import get_transport
+from .receiptimage import PreparedImage, preprocess_receipt, server_timing
+from .schema import Receipt
+
+MODEL_NAME = 'gemini-2.5-flash'
+PROMPT = "Extract all line items from this receipt. Follow the schema."
+
+logger = logging.getLogger(__name__)
+
+
+class GeminiNotConfigured(RuntimeError):
+    """Live Gemini calls are needed but GEMINI_API_KEY is not set."""
+
+
+@dataclass
+class ParsedReceipt:
+    data: Dict
+    image: PreparedImage
+    cache_status: str  # 'exact' or 'miss'
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def cached(self):
+        return self.cache_status != 'miss'
+
+
+def configure_gemini(transport=None):
+    """Configure the SDK with GEMINI_API_KEY (not needed by replay/fake transports)."""
+    transport = transport or get_transport()
+    if transport.offline:
+        return
+    if not settings.GEMINI_API_KEY:
+        raise GeminiNotConfigured("GEMINI_API_KEY not configured on server.")
+    genai.configure(api_key=settings.GEMINI_API_KEY)
+
+
+def parse_receipt(user, raw, target_currency='CAD', transport=None) -> ParsedReceipt:
+    """
+    Parse one uploaded receipt photo.
+
+    Returns:
+        ParsedReceipt whose data is the Receipt dict, each item with a
+        `price_in_<target>` converted amount
+    Raises:
+        ImageRejected for unreadable images; Gemini, validation and FX errors as they come
+    """
+    transport = transport or get_transport()
+    fx = get_fx_service()
+    # Refresh stale FX rates in the background, overlapping the Gemini call
+    fx.prefetch()
+
+    # Step 1: Shrink the photo
+    # The hash of what is sent identifies the image for recorded/replayed responses
+    image = preprocess_receipt(raw)
+    image_digest = hashlib.sha256(image.data).hexdigest()
+    timings = {"preprocess": image.duration_ms}
+
+    # Step 2: Same photo parsed before? Then skip Gemini
+    started = time.perf_counter()
+    hit = receiptcache.lookup(MODEL_NAME, image_digest)
+    timings["cache"] = (time.perf_counter() - started) * 1000
+
+    if hit:
+        data = Receipt.model_validate(hit.result).model_dump()
+    else:
+        def _call_gemini():
+            # Send the JPEG bytes as they are, so the SDK does not re-encode them
+            img = {"mime_type": image.mime_type, "data": image.data}
+            model = genai.GenerativeModel(MODEL_NAME)
+            response = model.generate_content(
+                [PROMPT, img],
+                generation_config=genai.GenerationConfig(
+                    response_schema=Receipt,  # Enforce the Pydantic schema
+                    response_mime_type="application/json"
+                )
+            )
+            return {"text": response.text}
+
+        # Step 3: Call Gemini and validate its JSON against the schema
+        started = time.perf_counter()
+        payload = transport.call(
+            'receipt',
+            {"model": MODEL_NAME, "prompt": PROMPT, "image_sha256": image_digest},
+            live=_call_gemini,
+            fake=lambda: fake_receipt_payload(image_digest)
+        )
+        timings["gemini"] = (time.perf_counter() - started) * 1000
+
+        data = Receipt.model_validate_json(payload["text"]).model_dump()
+        receiptcache.store(user, MODEL_NAME, image_digest, data)
+
+    # Step 4: Convert every item in one pass (rates are cached, see api/fx.py)
+    started = time.perf_counter()
+    converted = fx.convert_many(
+        [(item["price"], item["currency"]) for item in data["items"]], target=target_currency
+    )
+    for item, price in zip(data["items"], converted):
+        item[f"price_in_{target_currency.lower()}"] = price
+    timings["fx"] = (time.perf_counter() - started) * 1000
+
+    return ParsedReceipt(data, image, hit.kind if hit else 'miss', timings)
+
+
+def log_parse(parsed: ParsedReceipt, label: Optional[str] = None):
+    """Log bytes uploaded vs sent, cache status and timings."""
+    image = parsed.image
+    logger.info(
+        "Receipt image %s: %d -> %d bytes (%dx%d), cache %s, %s",
+        label or '-', image.original_bytes, image.sent_bytes, image.width, image.height,
+        parsed.cache_status, server_timing(parsed.timings),
+    )
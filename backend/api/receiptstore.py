@@ -0,0 +1,147 @@
+"""
+Content-addressed storage of receipt photos on local disk.
+
+Each upload is stored once, under the SHA-256 of its bytes:
+
+    RECEIPT_STORAGE_DIR/ab/cd/abcd...            the photo as uploaded
+    RECEIPT_STORAGE_DIR/thumbs/160/ab/abcd....jpg  thumbnails, made on first request
+
+The same photo parsed twice, attached to several expenses or uploaded by
+several members is one file and one ReceiptImage row. Files never change
+once written, so they are served with an ETag and a year-long
+Cache-Control (see ReceiptImageView).
+"""
+import datetime
+import hashlib
+import io
+import os
+import tempfile
+from pathlib import Path
+
+import PIL.Image
+import PIL.ImageOps
+from django.conf import settings
+from django.db.models import Q
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import ReceiptImage
+
+THUMBNAIL_QUALITY = 75
+
+
+def _root():
+    return Path(settings.RECEIPT_STORAGE_DIR)
+
+
+def original_path(sha256):
+    return _root() / sha256[:2] / sha256[2:4] / sha256
+
+
+def thumbnail_path(sha256, size):
+    return _root() / 'thumbs' / str(size) / sha256[:2] / f"{sha256}.jpg"
+
+
+def _write_atomic(path, data):
+    """Write to a temporary file and rename it, so readers never see half a file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def save_receipt_image(user, raw):
+    """
+    Store an uploaded photo (if not stored already) and record `user` as one of its uploaders.
+    Call it after the photo went through preprocess_receipt, which rejects non-images.
+
+    Returns:
+        ReceiptImage
+    """
+    sha256 = hashlib.sha256(raw).hexdigest()
+    path = original_path(sha256)
+    if not path.exists():
+        _write_atomic(path, raw)
+
+    try:
+        image_format = PIL.Image.open(io.BytesIO(raw)).format
+    except (PIL.UnidentifiedImageError, OSError):
+        image_format = None
+    # A concurrent upload of the same photo is ignored
+    ReceiptImage.objects.bulk_create([
+        ReceiptImage(
+            sha256=sha256, size=len(raw),
+            content_type=PIL.Image.MIME.get(image_format, 'application/octet-stream'),
+        )
+    ], ignore_conflicts=True)
+    image = ReceiptImage.objects.get(sha256=sha256)
+    image.uploaded_by.add(user)
+    return image
+
+
+def accessible_images(user):
+    """Photos `user` uploaded, or attached to expenses of their groups."""
+    return ReceiptImage.objects.filter(
+        Q(uploaded_by=user) | Q(expenses__group__members=user)
+    ).distinct()
+
+
+def ensure_thumbnail(sha256, size):
+    """
+    Path of the `size` px thumbnail, generated from the original on first use.
+    Two requests racing on a new thumbnail both write the same bytes; the
+    rename makes that harmless.
+    """
+    path = thumbnail_path(sha256, size)
+    if path.exists():
+        return path
+
+    with PIL.Image.open(original_path(sha256)) as img:
+        # Decode JPEGs at reduced scale, as in api/receiptimage.py
+        if img.format == 'JPEG':
+            scale = min(1.0, size / max(img.size))
+            img.draft('RGB', (int(img.width * scale), int(img.height * scale)))
+        thumb = PIL.ImageOps.exif_transpose(img).convert('RGB')
+    thumb.thumbnail((size, size), PIL.Image.LANCZOS)
+
+    out = io.BytesIO()
+    thumb.save(out, format='JPEG', quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+    _write_atomic(path, out.getvalue())
+    return path
+
+
+def receipt_urls(sha256):
+    """What clients need to show a stored photo: {"id", "url", "thumbnail_url"}."""
+    if not sha256:
+        return None
+    return {
+        "id": sha256,
+        "url": reverse('receipt-image', args=[sha256]),
+        "thumbnail_url": reverse('receipt-thumbnail', args=[sha256]),
+    }
+
+
+def prune(days=None):
+    """
+    Delete photos attached to no expense and uploaded more than `days`
+    (default RECEIPT_CACHE_DAYS) ago, with their thumbnails. Returns how many.
+    """
+    days = settings.RECEIPT_CACHE_DAYS if days is None else days
+    cutoff = timezone.now() - datetime.timedelta(days=days)
+    orphans = list(
+        ReceiptImage.objects.filter(created_at__lt=cutoff, expenses__isnull=True)
+        .values_list('sha256', flat=True)
+    )
+    for sha256 in orphans:
+        paths = [original_path(sha256)]
+        paths += [thumbnail_path(sha256, size) for size in settings.RECEIPT_THUMBNAIL_SIZES]
+        for path in paths:
+            path.unlink(missing_ok=True)
+    ReceiptImage.objects.filter(sha256__in=orphans).delete()
+    return len(orphans)
@@ -0,0 +1,193 @@
+"""
+Destination recommendations over the country ratings matrix.
+
+The ratings of every country (see api/countries.py) are held as NumPy
+columns: a float32 (countries x categories) score matrix and an int8
+safety-advisory column. A query is a few whole-column operations:
+
+    mask   = AND of (scores[:, c] >= min_c), (scores[:, c] <= max_c), (safety <= level)
+    score  = scores[mask] @ weights / sum(weights)        (weighted 1-5 score)
+    top k  = argpartition (O(n)), then only those k sorted
+
+With ~250 countries this takes tens of microseconds. Building the matrix
+takes under 0.1 s; gunicorn builds it in every worker as it starts (see
+gunicorn.conf.py), so no request pays for it. Anything else, like
+runserver or a management command, builds it on the first recommendation.
+"""
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List
+
+import numpy as np
+
+from .countries import ratings_index
+
+CATEGORIES = [
+    'cultural_historical', 'natural_beauty', 'relaxation', 'shopping',
+    'entertainment_nightlife', 'budget_friendliness',
+]
+
+# Short names accepted in queries ("budget" for budget_friendliness)
+CATEGORY_ALIASES = {
+    'cultural': 'cultural_historical',
+    'natural': 'natural_beauty',
+    'nature': 'natural_beauty',
+    'entertainment': 'entertainment_nightlife',
+    'nightlife': 'entertainment_nightlife',
+    'budget': 'budget_friendliness',
+}
+
+# Travel advisory levels, least to most severe, as in the ratings file
+SAFETY_LEVELS = [
+    'Take normal security precautions',
+    'Exercise a high degree of caution',
+    'Avoid non-essential travel',
+    'Avoid all travel',
+]
+SAFETY_ALIASES = {'normal': 0, 'caution': 1, 'avoid-non-essential': 2, 'avoid-all': 3}
+
+
+class InvalidQuery(ValueError):
+    """A filter, weight or level that does not exist."""
+
+
+def category_column(name):
+    """Column index of a category, by full or short name."""
+    name = CATEGORY_ALIASES.get(name, name)
+    try:
+        return CATEGORIES.index(name)
+    except ValueError:
+        raise InvalidQuery(
+            f"Unknown category '{name}'. Use one of: {', '.join(CATEGORIES + list(CATEGORY_ALIASES))}."
+        )
+
+
+def safety_level(name):
+    try:
+        return SAFETY_ALIASES[name]
+    except KeyError:
+        raise InvalidQuery(f"Unknown safety level '{name}'. Use one of: {', '.join(SAFETY_ALIASES)}.")
+
+
+def parse_query(params, max_k=50):
+    """
+    Turn query parameters into RatingsMatrix.recommend() arguments:
+        min_<category>=4, max_<category>=2   score bounds ("min_budget=4")
+        weights=cultural:2,budget:1          default: every category 1
+        safety=normal|caution|avoid-non-essential|avoid-all
+                                             most severe advisory allowed (default: no filter)
+        k=10                                 how many results (1 to max_k)
+    Raises:
+        InvalidQuery
+    """
+    query = {'minimum': {}, 'maximum': {}, 'weights': {}}
+    try:
+        for key, value in params.items():
+            if key.startswith('min_'):
+                query['minimum'][category_column(key[4:])] = float(value)
+            elif key.startswith('max_'):
+                query['maximum'][category_column(key[4:])] = float(value)
+
+        for pair in filter(None, params.get('weights', '').split(',')):
+            name, _, weight = pair.partition(':')
+            query['weights'][category_column(name.strip())] = float(weight or 1)
+        if any(weight < 0 for weight in query['weights'].values()):
+            raise InvalidQuery("Weights cannot be negative.")
+
+        query['max_safety'] = safety_level(params['safety']) if 'safety' in params else None
+        query['k'] = int(params.get('k', 10))
+    except InvalidQuery:
+        raise
+    except ValueError as e:
+        raise InvalidQuery(f"Invalid number: {e}")
+    if not 1 <= query['k'] <= max_k:
+        raise InvalidQuery(f"'k' must be between 1 and {max_k}.")
+    return query
+
+
+@dataclass
+class RatingsMatrix:
+    countries: List[Dict]   # the index's entries, row i is countries[i]
+    scores: np.ndarray      # float32 (n, len(CATEGORIES)), 1-5, 0 where unrated
+    safety: np.ndarray      # int8 (n,), index into SAFETY_LEVELS, len(SAFETY_LEVELS) if unknown
+
+    def recommend(self, minimum=None, maximum=None, weights=None, max_safety=None, k=10):
+        """
+        Top `k` countries by weighted score among those passing every filter.
+
+        Args:
+            minimum / maximum: {column: score} bounds, inclusive
+            weights: {column: weight}; every category weighs 1 by default
+            max_safety: most severe advisory level allowed (SAFETY_LEVELS index);
+                None keeps every country, including those without an advisory
+        Returns:
+            [(row, score)], best first
+        """
+        # Step 1: Filter, one boolean column at a time
+        mask = np.ones(len(self.countries), dtype=bool)
+        if max_safety is not None:
+            mask &= self.safety <= max_safety
+        for column, bound in (minimum or {}).items():
+            mask &= self.scores[:, column] >= bound
+        for column, bound in (maximum or {}).items():
+            mask &= self.scores[:, column] <= bound
+        rows = np.flatnonzero(mask)
+        if rows.size == 0 or k <= 0:
+            return []
+
+        # Step 2: Weighted score of the remaining rows, in one matrix-vector product
+        weight_vector = np.ones(len(CATEGORIES), dtype=np.float32)
+        if weights:
+            weight_vector[:] = 0
+            for column, weight in weights.items():
+                weight_vector[column] = weight
+        total_weight = weight_vector.sum()
+        if total_weight <= 0:
+            raise InvalidQuery("At least one weight must be positive.")
+        row_scores = self.scores[rows] @ (weight_vector / total_weight)
+
+        # Step 3: Top k without sorting everything, then sort just those (equal scores in file order)
+        if k < rows.size:
+            top = np.argpartition(-row_scores, k - 1)[:k]
+        else:
+            top = np.arange(rows.size)
+        top = top[np.lexsort((rows[top], -row_scores[top]))]
+        return [(int(rows[i]), float(row_scores[i])) for i in top]
+
+
+def build_ratings_matrix(index=None) -> RatingsMatrix:
+    index = index or ratings_index()
+    countries = index.countries
+    scores = np.zeros((len(countries), len(CATEGORIES)), dtype=np.float32)
+    safety = np.full(len(countries), len(SAFETY_LEVELS), dtype=np.int8)
+    for row, country in enumerate(countries):
+        for column, category in enumerate(CATEGORIES):
+            value = (country.get(category) or {}).get('value')
+            if isinstance(value, (int, float)):
+                scores[row, column] = value
+        status = (country.get('safety') or {}).get('status')
+        if status in SAFETY_LEVELS:
+            safety[row] = SAFETY_LEVELS.index(status)
+    # Read-only: shared by every request of the worker
+    scores.flags.writeable = False
+    safety.flags.writeable = False
+    return RatingsMatrix(countries, scores, safety)
+
+
+@lru_cache(maxsize=None)
+def ratings_matrix() -> RatingsMatrix:
+    """The matrix of this worker, built when gunicorn starts it or on first use."""
+    return build_ratings_matrix()
+
+
+def recommendation(matrix: RatingsMatrix, row: int, score: float) -> Dict:
+    """One result as sent to clients."""
+    country = matrix.countries[row]
+    level = int(matrix.safety[row])
+    return {
+        "code": country['code'],
+        "name": country['destination_name'],
+        "score": round(score, 2),
+        "ratings": {category: int(matrix.scores[row, column]) for column, category in enumerate(CATEGORIES)},
+        "safety": SAFETY_LEVELS[level] if level < len(SAFETY_LEVELS) else None,
+    }
@@ -1,6 +1,14 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Itinerary, ItineraryItem, BillGroup, Expense, ExpenseSplit # Add new models
+from django.db import transaction
+from .models import Itinerary, ItineraryItem, BillGroup, Expense, ExpenseSplit, Settlement # Add new models
+from .ledger import (
+    from_cents, invalidate_checkpoints, record_expense, record_settlement, reverse_expense, to_cents
+)
+from .splits import SplitError, allocate_cents, even_split, itemized_split
+from .fx import FXUnavailable, get_fx_service
+from .lineitems import replace_line_items, write_line_items
+from .receiptstore import accessible_images, receipt_urls
 import decimal
 
 class UserSimpleSerializer(serializers.ModelSerializer):
@@ -111,7 +119,7 @@ class ExpenseSplitReadSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = ExpenseSplit
-        fields = ['user_owed', 'user_owed_username', 'amount_owed']
+        fields = ['user_owed', 'user_owed_username', 'amount_owed', 'original_amount']
 
 
 class ExpenseSerializer(serializers.ModelSerializer):
@@ -119,16 +127,33 @@ class ExpenseSerializer(serializers.ModelSerializer):
     Serializer for creating a new Expense.
     This is the "nested" serializer.
     """
-    # This 'splits' field will accept a *list* of ExpenseSplit objects
-    splits = ExpenseSplitSerializer(many=True, write_only=True)
+    # This 'splits' field will accept a *list* of ExpenseSplit objects.
+    # It can be left out for even ('E') and itemized ('I') expenses: the
+    # server then computes the splits (see api/splits.py).
+    splits = ExpenseSplitSerializer(many=True, write_only=True, required=False)
     payer_id = serializers.IntegerField(write_only=True)
+    # Who shares an even split when 'splits' is left out (default: every member)
+    participants = serializers.ListField(
+        child=serializers.IntegerField(), write_only=True, required=False
+    )
 
     class Meta:
         model = Expense
         fields = [
             'id', 'group', 'description', 'total_amount', 'date', 'payer_id', 
-            'split_type', 'receipt_image', 'item_data_json', 'splits'
+            'split_type', 'receipt_image', 'receipt', 'item_data_json', 'splits', 'participants',
+            'currency', 'original_amount', 'fx_rate'
         ]
+        # total_amount and the splits are sent in `currency`; the server converts them
+        read_only_fields = ['original_amount', 'fx_rate']
+
+    def validate_receipt(self, value):
+        """A stored photo (the "id" from a parse response) can only be attached by someone who may see it."""
+        request = self.context.get('request')
+        if value is not None and request is not None:
+            if not accessible_images(request.user).filter(sha256=value.sha256).exists():
+                raise serializers.ValidationError("Receipt image not found.")
+        return value
 
     def validate(self, data):
         """
@@ -136,38 +161,60 @@ class ExpenseSerializer(serializers.ModelSerializer):
         1. The payer exists and is a member of the group
         2. All users in splits exist and are members of the group
         3. The sum of the splits equals the total_amount
+        Then converts the amounts to the group's currency.
         """
+        # On PATCH, fields that are not sent keep their current values
+        # (amounts as originally entered, in the expense's currency)
+        if self.partial and self.instance is not None:
+            # Changing any of these re-computes server-side splits
+            recompute = any(key in data for key in ('participants', 'total_amount', 'split_type', 'item_data_json'))
+            data.setdefault('group', self.instance.group)
+            data.setdefault('payer_id', self.instance.payer_id)
+            data.setdefault('total_amount', self.instance.original_amount or self.instance.total_amount)
+            data.setdefault('split_type', self.instance.split_type)
+            data.setdefault('item_data_json', self.instance.item_data_json)
+            data.setdefault('currency', self.instance.currency)
+            if 'splits' not in data and not recompute:
+                data['splits'] = [
+                    {'user_owed_id': split.user_owed_id,
+                     'amount_owed': split.original_amount if split.original_amount is not None else split.amount_owed}
+                    for split in self.instance.splits.all()
+                ]
+
         group = data['group']
         payer_id = data['payer_id']
-        
-        # Check if payer exists
-        try:
-            payer = User.objects.get(id=payer_id)
-        except User.DoesNotExist:
-            raise serializers.ValidationError(
-                f"Payer with ID {payer_id} does not exist."
-            )
-        
-        # Check if payer is a member of the group
-        if payer not in group.members.all():
+
+        # Load the member ids once; every check below is a set lookup
+        # (bulk imports pass them in the context, shared by every row)
+        member_ids = self.context.get('member_ids')
+        if member_ids is None:
+            member_ids = set(group.members.values_list('id', flat=True))
+
+        # No splits sent: compute them from the compact input
+        if not data.get('splits'):
+            data['splits'] = self._compute_splits(data, member_ids)
+
+        # Check if payer exists and is a member of the group
+        if payer_id not in member_ids:
             raise serializers.ValidationError(
-                f"Payer '{payer.username}' is not a member of this group."
+                self._not_member_message(payer_id, "Payer with ID {id} does not exist.",
+                                         "Payer '{username}' is not a member of this group.")
             )
         
         # Check if all users in splits exist and are members
+        seen = set()
         for split_data in data['splits']:
             user_owed_id = split_data['user_owed_id']
-            try:
-                user_owed = User.objects.get(id=user_owed_id)
-            except User.DoesNotExist:
+            if user_owed_id not in member_ids:
                 raise serializers.ValidationError(
-                    f"User with ID {user_owed_id} in splits does not exist."
+                    self._not_member_message(user_owed_id, "User with ID {id} in splits does not exist.",
+                                             "User '{username}' in splits is not a member of this group.")
                 )
-            
-            if user_owed not in group.members.all():
+            if user_owed_id in seen:
                 raise serializers.ValidationError(
-                    f"User '{user_owed.username}' in splits is not a member of this group."
+                    f"User with ID {user_owed_id} appears more than once in splits."
                 )
+            seen.add(user_owed_id)
         
         # Check that the sum of the splits equals the total_amount
         total_split = sum(
@@ -182,32 +229,186 @@ class ExpenseSerializer(serializers.ModelSerializer):
                 f"The sum of splits (${total_split}) does not "
                 f"match the total_amount (${total_amount})."
             )
-        
+
+        self._convert_to_group_currency(data, group)
         return data
 
+    def _exchange_rate(self, currency, group):
+        """
+        Rate from `currency` to the group's currency, captured now.
+        An edit that keeps the expense's group and currency keeps its original rate.
+        """
+        if currency == group.currency:
+            return decimal.Decimal(1)
+        instance = self.instance
+        if instance is not None and instance.currency == currency and instance.group_id == group.id:
+            return instance.fx_rate
+
+        # Bulk imports share the rates already looked up through the context
+        rates = self.context.setdefault('fx_rates', {})
+        key = (currency, group.currency)
+        if key not in rates:
+            try:
+                rate = get_fx_service().rate(currency, group.currency)
+            except FXUnavailable as e:
+                raise serializers.ValidationError(str(e))
+            rates[key] = decimal.Decimal(str(rate)).quantize(decimal.Decimal('1e-10'))
+        return rates[key]
+
+    def _convert_to_group_currency(self, data, group):
+        """
+        Keep the entered amounts as original_amount and store total_amount and
+        amount_owed in the group's currency. The converted splits are allocated
+        from the converted total, so they still add up to it exactly.
+        """
+        currency = (data.get('currency') or group.currency).upper()
+        if len(currency) != 3 or not currency.isalpha():
+            raise serializers.ValidationError(f"'{currency}' is not a currency code.")
+        rate = self._exchange_rate(currency, group)
+
+        original_cents = to_cents(data['total_amount'])
+        split_cents = [to_cents(split['amount_owed']) for split in data['splits']]
+        group_cents = to_cents(from_cents(original_cents) * rate)
+
+        if rate == 1 or not original_cents:
+            converted = split_cents if rate == 1 else [0] * len(split_cents)
+        else:
+            sign = -1 if original_cents < 0 else 1
+            try:
+                converted = allocate_cents(group_cents, [sign * cents for cents in split_cents])
+            except SplitError as e:
+                raise serializers.ValidationError(str(e))
+
+        data['currency'] = currency
+        data['fx_rate'] = rate
+        data['original_amount'] = from_cents(original_cents)
+        data['total_amount'] = from_cents(group_cents)
+        for split, cents in zip(data['splits'], converted):
+            split['original_amount'] = split['amount_owed']
+            split['amount_owed'] = from_cents(cents)
+
+    @staticmethod
+    def _compute_splits(data, member_ids):
+        """
+        Build the splits for an expense sent without them:
+        - 'E': the total shared evenly by `participants` (or every member)
+        - 'I': item assignments from item_data_json, tax/tip proportional
+        """
+        split_type = data.get('split_type', 'E')
+        total_cents = to_cents(data['total_amount'])
+
+        try:
+            if split_type == 'E':
+                participants = data.get('participants') or sorted(member_ids)
+                shares = even_split(total_cents, participants)
+            elif split_type == 'I':
+                shares = itemized_split(total_cents, data.get('item_data_json'))
+            else:
+                raise serializers.ValidationError("'splits' is required for manual ('M') expenses.")
+        except SplitError as e:
+            raise serializers.ValidationError(str(e))
+
+        return [
+            {'user_owed_id': user_id, 'amount_owed': from_cents(cents)}
+            for user_id, cents in shares.items()
+        ]
+
+    @staticmethod
+    def _not_member_message(user_id, missing, not_member):
+        # Only reached on invalid input, so the extra lookup is fine here
+        username = User.objects.filter(id=user_id).values_list('username', flat=True).first()
+        if username is None:
+            return missing.format(id=user_id)
+        return not_member.format(username=username)
+
     def create(self, validated_data):
         """
         This is the magic. It creates the Expense AND all its Splits.
         """
         splits_data = validated_data.pop('splits')
         payer_id = validated_data.pop('payer_id')
+        validated_data.pop('participants', None)
         
-        # Create the parent Expense object
-        expense = Expense.objects.create(
-            payer_id=payer_id, 
-            **validated_data
-        )
-
-        # Loop through the split data and create each ExpenseSplit object
-        for split_data in splits_data:
-            ExpenseSplit.objects.create(
-                expense=expense,
-                user_owed_id=split_data['user_owed_id'],
-                amount_owed=split_data['amount_owed']
+        with transaction.atomic():
+            # Create the parent Expense object
+            expense = Expense.objects.create(
+                payer_id=payer_id, 
+                **validated_data
             )
+
+            # Create every ExpenseSplit in a single INSERT
+            splits = ExpenseSplit.objects.bulk_create([
+                ExpenseSplit(
+                    expense=expense,
+                    user_owed_id=split_data['user_owed_id'],
+                    amount_owed=split_data['amount_owed'],
+                    original_amount=split_data.get('original_amount')
+                )
+                for split_data in splits_data
+            ])
+
+            # Keep the materialised group balances in step
+            record_expense(expense, splits)
+            write_line_items([expense])
             
         return expense
 
+    def update(self, instance, validated_data):
+        """
+        Updates the Expense and replaces all of its Splits.
+        The old version is taken out of the group balances and the new one added.
+        """
+        splits_data = validated_data.pop('splits')
+        payer_id = validated_data.pop('payer_id')
+        validated_data.pop('participants', None)
+
+        old_group_id = instance.group_id
+
+        with transaction.atomic():
+            reverse_expense(instance)
+            # Checkpoints that already include this expense are now wrong
+            invalidate_checkpoints(old_group_id, expense_id=instance.id)
+
+            instance.payer_id = payer_id
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            instance.save()
+
+            instance.splits.all().delete()
+            splits = ExpenseSplit.objects.bulk_create([
+                ExpenseSplit(
+                    expense=instance,
+                    user_owed_id=split_data['user_owed_id'],
+                    amount_owed=split_data['amount_owed'],
+                    original_amount=split_data.get('original_amount')
+                )
+                for split_data in splits_data
+            ])
+
+            record_expense(instance, splits)
+            replace_line_items(instance)
+            # If the expense moved groups, the new group's checkpoints may cover its id too
+            if instance.group_id != old_group_id:
+                invalidate_checkpoints(instance.group_id, expense_id=instance.id)
+
+        return instance
+
+
+class ExpenseImportRowSerializer(ExpenseSerializer):
+    """
+    One row of a bulk expense import.
+    The group comes from the URL (via the context), not from the row.
+    """
+    class Meta(ExpenseSerializer.Meta):
+        fields = [
+            'description', 'total_amount', 'date', 'payer_id', 'split_type',
+            'receipt_image', 'item_data_json', 'splits', 'participants', 'currency'
+        ]
+
+    def validate(self, data):
+        data['group'] = self.context['group']
+        return super().validate(data)
+
 
 class ExpenseReadSerializer(serializers.ModelSerializer):
     """
@@ -217,15 +418,68 @@ class ExpenseReadSerializer(serializers.ModelSerializer):
     payer = serializers.IntegerField(source='payer.id', read_only=True)
     payer_username = serializers.CharField(source='payer.username', read_only=True)
     splits_read = ExpenseSplitReadSerializer(source='splits', many=True, read_only=True)
+    # {"id", "url", "thumbnail_url"} of the stored photo, or null
+    receipt = serializers.SerializerMethodField()
     
     class Meta:
         model = Expense
         fields = [
             'id', 'group', 'description', 'total_amount', 'date',
-            'payer', 'payer_username', 'split_type', 'receipt_image', 
-            'item_data_json', 'splits_read'
+            'payer', 'payer_username', 'split_type', 'receipt_image', 'receipt',
+            'item_data_json', 'splits_read', 'currency', 'original_amount', 'fx_rate'
         ]
 
+    def get_receipt(self, obj):
+        return receipt_urls(obj.receipt_id)
+
+
+class SettlementSerializer(serializers.ModelSerializer):
+    """
+    Serializer for recording a payment between two group members
+    ("Bob paid Alice back $30").
+    """
+    from_username = serializers.CharField(source='from_user.username', read_only=True)
+    to_username = serializers.CharField(source='to_user.username', read_only=True)
+
+    class Meta:
+        model = Settlement
+        fields = [
+            'id', 'group', 'from_user', 'from_username', 'to_user', 'to_username',
+            'amount', 'note', 'created_by', 'date'
+        ]
+        read_only_fields = ['created_by', 'date']
+
+    def validate(self, data):
+        """
+        Check that the requesting user and both parties are members of the
+        group, that the parties differ, and that the amount is positive.
+        """
+        group = data['group']
+        member_ids = set(group.members.values_list('id', flat=True))
+
+        if self.context['request'].user.id not in member_ids:
+            raise serializers.ValidationError("You are not a member of this group.")
+        for field in ('from_user', 'to_user'):
+            if data[field].id not in member_ids:
+                raise serializers.ValidationError(
+                    f"User '{data[field].username}' is not a member of this group."
+                )
+        if data['from_user'].id == data['to_user'].id:
+            raise serializers.ValidationError("A user cannot pay themselves.")
+        if data['amount'] <= 0:
+            raise serializers.ValidationError("The amount must be positive.")
+        return data
+
+    def create(self, validated_data):
+        with transaction.atomic():
+            payment = Settlement.objects.create(
+                created_by=self.context['request'].user,
+                **validated_data
+            )
+            # Keep the materialised group balances in step
+            record_settlement(payment)
+        return payment
+
 
 class BillGroupSerializer(serializers.ModelSerializer):
     """
@@ -238,7 +492,16 @@ class BillGroupSerializer(serializers.ModelSerializer):
     class Meta:
         model = BillGroup
         # The 'members' field passed during creation is handled in the ViewSet
-        fields = ['id', 'name', 'members', 'created_at']
+        fields = ['id', 'name', 'members', 'created_at', 'currency']
+
+    def validate_currency(self, value):
+        value = value.upper()
+        if len(value) != 3 or not value.isalpha():
+            raise serializers.ValidationError(f"'{value}' is not a currency code.")
+        # Stored amounts are already converted, so the currency is fixed once there are expenses
+        if self.instance is not None and value != self.instance.currency and self.instance.expenses.exists():
+            raise serializers.ValidationError("The currency cannot change once the group has expenses.")
+        return value
 
 
 class BillGroupDetailSerializer(serializers.ModelSerializer):
@@ -253,4 +516,4 @@ class BillGroupDetailSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = BillGroup
-        fields = ['id', 'name', 'members', 'created_at', 'expenses']
+        fields = ['id', 'name', 'members', 'created_at', 'currency', 'expenses']
@@ -0,0 +1,214 @@
+"""
+Settlement engine: turn net balances into a list of transfers.
+
+All arithmetic is on integer cents. A group whose balances split into k
+disjoint zero-sum subsets can be settled with n - k transfers (n = members
+with a non-zero balance), and that is the minimum. So:
+
+- Small groups: exact search for the partition into the largest number of
+  zero-sum subsets (bitmask DP), then settle each subset on its own.
+- Large groups, or when the exact search runs out of its time budget:
+  a heap-based O(n log n) heuristic that first pairs exact opposites.
+
+Every plan reports a lower bound on the number of transfers, so callers
+can see how far a heuristic answer may be from optimal.
+"""
+import heapq
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+Transfer = Tuple[str, str, int]  # (from, to, cents)
+
+
+@dataclass
+class SettlementPlan:
+    transfers: List[Transfer] = field(default_factory=list)
+    strategy: str = 'exact'
+    lower_bound: int = 0
+
+    @property
+    def gap(self) -> int:
+        """Transfers above the lower bound (0 means provably optimal)."""
+        return len(self.transfers) - self.lower_bound
+
+    def as_list(self) -> List[Dict[str, str]]:
+        """The `/settlements/` response format."""
+        return [
+            {"from": debtor, "to": creditor, "amount": f"{cents // 100}.{cents % 100:02d}"}
+            for debtor, creditor, cents in self.transfers
+        ]
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+# --- LOWER BOUND ---
+
+def opposite_pairs(amounts: List[int]) -> int:
+    """The largest number of disjoint (x, -x) pairs among `amounts`."""
+    counts = defaultdict(int)
+    for amount in amounts:
+        counts[amount] += 1
+    return sum(min(count, counts.get(-amount, 0)) for amount, count in counts.items() if amount > 0)
+
+
+def lower_bound(amounts: List[int]) -> int:
+    """
+    A lower bound on the number of transfers that settles `amounts`.
+
+    With n non-zero balances split into k zero-sum subsets, n - k transfers
+    are needed. Only opposite pairs (P of them at most) are subsets of size
+    2, the rest have at least 3 members, so k <= (n + P) / 3. Every debtor
+    and every creditor also needs at least one transfer.
+    """
+    nonzero = [a for a in amounts if a]
+    if not nonzero:
+        return 0
+    n = len(nonzero)
+    creditors = sum(1 for a in nonzero if a > 0)
+    return max(n - (n + opposite_pairs(nonzero)) // 3, creditors, n - creditors)
+
+
+# --- SETTLING ONE SUBSET ---
+
+def _match(members: List[Tuple[str, int]]) -> List[Transfer]:
+    """
+    Settle a zero-sum set of (name, cents) with at most len - 1 transfers,
+    always matching the largest debtor with the largest creditor.
+    """
+    creditors = [(-cents, name) for name, cents in members if cents > 0]
+    debtors = [(cents, name) for name, cents in members if cents < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((debtor, creditor, amount))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+    return transfers
+
+
+def _pair_opposites(members: List[Tuple[str, int]]):
+    """
+    Settle exact opposites directly. Some optimal plan always contains
+    these pairs, so this never makes the answer worse.
+
+    Returns (transfers, remaining members).
+    """
+    waiting = defaultdict(list)  # cents -> names still waiting for a partner
+    transfers = []
+    for name, cents in members:
+        partners = waiting.get(-cents)
+        if partners:
+            partner = partners.pop()
+            debtor, creditor = (name, partner) if cents < 0 else (partner, name)
+            transfers.append((debtor, creditor, abs(cents)))
+        else:
+            waiting[cents].append(name)
+
+    remaining = [(name, cents) for cents, names in waiting.items() for name in names]
+    return transfers, remaining
+
+
+# --- STRATEGIES ---
+
+def heuristic_settlements(members: List[Tuple[str, int]]) -> List[Transfer]:
+    """O(n log n): pair exact opposites, then largest-debtor/largest-creditor matching."""
+    transfers, remaining = _pair_opposites(members)
+    return transfers + _match(remaining)
+
+
+def exact_settlements(members: List[Tuple[str, int]], deadline: Optional[float] = None) -> List[Transfer]:
+    """
+    The minimum number of transfers, by DP over subsets of the members left
+    after pairing exact opposites.
+
+    best[mask] is the largest number of zero-sum subsets that `mask` can be
+    peeled into, removing one member at a time; the masks along the best
+    chain with sum 0 delimit the subsets. O(2^n * n) time.
+
+    Raises BudgetExceeded if `deadline` (time.monotonic()) passes.
+    """
+    transfers, remaining = _pair_opposites(members)
+    n = len(remaining)
+    if n == 0:
+        return transfers
+
+    values = [cents for _, cents in remaining]
+    size = 1 << n
+    sums = [0] * size
+    best = [0] * size
+    removed = [0] * size
+
+    for mask in range(1, size):
+        if deadline is not None and not mask & 0xFFF and time.monotonic() > deadline:
+            raise BudgetExceeded()
+
+        low = mask & -mask
+        sums[mask] = sums[mask ^ low] + values[low.bit_length() - 1]
+
+        top, choice = -1, 0
+        bits = mask
+        while bits:
+            bit = bits & -bits
+            if best[mask ^ bit] > top:
+                top, choice = best[mask ^ bit], bit
+            bits ^= bit
+        best[mask] = top + (sums[mask] == 0)
+        removed[mask] = choice
+
+    # Walk the chain from the full set; split it at every zero-sum mask
+    mask = size - 1
+    group = []
+    while mask:
+        bit = removed[mask]
+        group.append(remaining[bit.bit_length() - 1])
+        mask ^= bit
+        if sums[mask] == 0:
+            transfers.extend(_match(group))
+            group = []
+    return transfers
+
+
+def plan_settlements(balances: Dict[str, int], exact_max_members: Optional[int] = None,
+                     time_budget_ms: Optional[int] = None) -> SettlementPlan:
+    """
+    Choose a strategy by group size and build the settlement plan.
+
+    Args:
+        balances: Dict of username -> net cents (must sum to 0)
+        exact_max_members: Largest number of unpaired non-zero balances for
+            the exact search (default settings.SETTLEMENT_EXACT_MAX_MEMBERS)
+        time_budget_ms: Fall back to the heuristic after this long
+            (default settings.SETTLEMENT_TIME_BUDGET_MS)
+    """
+    if exact_max_members is None:
+        exact_max_members = settings.SETTLEMENT_EXACT_MAX_MEMBERS
+    if time_budget_ms is None:
+        time_budget_ms = settings.SETTLEMENT_TIME_BUDGET_MS
+
+    # Sorted so the same balances always give the same plan
+    members = sorted(((name, cents) for name, cents in balances.items() if cents),
+                     key=lambda member: (-member[1], member[0]))
+    bound = lower_bound([cents for _, cents in members])
+
+    unpaired = len(members) - 2 * opposite_pairs([cents for _, cents in members])
+    if unpaired > exact_max_members:
+        return SettlementPlan(heuristic_settlements(members), 'heuristic', bound)
+
+    deadline = time.monotonic() + time_budget_ms / 1000
+    try:
+        return SettlementPlan(exact_settlements(members, deadline), 'exact', bound)
+    except BudgetExceeded:
+        return SettlementPlan(heuristic_settlements(members), 'heuristic_budget_exceeded', bound)
@@ -0,0 +1,271 @@
+"""
+Server-side split computation for even and itemized expenses.
+
+Everything is done in integer cents. Amounts that do not divide exactly are
+distributed with the largest-remainder method, so the shares always add up
+to the expense total to the cent.
+
+Itemized expenses read their items from `item_data_json`:
+
+    {
+        "items": [
+            {"item_en": "Pizza", "price": 24.00, "assigned_to": [1, 2]},
+            {"item_en": "Beer", "price": 8.50, "assigned_to": [2]}
+        ],
+        "tax": 4.24,
+        "tip": 5.00
+    }
+
+Each item is shared evenly by the users in `assigned_to`. Whatever is left
+between the item subtotal and the expense total (tax, tip, service fees,
+or a discount when negative) is allocated in proportion to each user's
+item subtotal.
+"""
+import decimal
+import json
+import re
+
+
+class SplitError(ValueError):
+    """The compact split input cannot be turned into splits."""
+
+
+def _to_cents(value):
+    try:
+        amount = decimal.Decimal(str(value))
+        if not amount.is_finite():
+            raise decimal.InvalidOperation()
+        return int(amount.quantize(decimal.Decimal('0.01'), rounding=decimal.ROUND_HALF_UP) * 100)
+    except decimal.InvalidOperation:
+        raise SplitError(f"'{value}' is not a valid amount.")
+
+
+def allocate_cents(total_cents, weights):
+    """
+    Split `total_cents` in proportion to `weights` (largest remainder).
+
+    The floors of the exact shares are handed out first; the cents left over
+    go to the largest fractional parts, ties to the earlier weight.
+    Negative totals are allocated like positive ones and negated.
+
+    Returns:
+        List of ints, one per weight, summing exactly to total_cents
+    """
+    if total_cents < 0:
+        return [-cents for cents in allocate_cents(-total_cents, weights)]
+
+    weight_sum = sum(weights)
+    if weight_sum <= 0:
+        raise SplitError("Cannot allocate an amount over zero weights.")
+
+    shares = []
+    remainders = []
+    for index, weight in enumerate(weights):
+        share, remainder = divmod(total_cents * weight, weight_sum)
+        shares.append(share)
+        remainders.append((-remainder, index))
+
+    for _, index in sorted(remainders)[:total_cents - sum(shares)]:
+        shares[index] += 1
+    return shares
+
+
+def even_split(total_cents, participant_ids):
+    """
+    Share the total evenly between the participants.
+
+    Returns:
+        Dict of user_id -> cents, in participant order
+    """
+    participant_ids = list(dict.fromkeys(participant_ids))
+    if not participant_ids:
+        raise SplitError("An even split needs at least one participant.")
+    return dict(zip(participant_ids, allocate_cents(total_cents, [1] * len(participant_ids))))
+
+
+def parse_item_data(item_data_json):
+    """Load `item_data_json` (a JSON string, or already-parsed data) into a dict."""
+    if not item_data_json:
+        raise SplitError("An itemized split needs item_data_json.")
+    data = item_data_json
+    if isinstance(item_data_json, str):
+        try:
+            data = json.loads(item_data_json)
+        except json.JSONDecodeError:
+            raise SplitError("item_data_json is not valid JSON.")
+    if isinstance(data, list):
+        data = {'items': data}
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list) or not data['items']:
+        raise SplitError("item_data_json must contain a non-empty 'items' list.")
+    return data
+
+
+def itemized_split(total_cents, item_data_json):
+    """
+    Compute each user's share from assigned receipt items, then allocate
+    tax/tip (total minus item subtotal) in proportion to their subtotals.
+
+    Returns:
+        Dict of user_id -> cents
+    """
+    data = parse_item_data(item_data_json)
+
+    subtotals = {}
+    for number, item in enumerate(data['items'], start=1):
+        if not isinstance(item, dict):
+            raise SplitError(f"Item {number} must be an object.")
+        assigned = item.get('assigned_to')
+        if not assigned or not isinstance(assigned, list):
+            raise SplitError(f"Item {number} has no 'assigned_to' users.")
+        try:
+            assigned = [int(user_id) for user_id in assigned]
+        except (TypeError, ValueError):
+            raise SplitError(f"Item {number} has an invalid user id in 'assigned_to'.")
+        price_cents = _to_cents(item.get('price', 0))
+        if price_cents < 0:
+            raise SplitError(f"Item {number} has a negative price; put discounts in the total instead.")
+        for user_id, cents in even_split(price_cents, assigned).items():
+            subtotals[user_id] = subtotals.get(user_id, 0) + cents
+
+    items_cents = sum(subtotals.values())
+    extra_cents = total_cents - items_cents
+
+    # If tax/tip are given, they must account for the whole difference
+    if 'tax' in data or 'tip' in data:
+        stated = _to_cents(data.get('tax') or 0) + _to_cents(data.get('tip') or 0)
+        if stated != extra_cents:
+            raise SplitError(
+                f"Items ({items_cents / 100:.2f}) plus tax and tip ({stated / 100:.2f}) "
+                f"do not add up to the total ({total_cents / 100:.2f})."
+            )
+
+    user_ids = list(subtotals)
+    if extra_cents and items_cents > 0:
+        for user_id, cents in zip(user_ids, allocate_cents(extra_cents, [subtotals[u] for u in user_ids])):
+            subtotals[user_id] += cents
+    elif extra_cents:
+        # Free items only: nothing to weigh by, share the rest evenly
+        for user_id, cents in even_split(extra_cents, user_ids).items():
+            subtotals[user_id] += cents
+
+    if any(cents < 0 for cents in subtotals.values()):
+        raise SplitError("The discount is larger than some users' items.")
+    return subtotals
+
+
+def assign_receipt_items(items, assignments=None, default_assignees=(), tax=None, tip=None):
+    """
+    Build the itemized `item_data_json` data for parsed receipt items.
+
+    `assignments` maps item positions to the user ids sharing them, either as a
+    list aligned with `items` or a dict {"0": [1, 2], ...}. Items without an
+    assignment are shared by `default_assignees`.
+
+    Returns:
+        (data, total_cents): data for itemized_split(), and items + tax + tip
+    """
+    if not items:
+        raise SplitError("The receipt has no items.")
+
+    if isinstance(assignments, list):
+        assignments = dict(enumerate(assignments))
+    elif isinstance(assignments, dict):
+        try:
+            assignments = {int(index): users for index, users in assignments.items()}
+        except (TypeError, ValueError):
+            raise SplitError("'assignments' keys must be item positions.")
+    elif assignments is not None:
+        raise SplitError("'assignments' must be a list or an object.")
+    assignments = assignments or {}
+
+    unknown = sorted(index for index in assignments if not 0 <= index < len(items))
+    if unknown:
+        raise SplitError(f"'assignments' refers to items {unknown}, but the receipt has {len(items)} items.")
+
+    data_items = []
+    for index, item in enumerate(items):
+        assigned = assignments.get(index) or list(default_assignees)
+        if not isinstance(assigned, list):
+            raise SplitError(f"The assignment of item {index} must be a list of user ids.")
+        data_items.append({**item, 'assigned_to': assigned})
+
+    data = {'items': data_items}
+    total_cents = sum(_to_cents(item['price']) for item in items)
+    for key, value in (('tax', tax), ('tip', tip)):
+        if value not in (None, ''):
+            data[key] = value
+            total_cents += _to_cents(value)
+    return data, total_cents
+
+
+# --- RECEIPT LINE ITEMS ---
+
+# Keyword -> category, checked in order. Keywords match whole words of the
+# item name, plurals included ('dumplings'), so 'tea' is not found in 'steak'
+# nor 'gin' in 'original'; compound words need their own keyword ('cheesecake').
+ITEM_CATEGORIES = [
+    ('drinks', ('beer', 'wine', 'cocktail', 'coffee', 'espresso', 'latte', 'cappuccino', 'tea', 'juice',
+                'soda', 'cola', 'water', 'lemonade', 'smoothie', 'milkshake', 'sake', 'soju', 'whisky',
+                'vodka', 'gin', 'rum', 'cider', 'drink')),
+    ('desserts', ('tiramisu', 'cake', 'cheesecake', 'cupcake', 'ice cream', 'gelato', 'dessert', 'pie',
+                  'brownie', 'cookie', 'mochi', 'pudding', 'crepe')),
+    ('food', ('pizza', 'salad', 'ramen', 'noodle', 'pad thai', 'gyoza', 'dumpling', 'fish', 'chips', 'fries',
+              'burger', 'sandwich', 'rice', 'soup', 'taco', 'sushi', 'steak', 'chicken', 'pasta', 'curry',
+              'bread', 'egg', 'pancake', 'breakfast', 'lunch', 'dinner', 'meal')),
+    ('fees', ('tax', 'service', 'tip', 'gratuity', 'fee', 'charge', 'deposit')),
+]
+
+_CATEGORY_PATTERNS = [
+    (category, re.compile(r'\b(?:%s)(?:e?s)?\b' % '|'.join(map(re.escape, keywords)), re.IGNORECASE))
+    for category, keywords in ITEM_CATEGORIES
+]
+
+
+def categorize_item(name):
+    """Best-effort category of a receipt line ('drinks', 'food', ...), 'other' if unknown."""
+    for category, pattern in _CATEGORY_PATTERNS:
+        if pattern.search(name or ''):
+            return category
+    return 'other'
+
+
+def line_item_rows(item_data_json, fx_rate=1, default_currency=''):
+    """
+    The line items of an itemized expense as plain rows, ready to store.
+    Amounts are in cents: `price_cents` as on the receipt, `amount_cents`
+    converted with the expense's fx_rate and shared evenly by `assigned_to`.
+
+    Returns:
+        List of {"position", "name", "category", "currency", "price_cents",
+                 "amount_cents", "shares": {user_id: cents}}
+    Raises:
+        SplitError if item_data_json is not in the itemized format
+    """
+    data = parse_item_data(item_data_json)
+    rate = decimal.Decimal(str(fx_rate))
+
+    rows = []
+    for position, item in enumerate(data['items']):
+        if not isinstance(item, dict):
+            raise SplitError(f"Item {position + 1} must be an object.")
+        name = str(item.get('item_en') or item.get('name') or '')[:255]
+        price_cents = _to_cents(item.get('price', 0))
+        amount_cents = int((price_cents * rate).quantize(decimal.Decimal('1'), rounding=decimal.ROUND_HALF_UP))
+
+        # Items stored before assignments existed have no shares
+        assigned = item.get('assigned_to') or []
+        try:
+            assigned = [int(user_id) for user_id in assigned]
+        except (TypeError, ValueError):
+            raise SplitError(f"Item {position + 1} has an invalid user id in 'assigned_to'.")
+
+        rows.append({
+            'position': position,
+            'name': name,
+            'category': str(item.get('category') or categorize_item(name))[:32],
+            'currency': str(item.get('currency') or default_currency).upper()[:3],
+            'price_cents': price_cents,
+            'amount_cents': amount_cents,
+            'shares': even_split(amount_cents, assigned) if assigned else {},
+        })
+    return rows
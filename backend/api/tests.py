@@ -1,3 +1,1293 @@
-from django.test import TestCase
+import base64
+import csv
+import datetime
+import decimal
+import gzip
+import hashlib
+import importlib.util
+import io
+import json
+import pathlib
+import pickle
+import tempfile
+import threading
+import time
+import warnings
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import PIL.Image
+import PIL.ImageDraw
+import PIL.ImageFont
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .chat_sessions import ChatSessionStore, RefinementSession
+from .countries import MAX_BULK_KEYS
+from .exports import EXPORT_COLUMNS, ledger_rows
+from .fx import FXService, FXUnavailable, set_fx_service
+from .genaifakes import fake_itinerary
+from .genaitransport import CassetteMissError, GenAITransport, request_fingerprint, set_transport
+from .ledger import compute_net_cents, create_checkpoint, find_balance_drift, group_net_cents, ledger_version
+from .models import BalanceCheckpoint, BillGroup, Expense, GroupBalance, Itinerary, ReceiptImage, ReceiptParseCache
+from .recommend import CATEGORIES, SAFETY_LEVELS, RatingsMatrix, parse_query, ratings_matrix
+from .receiptimage import ImageRejected, PreparedImage, preprocess_receipt
+from .receiptparse import ParsedReceipt, log_parse, parse_receipt
+from .receiptstore import original_path, thumbnail_path
+from .settlements import lower_bound, plan_settlements
+from .splits import SplitError, allocate_cents, categorize_item, even_split, itemized_split
+from .views import BatchParseReceiptView, batch_executor
+
+
+class GroupTestCase(TestCase):
+    """A CAD group of alice, bob and carol, with alice logged in."""
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='pw')
+        self.bob = User.objects.create_user('bob', password='pw')
+        self.carol = User.objects.create_user('carol', password='pw')
+        self.group = BillGroup.objects.create(name="Trip", currency='CAD')
+        self.group.members.add(self.alice, self.bob, self.carol)
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def add_expense(self, total, payer, **fields):
+        payload = {
+            'group': self.group.id, 'description': "Dinner", 'total_amount': total,
+            'payer_id': payer.id, 'split_type': 'E', **fields,
+        }
+        response = self.client.post('/api/expenses/', payload, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def add_payment(self, from_user, to_user, amount):
+        payload = {'group': self.group.id, 'from_user': from_user.id, 'to_user': to_user.id, 'amount': amount}
+        response = self.client.post('/api/payments/', payload, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def assertNoDrift(self):
+        self.assertEqual(find_balance_drift([self.group.id]), [])
+
+
+class GroupBalanceTests(GroupTestCase):
+    """GroupBalance rows follow every write (user-031)."""
+
+    def test_even_expense(self):
+        self.add_expense("30.00", self.alice)
+        self.assertEqual(group_net_cents(self.group), {'alice': 2000, 'bob': -1000, 'carol': -1000})
+        self.assertNoDrift()
+
+    def test_balances_sum_to_zero_with_odd_cents(self):
+        self.add_expense("10.00", self.bob)
+        balances = group_net_cents(self.group)
+        self.assertEqual(sum(balances.values()), 0)
+        self.assertEqual(sorted(balances.values()), [-334, -333, 667])
+        self.assertNoDrift()
+
+    def test_edit_replaces_old_splits(self):
+        expense_id = self.add_expense("30.00", self.alice)
+        response = self.client.patch(
+            f'/api/expenses/{expense_id}/', {'total_amount': "60.00", 'payer_id': self.bob.id}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(group_net_cents(self.group), {'alice': -2000, 'bob': 4000, 'carol': -2000})
+        self.assertNoDrift()
+
+    def test_delete_reverses_expense(self):
+        self.add_expense("30.00", self.alice)
+        expense_id = self.add_expense("12.00", self.carol, participants=[self.bob.id, self.carol.id])
+        self.assertEqual(self.client.delete(f'/api/expenses/{expense_id}/').status_code, 204)
+        self.assertEqual(group_net_cents(self.group), {'alice': 2000, 'bob': -1000, 'carol': -1000})
+        self.assertNoDrift()
+
+    def test_payments_settle_debts(self):
+        self.add_expense("30.00", self.alice)
+        self.add_payment(self.bob, self.alice, "10.00")
+        payment_id = self.add_payment(self.carol, self.alice, "10.00")
+        self.assertEqual(group_net_cents(self.group), {'alice': 0, 'bob': 0, 'carol': 0})
+
+        self.assertEqual(self.client.delete(f'/api/payments/{payment_id}/').status_code, 204)
+        self.assertEqual(group_net_cents(self.group)['carol'], -1000)
+        self.assertNoDrift()
+
+    def test_drift_is_detected(self):
+        self.add_expense("30.00", self.alice)
+        GroupBalance.objects.filter(group=self.group, user=self.bob).update(net_cents=0)
+        self.assertEqual(len(find_balance_drift([self.group.id])), 1)
+
+
+class BalanceCheckpointTests(GroupTestCase):
+    """Recomputing from a checkpoint gives the same balances as from the whole history (user-035)."""
+
+    def assertSameFromCheckpoint(self):
+        self.assertEqual(
+            compute_net_cents([self.group.id], use_checkpoints=True),
+            compute_net_cents([self.group.id], use_checkpoints=False),
+        )
+        self.assertNoDrift()
+
+    def test_activity_after_checkpoint(self):
+        self.add_expense("30.00", self.alice)
+        self.add_payment(self.bob, self.alice, "10.00")
+        checkpoint = create_checkpoint(self.group.id)
+        self.assertEqual(
+            dict(checkpoint.entries.values_list('user__username', 'net_cents')),
+            {'alice': 1000, 'carol': -1000},
+        )
+
+        self.add_expense("9.00", self.carol)
+        self.add_payment(self.alice, self.carol, "1.00")
+        self.assertSameFromCheckpoint()
+
+    def test_editing_included_expense_drops_checkpoint(self):
+        expense_id = self.add_expense("30.00", self.alice)
+        create_checkpoint(self.group.id)
+        self.add_expense("6.00", self.bob)
+        create_checkpoint(self.group.id)
+
+        response = self.client.patch(f'/api/expenses/{expense_id}/', {'total_amount': "45.00"}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertFalse(BalanceCheckpoint.objects.filter(group=self.group).exists())
+        self.assertSameFromCheckpoint()
+
+    def test_deleting_later_expense_keeps_older_checkpoint(self):
+        self.add_expense("30.00", self.alice)
+        checkpoint = create_checkpoint(self.group.id)
+        expense_id = self.add_expense("6.00", self.bob)
+
+        self.assertEqual(self.client.delete(f'/api/expenses/{expense_id}/').status_code, 204)
+        self.assertTrue(BalanceCheckpoint.objects.filter(id=checkpoint.id).exists())
+        self.assertSameFromCheckpoint()
+
+    def test_deleting_included_payment_drops_checkpoint(self):
+        self.add_expense("30.00", self.alice)
+        payment_id = self.add_payment(self.bob, self.alice, "10.00")
+        create_checkpoint(self.group.id)
+
+        self.assertEqual(self.client.delete(f'/api/payments/{payment_id}/').status_code, 204)
+        self.assertFalse(BalanceCheckpoint.objects.filter(group=self.group).exists())
+        self.assertSameFromCheckpoint()
+
+    @override_settings(BALANCE_CHECKPOINTS_KEPT=2)
+    def test_old_checkpoints_are_pruned(self):
+        for total in ("3.00", "6.00", "9.00"):
+            self.add_expense(total, self.alice)
+            create_checkpoint(self.group.id)
+        self.assertEqual(BalanceCheckpoint.objects.filter(group=self.group).count(), 2)
+        self.assertSameFromCheckpoint()
+
+
+class SettlementPlanTests(TestCase):
+    """Settlement plans with the fewest transfers (user-032)."""
+
+    def assertSettles(self, balances, plan):
+        left = dict(balances)
+        for debtor, creditor, cents in plan.transfers:
+            self.assertGreater(cents, 0)
+            left[debtor] += cents
+            left[creditor] -= cents
+        self.assertEqual(set(left.values()), {0})
+
+    def test_opposite_balances_are_paired(self):
+        balances = {'a': 500, 'b': -500, 'c': 1200, 'd': -1200}
+        plan = plan_settlements(balances)
+        self.assertSettles(balances, plan)
+        self.assertEqual(sorted(plan.transfers), [('b', 'a', 500), ('d', 'c', 1200)])
+        self.assertEqual(plan.gap, 0)
+
+    def test_exact_uses_zero_sum_subsets(self):
+        # {a, b, c} and {d, e} settle separately: 3 transfers instead of 4
+        balances = {'a': 700, 'b': -300, 'c': -400, 'd': 250, 'e': -250}
+        plan = plan_settlements(balances)
+        self.assertEqual(plan.strategy, 'exact')
+        self.assertSettles(balances, plan)
+        self.assertEqual(len(plan.transfers), 3)
+        self.assertEqual(plan.lower_bound, 3)
+
+    def test_large_groups_use_heuristic(self):
+        balances = {f'u{i}': (i + 1) * 100 for i in range(12)}
+        balances['payer'] = -sum(balances.values())
+        plan = plan_settlements(balances, exact_max_members=8)
+        self.assertEqual(plan.strategy, 'heuristic')
+        self.assertSettles(balances, plan)
+        self.assertLessEqual(len(plan.transfers), len(balances) - 1)
+
+    def test_budget_exceeded_falls_back(self):
+        # 14 balances with no exact opposites: too many subsets to search in 0 ms
+        balances = {f'u{i}': 1000 + 7 * i for i in range(7)}
+        balances.update({f'v{i}': -(500 + 3 * i) for i in range(6)})
+        balances['w'] = -sum(balances.values())
+        plan = plan_settlements(balances, time_budget_ms=0)
+        self.assertEqual(plan.strategy, 'heuristic_budget_exceeded')
+        self.assertSettles(balances, plan)
+
+    def test_settled_group_has_no_transfers(self):
+        plan = plan_settlements({'a': 0, 'b': 0})
+        self.assertEqual(plan.transfers, [])
+        self.assertEqual(lower_bound([]), 0)
+
+    def test_as_list_formats_cents(self):
+        plan = plan_settlements({'a': 1005, 'b': -1005})
+        self.assertEqual(plan.as_list(), [{"from": "b", "to": "a", "amount": "10.05"}])
+
+
+class ExpenseImportTests(GroupTestCase):
+    """POST /api/groups/<id>/import-expenses/ (user-034)."""
+
+    def import_rows(self, rows):
+        return self.client.post(
+            f'/api/groups/{self.group.id}/import-expenses/', {'expenses': rows}, format='json'
+        )
+
+    def test_rows_keep_their_date(self):
+        before = timezone.now()
+        response = self.import_rows([
+            {'description': "Hotel", 'total_amount': "90.00", 'payer_id': self.bob.id,
+             'date': "2025-10-03T19:30:00Z"},
+            {'description': "Taxi", 'total_amount': "9.00", 'payer_id': self.alice.id},
+        ])
+        self.assertEqual(response.status_code, 201, response.data)
+        hotel, taxi = Expense.objects.filter(id__in=response.data['expense_ids']).order_by('id')
+        self.assertEqual(hotel.date, datetime.datetime(2025, 10, 3, 19, 30, tzinfo=datetime.timezone.utc))
+        self.assertGreaterEqual(taxi.date, before)
+        self.assertEqual(group_net_cents(self.group), {'alice': -2400, 'bob': 5700, 'carol': -3300})
+        self.assertNoDrift()
+
+    def test_invalid_date_rejects_import(self):
+        response = self.import_rows([
+            {'description': "Hotel", 'total_amount': "90.00", 'payer_id': self.bob.id, 'date': "yesterday"},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('date', response.data['errors'][0]['errors'])
+        self.assertFalse(Expense.objects.exists())
+
+
+class CentSplitTests(TestCase):
+    """Splits computed in whole cents (user-038)."""
+
+    def test_leftover_cents_go_to_largest_remainders(self):
+        self.assertEqual(allocate_cents(1000, [1, 1, 1]), [334, 333, 333])
+        self.assertEqual(allocate_cents(100, [1, 2]), [33, 67])
+        self.assertEqual(allocate_cents(-1000, [1, 1, 1]), [-334, -333, -333])
+
+    def test_allocation_always_sums_to_total(self):
+        for total in (1, 99, 1001, 123457):
+            for weights in ([1], [3, 7], [5, 5, 5, 1], [1250, 899, 2]):
+                self.assertEqual(sum(allocate_cents(total, weights)), total)
+
+    def test_zero_weights_are_rejected(self):
+        with self.assertRaises(SplitError):
+            allocate_cents(100, [0, 0])
+
+    def test_even_split_ignores_duplicates(self):
+        self.assertEqual(even_split(1000, [3, 1, 3]), {3: 500, 1: 500})
+        with self.assertRaises(SplitError):
+            even_split(1000, [])
+
+    def test_itemized_split_allocates_tax_and_tip(self):
+        items = {'items': [
+            {'name': "Pizza", 'price': "20.00", 'assigned_to': [1, 2]},
+            {'name': "Wine", 'price': "10.00", 'assigned_to': [2]},
+        ], 'tax': "3.00", 'tip': "0.01"}
+        split = itemized_split(3301, items)
+        self.assertEqual(split, {1: 1100, 2: 2201})
+
+    def test_itemized_split_checks_tax_and_tip(self):
+        items = {'items': [{'name': "Pizza", 'price': "20.00", 'assigned_to': [1]}], 'tax': "1.00"}
+        with self.assertRaises(SplitError):
+            itemized_split(2500, items)
+
+    def test_non_finite_amounts_are_rejected(self):
+        for price in ("NaN", "Infinity", "-Infinity", "sNaN", float('nan'), float('inf')):
+            items = {'items': [{'name': "Pizza", 'price': price, 'assigned_to': [1]}]}
+            with self.assertRaises(SplitError):
+                itemized_split(2000, items)
+
+
+class ComputedSplitAPITests(GroupTestCase):
+    """Server-computed splits through POST /api/expenses/ (user-038)."""
+
+    def test_nan_price_is_a_bad_request(self):
+        item_data = '{"items": [{"name": "Pizza", "price": NaN, "assigned_to": [%d]}]}' % self.bob.id
+        response = self.client.post('/api/expenses/', {
+            'group': self.group.id, 'description': "Dinner", 'total_amount': "20.00",
+            'payer_id': self.alice.id, 'split_type': 'I', 'item_data_json': item_data,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Expense.objects.exists())
+
+    def test_even_split_of_participants(self):
+        expense_id = self.add_expense("10.00", self.alice, participants=[self.bob.id, self.carol.id])
+        owed = dict(Expense.objects.get(id=expense_id).splits.values_list('user_owed__username', 'amount_owed'))
+        self.assertEqual(owed, {'bob': decimal.Decimal('5.00'), 'carol': decimal.Decimal('5.00')})
+
+
+class LedgerExportTests(GroupTestCase):
+    """GET /api/groups/<id>/export/ streamed from ledger_rows (user-036)."""
+
+    def setUp(self):
+        super().setUp()
+        # Posted out of date order; the export is oldest first
+        self.lunch = self.add_expense("30.00", self.bob, description="Lunch", date='2026-05-02T12:00:00Z')
+        self.dinner = self.add_expense("10.00", self.alice, description="Dinner", date='2026-05-01T19:00:00Z')
+
+    def export(self, **params):
+        return self.client.get(f'/api/groups/{self.group.id}/export/', params)
+
+    def test_csv_header_and_row_order(self):
+        response = self.export(output='csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+
+        self.assertEqual(rows[0], EXPORT_COLUMNS)
+        self.assertEqual([(int(row[0]), row[8], row[9]) for row in rows[1:]], [
+            (self.dinner, 'alice', '3.34'), (self.dinner, 'bob', '3.33'), (self.dinner, 'carol', '3.33'),
+            (self.lunch, 'alice', '10.00'), (self.lunch, 'bob', '10.00'), (self.lunch, 'carol', '10.00'),
+        ])
+
+    def test_ndjson_rows(self):
+        response = self.export(output='ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(list(rows[0]), EXPORT_COLUMNS)
+        self.assertEqual(rows[3]['description'], "Lunch")
+        self.assertEqual(rows[3]['payer_username'], 'bob')
+        self.assertEqual(rows[3]['amount_owed'], '10.00')
+
+    def test_unknown_output_is_rejected(self):
+        response = self.export(output='xlsx')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('output', response.json()['error'])
+
+    def test_rows_are_streamed_from_a_chunked_iterator(self):
+        with mock.patch.object(QuerySet, 'iterator', autospec=True, side_effect=QuerySet.iterator) as iterator:
+            response = self.export()
+            self.assertIsInstance(response, StreamingHttpResponse)
+            # Nothing is queried until the response is consumed
+            iterator.assert_not_called()
+            body = b''.join(response.streaming_content)
+        iterator.assert_called_once()
+        self.assertEqual(len(body.decode().splitlines()), 7)
+
+    def test_expense_split_across_chunks(self):
+        self.add_expense("40.00", self.carol, description="Groceries", date='2026-05-03T09:00:00Z')
+        # Chunks of 2 rows cut every three-split expense in two
+        rows = list(ledger_rows(self.group, chunk_size=2))
+
+        self.assertEqual(rows, list(ledger_rows(self.group)))
+        self.assertEqual([row[2] for row in rows], ["Dinner"] * 3 + ["Lunch"] * 3 + ["Groceries"] * 3)
+        self.assertEqual([row[8] for row in rows], ['alice', 'bob', 'carol'] * 3)
+
+
+class ExpenseQueryCountTests(TestCase):
+    """Creating an expense costs the same queries for any number of participants (user-033)."""
+
+    def setUp(self):
+        self.members = User.objects.bulk_create([User(username=f'member{i}') for i in range(51)])
+        self.group = BillGroup.objects.create(name="Conference", currency='CAD')
+        self.group.members.add(*self.members)
+        self.client = APIClient()
+        self.client.force_authenticate(self.members[0])
+
+    def post_expense(self, participants):
+        response = self.client.post('/api/expenses/', {
+            'group': self.group.id, 'description': "Catering", 'total_amount': "500.00",
+            'payer_id': self.members[0].id, 'split_type': 'E',
+            'participants': [member.id for member in participants],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def test_query_count_does_not_grow_with_participants(self):
+        for participants in (self.members[1:6], self.members[1:51]):
+            with self.assertNumQueries(10):
+                self.post_expense(participants)
+        self.assertEqual(Expense.objects.latest('id').splits.count(), 50)
+
+
+class SharedCacheTests(GroupTestCase):
+    """Cached group results are invalidated in every worker (user-039, user-040)."""
+
+    def stored_version(self):
+        # What another worker process reads: the row in the cache table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT value FROM {settings.CACHES['default']['LOCATION']} WHERE cache_key = %s",
+                [cache.make_key(f"ledger-version:{self.group.id}")],
+            )
+            row = cursor.fetchone()
+        return row and pickle.loads(base64.b64decode(row[0]))
+
+    def test_ledger_version_is_shared(self):
+        version = ledger_version(self.group.id)
+        self.assertEqual(self.stored_version(), version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_expense("30.00", self.alice)
+        self.assertNotIn(self.stored_version(), (None, version))
+
+    def test_timeline_follows_writes(self):
+        url = f'/api/groups/{self.group.id}/timeline/?bucket=day'
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_expense("30.00", self.alice)
+
+        timeline = self.client.get(url).json()
+        self.assertEqual(timeline['series'][-1]['balances'], {'alice': '20.00', 'bob': '-10.00', 'carol': '-10.00'})
+
+    def test_analytics_follow_writes(self):
+        url = f'/api/groups/{self.group.id}/analytics/'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_expense("30.00", self.alice)
+        self.assertEqual(self.client.get(url).json()['total'], "30.00")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_expense("12.50", self.bob)
+        analytics = self.client.get(url).json()
+        self.assertEqual(analytics['total'], "42.50")
+        self.assertEqual(analytics['expense_count'], 2)
+
+
+class GenAITransportTests(TestCase):
+    """Record/replay of external calls (user-027)."""
+
+    def setUp(self):
+        cassettes = tempfile.TemporaryDirectory()
+        self.addCleanup(cassettes.cleanup)
+        self.cassette_dir = cassettes.name
+
+    def transport(self, mode, **kwargs):
+        return GenAITransport(mode=mode, cassette_dir=self.cassette_dir, **kwargs)
+
+    def test_record_then_replay(self):
+        request = {'model': 'gemini-2.5-flash', 'prompt': "Plan 2 days in Lisbon"}
+        recorded = self.transport('record').call(
+            'itinerary', request, live=lambda: {'text': '{"tripTitle": "Lisbon"}'}, fake=dict)
+
+        sleeps = []
+        replay = self.transport('replay', latency={'default': 0.25}, sleep=sleeps.append)
+        replayed = replay.call('itinerary', dict(request), live=self.fail, fake=self.fail)
+
+        self.assertEqual(replayed, recorded)
+        self.assertEqual(sleeps, [0.25])
+
+    def test_replay_miss_raises(self):
+        replay = self.transport('replay')
+        with self.assertRaises(CassetteMissError):
+            replay.call('itinerary', {'prompt': "never recorded"}, live=self.fail, fake=self.fail)
+
+    def test_fingerprint_ignores_key_order(self):
+        first = {'model': 'm', 'config': {'temperature': 0, 'tools': ['search']}, 'prompt': 'p'}
+        second = {'prompt': 'p', 'config': {'tools': ['search'], 'temperature': 0}, 'model': 'm'}
+        self.assertEqual(request_fingerprint('itinerary', first), request_fingerprint('itinerary', second))
+        self.assertNotEqual(request_fingerprint('itinerary', first), request_fingerprint('ratings', first))
+
+
+class FakeFXMixin:
+    """FX rates from the fake transport (api/genaifakes.py), no network or snapshot file."""
+
+    def setUp(self):
+        super().setUp()
+        set_transport(GenAITransport(mode='fake'))
+        set_fx_service(self.fx_service())
+        self.addCleanup(set_transport, None)
+        self.addCleanup(set_fx_service, None)
+
+    def fx_service(self):
+        return FXService(url='https://fx.test/latest', ttl_seconds=3600, snapshot_path=None)
+
+
+class FXSharedCacheTests(FakeFXMixin, TestCase):
+    """Workers share fetched rates through the cache (user-041)."""
+
+    def test_other_worker_reuses_fetched_rates(self):
+        fetched = self.fx_service().refresh()
+
+        other_worker = self.fx_service()
+        other_worker._fetch = lambda: self.fail("rates were fetched twice")
+        rates = other_worker.get_rates()
+        self.assertEqual(rates['fetched_at'], fetched['fetched_at'])
+        self.assertFalse(rates['stale'])
+
+    def test_one_background_refresh_at_a_time(self):
+        release, calls = threading.Event(), []
+        service = self.fx_service()
+        service.refresh = lambda: calls.append(release.wait(5))
+
+        def finish_refreshes():
+            for thread in threading.enumerate():
+                if thread.name == 'fx-refresh':
+                    thread.join(5)
+
+        service.refresh_in_background()
+        service.refresh_in_background()   # the first one is still running
+        release.set()
+        finish_refreshes()
+        self.assertEqual(len(calls), 1)
+
+        # Once it has finished, the next refresh can start
+        service.refresh_in_background()
+        finish_refreshes()
+        self.assertEqual(len(calls), 2)
+
+    def test_no_rates_anywhere(self):
+        def offline():
+            raise FXUnavailable("offline")
+
+        service = self.fx_service()
+        service._fetch = offline
+        with self.assertRaises(FXUnavailable):
+            service.get_rates()
+
+
+class CurrencyConversionTests(FakeFXMixin, GroupTestCase):
+    """Expenses in another currency are converted once, when written (user-042)."""
+
+    def splits_of(self, expense_id):
+        return {
+            username: (owed, original)
+            for username, owed, original in Expense.objects.get(id=expense_id).splits.values_list(
+                'user_owed__username', 'amount_owed', 'original_amount')
+        }
+
+    def test_converted_splits_add_up(self):
+        expense_id = self.add_expense("10.00", self.alice, currency='USD')
+        expense = Expense.objects.get(id=expense_id)
+        self.assertEqual(expense.currency, 'USD')
+        self.assertEqual(expense.original_amount, decimal.Decimal('10.00'))
+        self.assertEqual(expense.fx_rate, decimal.Decimal('1.37'))
+        self.assertEqual(expense.total_amount, decimal.Decimal('13.70'))
+
+        splits = self.splits_of(expense_id)
+        self.assertEqual(sum(owed for owed, _ in splits.values()), expense.total_amount)
+        self.assertEqual(sum(original for _, original in splits.values()), expense.original_amount)
+        self.assertEqual(group_net_cents(self.group), {'alice': 912, 'bob': -456, 'carol': -456})
+        self.assertNoDrift()
+
+    def test_cross_rate(self):
+        expense_id = self.add_expense("100.00", self.bob, currency='eur')
+        expense = Expense.objects.get(id=expense_id)
+        self.assertEqual(expense.currency, 'EUR')
+        self.assertEqual(expense.fx_rate, decimal.Decimal('1.4891304348'))
+        self.assertEqual(expense.total_amount, decimal.Decimal('148.91'))
+
+    def test_group_currency_is_not_converted(self):
+        expense_id = self.add_expense("30.00", self.alice)
+        expense = Expense.objects.get(id=expense_id)
+        self.assertEqual((expense.currency, expense.fx_rate), ('CAD', 1))
+        self.assertEqual(expense.total_amount, decimal.Decimal('30.00'))
+
+    def test_edit_keeps_original_rate(self):
+        expense_id = self.add_expense("10.00", self.alice, currency='USD')
+
+        def offline():
+            raise FXUnavailable("offline")
+
+        service = self.fx_service()
+        service._fetch = offline
+        set_fx_service(service)
+        cache.clear()
+
+        response = self.client.patch(
+            f'/api/expenses/{expense_id}/', {'participants': [self.alice.id, self.bob.id]}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(Expense.objects.get(id=expense_id).fx_rate, decimal.Decimal('1.37'))
+        self.assertEqual(group_net_cents(self.group), {'alice': 685, 'bob': -685, 'carol': 0})
+
+    def test_unknown_currency_is_rejected(self):
+        for currency in ('XYZ', 'US'):
+            response = self.client.post('/api/expenses/', {
+                'group': self.group.id, 'description': "Dinner", 'total_amount': "10.00",
+                'payer_id': self.alice.id, 'currency': currency,
+            }, format='json')
+            self.assertEqual(response.status_code, 400, currency)
+        self.assertFalse(Expense.objects.exists())
+
+
+def png_bytes(width, height, color=255):
+    out = io.BytesIO()
+    PIL.Image.new('L', (width, height), color).save(out, format='PNG')
+    return out.getvalue()
+
+
+class NetPositionTests(FakeFXMixin, GroupTestCase):
+    """GET /api/users/me/net-positions/ across groups (user-037)."""
+
+    def positions(self, **params):
+        response = self.client.get('/api/users/me/net-positions/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def nets(self, data):
+        return {row['username']: row['net'] for row in data['counterparties']}
+
+    def test_user_as_payer(self):
+        self.add_expense("30.00", self.alice)
+        data = self.positions()
+        self.assertEqual(self.nets(data), {'bob': '10.00', 'carol': '10.00'})
+        self.assertEqual(data['net'], '20.00')
+
+    def test_user_as_debtor(self):
+        self.add_expense("12.00", self.bob)
+        self.add_expense("9.00", self.carol, participants=[self.alice.id, self.carol.id])
+        data = self.positions()
+        self.assertEqual(self.nets(data), {'bob': '-4.00', 'carol': '-4.50'})
+        self.assertEqual(data['net'], '-8.50')
+
+    def test_partial_settlement(self):
+        self.add_expense("30.00", self.alice)
+        self.add_payment(self.carol, self.alice, "4.00")
+        self.assertEqual(self.nets(self.positions()), {'bob': '10.00', 'carol': '6.00'})
+
+    def test_counterparty_in_two_groups(self):
+        ski = BillGroup.objects.create(name="Ski", currency='CAD')
+        ski.members.add(self.alice, self.bob)
+        self.add_expense("30.00", self.alice)               # bob and carol owe alice 10 each
+        self.add_expense("12.00", self.bob)                 # alice owes bob 4
+        self.add_payment(self.carol, self.alice, "4.00")    # carol still owes 6
+        self.add_expense("20.00", self.bob, group=ski.id)   # alice owes bob 10 on the ski trip
+
+        data = self.positions(netted='true')
+        self.assertEqual(self.nets(data), {'carol': '6.00', 'bob': '-4.00'})
+        bob = next(row for row in data['counterparties'] if row['username'] == 'bob')
+        self.assertEqual({row['group_name']: row['net'] for row in bob['groups']}, {'Trip': '6.00', 'Ski': '-10.00'})
+        self.assertEqual(data['net'], '2.00')
+        self.assertEqual(data['transfers_without_netting'], 3)
+
+        # Netted: carol's 6.00 covers what alice owes bob, so two transfers settle everything
+        transfers = {(row['from'], row['to']): row['amount'] for row in data['netted_settlements']}
+        self.assertEqual(transfers, {('carol', 'bob'): '4.00', ('carol', 'alice'): '2.00'})
+
+
+class ReceiptPreprocessTests(TestCase):
+    """Uploads that are not images, or too large, are rejected (user-043)."""
+
+    def test_photo_is_shrunk(self):
+        prepared = preprocess_receipt(png_bytes(400, 200), max_dimension=100)
+        self.assertEqual((prepared.width, prepared.height), (100, 50))
+        self.assertEqual(prepared.mime_type, 'image/jpeg')
+
+    def test_not_an_image(self):
+        with self.assertRaises(ImageRejected):
+            preprocess_receipt(b"%PDF-1.4 not a photo")
+
+    @override_settings(RECEIPT_MAX_PIXELS=1000)
+    def test_too_many_pixels(self):
+        with self.assertRaises(ImageRejected):
+            preprocess_receipt(png_bytes(40, 40))
+
+    @mock.patch.object(PIL.Image, 'MAX_IMAGE_PIXELS', 100)
+    def test_decompression_bomb_error(self):
+        # Over twice Pillow's limit: DecompressionBombError
+        with self.assertRaises(ImageRejected):
+            preprocess_receipt(png_bytes(20, 20))
+
+    @mock.patch.object(PIL.Image, 'MAX_IMAGE_PIXELS', 100)
+    def test_decompression_bomb_warning_as_error(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', PIL.Image.DecompressionBombWarning)
+            with self.assertRaises(ImageRejected):
+                preprocess_receipt(png_bytes(12, 12))
+
+
+def receipt_photo(items, quality=90):
+    """A JPEG of a printed receipt: same header and layout for any `items`."""
+    img = PIL.Image.new('L', (600, 900), 245)
+    draw = PIL.ImageDraw.Draw(img)
+    font = PIL.ImageFont.load_default(size=28)
+    draw.text((150, 40), "CORNER CAFE", fill=20, font=font)
+    y = 140
+    for name, price in items:
+        draw.text((40, y), name, fill=20, font=font)
+        draw.text((460, y), f"{price:6.2f}", fill=20, font=font)
+        y += 50
+    draw.text((40, y + 20), "TOTAL", fill=20, font=font)
+    draw.text((460, y + 20), f"{sum(price for _, price in items):6.2f}", fill=20, font=font)
+    out = io.BytesIO()
+    img.save(out, format='JPEG', quality=quality)
+    return out.getvalue()
+
+
+class ReceiptParseCacheTests(FakeFXMixin, TestCase):
+    """Parsed receipts are reused for the same photo only (user-044)."""
+
+    BREAKFAST = [("Latte", 4.50), ("Croissant", 3.25), ("Orange juice", 3.99)]
+
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice', password='pw')
+        self.bob = User.objects.create_user('bob', password='pw')
+
+    def test_same_photo_is_a_hit(self):
+        photo = receipt_photo(self.BREAKFAST)
+        first = parse_receipt(self.alice, photo)
+        again = parse_receipt(self.bob, photo)
+        self.assertEqual((first.cache_status, again.cache_status), ('miss', 'exact'))
+        self.assertEqual(again.data, first.data)
+        self.assertEqual(ReceiptParseCache.objects.get().hits, 1)
+
+    def test_same_layout_different_receipt_is_a_miss(self):
+        first = parse_receipt(self.alice, receipt_photo(self.BREAKFAST))
+        other_items = [("Latte", 4.50), ("Croissant", 3.25), ("Orange juice", 4.99)]
+        other = parse_receipt(self.alice, receipt_photo(other_items))
+        self.assertEqual((first.cache_status, other.cache_status), ('miss', 'miss'))
+        self.assertEqual(ReceiptParseCache.objects.count(), 2)
+
+    def test_expired_entry_is_a_miss(self):
+        photo = receipt_photo(self.BREAKFAST)
+        parse_receipt(self.alice, photo)
+        ReceiptParseCache.objects.update(created_at=timezone.now() - datetime.timedelta(days=365))
+        self.assertEqual(parse_receipt(self.alice, photo).cache_status, 'miss')
+        self.assertEqual(ReceiptParseCache.objects.count(), 1)
+
+    def test_parse_is_logged(self):
+        parsed = parse_receipt(self.alice, receipt_photo(self.BREAKFAST))
+        with self.assertLogs('api.receiptparse', 'INFO') as logs:
+            log_parse(parsed, label="1/3")
+        image = parsed.image
+        self.assertIn(f"Receipt image 1/3: {image.original_bytes} -> {image.sent_bytes} bytes", logs.output[0])
+        self.assertIn("cache miss, preprocess;dur=", logs.output[0])
+
+
+class BatchParseTests(TestCase):
+    """Batch parses share one bounded pool per process (user-045)."""
+
+    def setUp(self):
+        self.running = 0
+        self.peak = 0
+        self.threads = set()
+        self.lock = threading.Lock()
+
+    def fake_parse(self, user, raw):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            self.threads.add(threading.current_thread().name)
+        time.sleep(0.02)
+        with self.lock:
+            self.running -= 1
+        if raw == b'bad':
+            raise ImageRejected("The uploaded file is not a supported image.")
+        image = PreparedImage(b'jpeg', 'image/jpeg', 600, 800, original_bytes=len(raw), duration_ms=1.0)
+        return ParsedReceipt({'items': []}, image, 'miss', {'gemini': 20.0}), None
+
+    def stream(self, images):
+        lines = BatchParseReceiptView.stream_results(None, images)
+        return [json.loads(line) for line in lines]
+
+    def test_concurrent_batches_share_the_pool(self):
+        images = [(index, f"{index}.jpg", b'photo') for index in range(6)]
+        results = []
+        with mock.patch('api.views._parse_in_worker', self.fake_parse):
+            batches = [threading.Thread(target=lambda: results.append(self.stream(images))) for _ in range(3)]
+            for batch in batches:
+                batch.start()
+            for batch in batches:
+                batch.join()
+
+        self.assertEqual([lines[-1] for lines in results], [{"done": True, "parsed": 6, "failed": 0}] * 3)
+        self.assertLessEqual(self.peak, settings.RECEIPT_BATCH_WORKERS)
+        self.assertLessEqual(len(self.threads), settings.RECEIPT_BATCH_WORKERS)
+        self.assertIs(batch_executor(), batch_executor())
+
+    def test_rejected_image_is_reported_per_line(self):
+        images = [(0, "a.jpg", b'photo'), (1, "b.heic", b'bad')]
+        with mock.patch('api.views._parse_in_worker', self.fake_parse):
+            lines = self.stream(images)
+        statuses = {line['filename']: line['status'] for line in lines[:-1]}
+        self.assertEqual(statuses, {"a.jpg": 200, "b.heic": 400})
+        self.assertEqual(lines[-1], {"done": True, "parsed": 1, "failed": 1})
+
+
+class ReceiptExpenseTests(FakeFXMixin, GroupTestCase):
+    """POST /api/groups/<id>/receipt-expense/ (user-046)."""
+
+    def setUp(self):
+        super().setUp()
+        storage = tempfile.TemporaryDirectory()
+        self.addCleanup(storage.cleanup)
+        storage_settings = override_settings(RECEIPT_STORAGE_DIR=storage.name)
+        storage_settings.enable()
+        self.addCleanup(storage_settings.disable)
+
+    def post_receipt(self, **fields):
+        photo = SimpleUploadedFile("receipt.jpg", receipt_photo(ReceiptParseCacheTests.BREAKFAST), 'image/jpeg')
+        return self.client.post(
+            f'/api/groups/{self.group.id}/receipt-expense/', {'image': photo, **fields}, format='multipart'
+        )
+
+    def test_receipt_becomes_itemized_expense(self):
+        response = self.post_receipt(participants=json.dumps([self.alice.id, self.bob.id]))
+        self.assertEqual(response.status_code, 201, response.data)
+        expense = Expense.objects.get(id=response.data['expense']['id'])
+        self.assertEqual(expense.split_type, 'I')
+        self.assertEqual(set(expense.splits.values_list('user_owed__username', flat=True)), {'alice', 'bob'})
+        self.assertNoDrift()
+
+    def test_participants_must_be_user_ids(self):
+        for participants in ('5', '"alice"', '{"0": [1]}', '[1, "2"]', '[true]', '[1.5]'):
+            with mock.patch('api.views.parse_receipt') as parse:
+                response = self.post_receipt(participants=participants)
+            self.assertEqual(response.status_code, 400, participants)
+            self.assertIn('participants', response.data['error'])
+            parse.assert_not_called()
+        self.assertFalse(Expense.objects.exists())
+
+    def stored_files(self):
+        return [path for path in pathlib.Path(settings.RECEIPT_STORAGE_DIR).rglob('*') if path.is_file()]
+
+    def post_parsed(self, items, **fields):
+        image = PreparedImage(b'jpeg', 'image/jpeg', 600, 800, original_bytes=100, duration_ms=1.0)
+        with mock.patch('api.views.parse_receipt', return_value=ParsedReceipt({'items': items}, image, 'miss')):
+            return self.post_receipt(**fields)
+
+    def test_rejected_expense_stores_no_photo(self):
+        response = self.post_receipt(payer_id=999)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ReceiptImage.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_items_in_another_currency_are_converted(self):
+        response = self.post_parsed([
+            {'item_en': "Burger", 'price': 10.00, 'currency': 'USD', 'price_in_cad': 13.70},
+            {'item_en': "Poutine", 'price': 5.00, 'currency': 'CAD', 'price_in_cad': 5.00},
+        ], currency='CAD')
+        self.assertEqual(response.status_code, 201, response.data)
+
+        expense = Expense.objects.get(id=response.data['expense']['id'])
+        self.assertEqual((expense.currency, expense.total_amount), ('CAD', decimal.Decimal('18.70')))
+        burger = json.loads(expense.item_data_json)['items'][0]
+        self.assertEqual((burger['price'], burger['original_price'], burger['original_currency']), (13.7, 10.0, 'USD'))
+        self.assertEqual(len(self.stored_files()), 1)
+
+    def test_item_currency_without_a_rate_is_rejected(self):
+        response = self.post_parsed([
+            {'item_en': "Burger", 'price': 10.00, 'currency': 'XYZ', 'price_in_cad': None},
+            {'item_en': "Poutine", 'price': 5.00, 'currency': 'CAD', 'price_in_cad': 5.00},
+        ], currency='CAD')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('XYZ', response.data['error'])
+        self.assertFalse(Expense.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+
+class ReceiptStorageTests(FakeFXMixin, GroupTestCase):
+    """Receipt photos stored by content hash and served from /api/receipts/ (user-048)."""
+
+    def setUp(self):
+        super().setUp()
+        storage = tempfile.TemporaryDirectory()
+        self.addCleanup(storage.cleanup)
+        storage_settings = override_settings(RECEIPT_STORAGE_DIR=storage.name, RECEIPT_THUMBNAIL_SIZES=[160, 480])
+        storage_settings.enable()
+        self.addCleanup(storage_settings.disable)
+        self.photo = receipt_photo(ReceiptParseCacheTests.BREAKFAST)
+
+    def upload(self, user):
+        self.client.force_authenticate(user)
+        photo = SimpleUploadedFile("receipt.jpg", self.photo, 'image/jpeg')
+        response = self.client.post('/api/ocr/parse-receipt/', {'image': photo}, format='multipart')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['image']
+
+    def fetch(self, url, user=None, **headers):
+        self.client.force_authenticate(user or self.alice)
+        response = self.client.get(url, headers=headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    def test_same_photo_is_stored_once(self):
+        first = self.upload(self.alice)
+        again = self.upload(self.bob)
+
+        self.assertEqual(first, again)
+        self.assertEqual(first['id'], hashlib.sha256(self.photo).hexdigest())
+        image = ReceiptImage.objects.get()
+        self.assertEqual(set(image.uploaded_by.values_list('username', flat=True)), {'alice', 'bob'})
+        files = [path for path in pathlib.Path(settings.RECEIPT_STORAGE_DIR).rglob('*') if path.is_file()]
+        self.assertEqual(files, [original_path(first['id'])])
+
+    def test_original_is_served_with_etag_and_cache_control(self):
+        image = self.upload(self.alice)
+        response, body = self.fetch(image['url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.photo)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['ETag'], f'"{image["id"]}"')
+        self.assertEqual(response['Cache-Control'], 'private, max-age=31536000, immutable')
+
+        response, body = self.fetch(image['url'], If_None_Match=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(body, b'')
+        self.assertEqual(response['Cache-Control'], 'private, max-age=31536000, immutable')
+
+    def test_thumbnail_is_made_on_first_request(self):
+        image = self.upload(self.alice)
+        thumbnail = thumbnail_path(image['id'], 160)
+        self.assertFalse(thumbnail.exists())
+
+        response, body = self.fetch(image['thumbnail_url'] + '?size=160')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], f'"{image["id"]}-160"')
+        self.assertTrue(thumbnail.exists())
+        with PIL.Image.open(io.BytesIO(body)) as thumb:
+            self.assertEqual((thumb.format, max(thumb.size)), ('JPEG', 160))
+
+        # Served from disk afterwards
+        with mock.patch('api.receiptstore.PIL.Image.open') as decode:
+            response, _ = self.fetch(image['thumbnail_url'] + '?size=160')
+        self.assertEqual(response.status_code, 200)
+        decode.assert_not_called()
+
+        response, _ = self.fetch(image['thumbnail_url'] + '?size=1000')
+        self.assertEqual(response.status_code, 400)
+
+    def test_only_uploaders_and_group_members_see_a_photo(self):
+        image = self.upload(self.alice)
+        dave = User.objects.create_user('dave', password='pw')
+        self.assertEqual(self.fetch(image['url'], self.carol)[0].status_code, 404)
+
+        # Attached to an expense of the group: every member may see it, outsiders still not
+        self.client.force_authenticate(self.alice)
+        self.add_expense("11.74", self.alice, receipt=image['id'])
+        self.assertEqual(self.fetch(image['url'], self.carol)[0].status_code, 200)
+        self.assertEqual(self.fetch(image['url'], dave)[0].status_code, 404)
+        self.assertEqual(self.fetch(f"/api/receipts/{'0' * 64}/")[0].status_code, 404)
+
+    def test_storage_failure_does_not_fail_the_parse(self):
+        with mock.patch('api.views.save_receipt_image', side_effect=OSError("disk full")), \
+                self.assertLogs('api.views', 'ERROR') as logs:
+            image = self.upload(self.alice)
+        self.assertIsNone(image)
+        self.assertIn("Could not store receipt image", logs.output[0])
+
+
+class CategorizeItemTests(TestCase):
+    """Receipt line categories match whole words (user-047)."""
+
+    def assertCategories(self, expected):
+        self.assertEqual({name: categorize_item(name) for name in expected}, expected)
+
+    def test_keywords_inside_other_words_do_not_match(self):
+        self.assertCategories({
+            "Steak": 'food',                  # not 'tea'
+            "Chocolate cake": 'desserts',     # not 'cola'
+            "Ginger chicken": 'food',         # not 'gin'
+            "Original burger": 'food',        # not 'gin'
+            "Watermelon": 'other',            # not 'water'
+            "2 pieces fried chicken": 'food',  # not 'pie'
+        })
+
+    def test_whole_words_and_plurals_match(self):
+        self.assertCategories({
+            "Gin & tonic": 'drinks',
+            "ICED TEA": 'drinks',
+            "Coca-Cola": 'drinks',
+            "Pork dumplings": 'food',
+            "Club sandwiches": 'food',
+            "Apple pie": 'desserts',
+            "Cheesecake": 'desserts',
+            "Service charge": 'fees',
+            "Widget": 'other',
+            "": 'other',
+        })
+
+
+class ItemSpendingTests(GroupTestCase):
+    """GET /api/groups/<id>/item-spending/ from stored line items (user-047)."""
+
+    def test_categories_of_itemized_expense(self):
+        items = [
+            {'name': "Steak", 'price': "30.00", 'assigned_to': [self.alice.id]},
+            {'name': "Chocolate cake", 'price': "8.00", 'assigned_to': [self.alice.id, self.bob.id]},
+            {'name': "Iced tea", 'price': "4.00", 'assigned_to': [self.bob.id]},
+        ]
+        self.add_expense("42.00", self.alice, split_type='I', item_data_json=json.dumps({'items': items}))
+
+        url = f'/api/groups/{self.group.id}/item-spending/'
+        self.assertEqual(self.client.get(url).json()['categories'], [
+            {"category": "food", "total": "30.00", "items": 1},
+            {"category": "desserts", "total": "8.00", "items": 1},
+            {"category": "drinks", "total": "4.00", "items": 1},
+        ])
+        self.assertEqual(self.client.get(url, {'mine': 'true'}).json()['categories'], [
+            {"category": "food", "total": "30.00", "items": 1},
+            {"category": "desserts", "total": "4.00", "items": 1},
+        ])
+
+
+class CountryRatingsTests(TestCase):
+    """GET /api/countries/<code>/ratings/ and /api/countries/ratings/ (user-049)."""
+
+    def get(self, url, **headers):
+        response = self.client.get(url, headers=headers)
+        return response, (json.loads(response.content) if response.status_code != 304 else None)
+
+    def test_lookup_by_code_and_name(self):
+        for key in ('FR', 'fr', 'France', 'FRANCE'):
+            response, country = self.get(f'/api/countries/{key}/ratings/')
+            self.assertEqual(response.status_code, 200, key)
+            self.assertEqual((country['code'], country['destination_name']), ('FR', "France"))
+        # Accents, punctuation and word order are ignored
+        for key, code in (("cote d'ivoire", 'CI'), ("Bolivia, Plurinational State of", 'BO'), ("United States", 'US')):
+            self.assertEqual(self.get(f'/api/countries/{key}/ratings/')[1]['code'], code, key)
+
+    def test_unknown_country(self):
+        response, body = self.get('/api/countries/ZZ/ratings/')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(body, {"error": "No ratings for 'ZZ'."})
+
+    def test_gzip_when_accepted(self):
+        plain, country = self.get('/api/countries/FR/ratings/')
+        response = self.client.get('/api/countries/FR/ratings/', headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content)), country)
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertNotEqual(response['ETag'], plain['ETag'])
+        for headers in (plain, response):
+            self.assertIn('Accept-Encoding', headers['Vary'])
+            self.assertEqual(headers['Cache-Control'], f'public, max-age={settings.COUNTRY_RATINGS_CACHE_SECONDS}')
+
+    def test_if_none_match(self):
+        first, _ = self.get('/api/countries/JP/ratings/')
+        response, _ = self.get('/api/countries/Japan/ratings/', If_None_Match=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], first['ETag'])
+        # Another country's ETag does not match
+        self.assertEqual(self.get('/api/countries/FR/ratings/', If_None_Match=first['ETag'])[0].status_code, 200)
+
+    def test_bulk_lookup(self):
+        response, body = self.get('/api/countries/ratings/?codes=FR, Japan,zz,france,,DE')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([country['code'] for country in body['countries']], ['FR', 'JP', 'DE'])
+        self.assertEqual(body['missing'], ['zz'])
+
+        _, everything = self.get('/api/countries/ratings/')
+        self.assertEqual(len(everything['countries']), 249)
+        self.assertEqual(everything['missing'], [])
+
+    def test_bulk_rejects_too_many_codes(self):
+        codes = ','.join(['FR'] * (MAX_BULK_KEYS + 1))
+        response, body = self.get(f'/api/countries/ratings/?codes={codes}')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('codes', body['error'])
+
+
+class DestinationRecommendationTests(TestCase):
+    """GET /api/countries/recommend/ over the ratings matrix (user-050)."""
+
+    def test_matrix_is_built_on_first_request(self):
+        ratings_matrix.cache_clear()
+        response = self.client.get('/api/countries/recommend/', {'k': 3})
+        self.assertEqual(response.status_code, 200)
+        self.client.get('/api/countries/recommend/', {'k': 3})
+        self.assertEqual(ratings_matrix.cache_info().misses, 1)
+
+    def test_results_pass_filters_best_first(self):
+        response = self.client.get('/api/countries/recommend/', {
+            'min_budget': 4, 'safety': 'normal', 'weights': 'cultural:2,natural:1', 'k': 10,
+        })
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertTrue(results)
+        scores = [result['score'] for result in results]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        for result in results:
+            self.assertGreaterEqual(result['ratings']['budget_friendliness'], 4)
+            self.assertEqual(result['safety'], 'Take normal security precautions')
+
+    def test_gunicorn_workers_build_the_matrix_before_serving(self):
+        spec = importlib.util.spec_from_file_location('gunicorn_conf', settings.BASE_DIR / 'gunicorn.conf.py')
+        gunicorn_conf = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(gunicorn_conf)
+
+        ratings_matrix.cache_clear()
+        gunicorn_conf.post_worker_init(worker=None)
+        self.assertEqual(ratings_matrix.cache_info().currsize, 1)
+
+    def test_safety_is_only_filtered_when_asked(self):
+        # Normal, avoid-all and no advisory at all
+        matrix = RatingsMatrix(
+            countries=[{'code': 'AA'}, {'code': 'BB'}, {'code': 'CC'}],
+            scores=np.full((3, len(CATEGORIES)), 3, dtype=np.float32),
+            safety=np.array([0, 3, len(SAFETY_LEVELS)], dtype=np.int8),
+        )
+        self.assertIsNone(parse_query({})['max_safety'])
+        self.assertEqual(sorted(row for row, _ in matrix.recommend()), [0, 1, 2])
+        avoid_all = parse_query({'safety': 'avoid-all'})['max_safety']
+        self.assertEqual(sorted(row for row, _ in matrix.recommend(max_safety=avoid_all)), [0, 1])
+        self.assertEqual([row for row, _ in matrix.recommend(max_safety=0)], [0])
+
+        unfiltered = self.client.get('/api/countries/recommend/', {'k': 50}).json()['results']
+        self.assertIn('Avoid all travel', {result['safety'] for result in unfiltered})
+
+    def test_invalid_query(self):
+        for params in ({'min_vibes': 3}, {'k': 0}, {'safety': 'yolo'}, {'weights': 'budget:-1'}):
+            self.assertEqual(self.client.get('/api/countries/recommend/', params).status_code, 400, params)
+
+
+class ItineraryItemOrderTests(TestCase):
+    """Reordering itinerary items through the move/insert-before actions (user-028)."""
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='pw')
+        self.bob = User.objects.create_user('bob', password='pw')
+        self.itinerary = Itinerary.objects.create(owner=self.alice, title="Lisbon")
+        # Day 1 is items 0-2, day 2 is items 3-4
+        day1 = datetime.datetime(2026, 5, 1, 9, tzinfo=datetime.timezone.utc)
+        day2 = day1 + datetime.timedelta(days=1)
+        self.items = [
+            self.itinerary.append_item(name, start_time=start)
+            for name, start in [("Castle", day1), ("Tram 28", day1), ("Fado", day1),
+                                ("Belem", day2), ("LX Factory", day2)]
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def move(self, item, order):
+        return self.client.post(f'/api/itinerary-items/{item.id}/move/', {'order': order}, format='json')
+
+    def descriptions(self):
+        return list(self.itinerary.items.values_list('description', flat=True))
+
+    def test_move_within_a_day(self):
+        response = self.move(self.items[2], 0)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['description'] for item in response.json()],
+                         ["Fado", "Castle", "Tram 28", "Belem", "LX Factory"])
+        self.assertEqual([item['order'] for item in response.json()], [0, 1, 2, 3, 4])
+
+    def test_move_across_days(self):
+        self.assertEqual(self.move(self.items[0], 3).status_code, 200)
+        self.assertEqual(self.descriptions(), ["Tram 28", "Fado", "Belem", "Castle", "LX Factory"])
+        self.assertEqual(self.move(self.items[4], 0).status_code, 200)
+        self.assertEqual(self.descriptions(), ["LX Factory", "Tram 28", "Fado", "Belem", "Castle"])
+
+    def test_move_rejects_positions_outside_the_itinerary(self):
+        for order in (-1, 5, 'last'):
+            self.assertEqual(self.move(self.items[0], order).status_code, 400, order)
+        self.assertEqual(self.descriptions(), ["Castle", "Tram 28", "Fado", "Belem", "LX Factory"])
+
+    def test_insert_before_shifts_later_items(self):
+        response = self.client.post(f'/api/itinerary-items/{self.items[1].id}/insert-before/',
+                                    {'description': "Coffee break"}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['order'], 1)
+        self.assertEqual(self.descriptions(), ["Castle", "Coffee break", "Tram 28", "Fado", "Belem", "LX Factory"])
+
+    def test_other_users_itinerary_is_rejected(self):
+        self.client.force_authenticate(self.bob)
+        response = self.client.post('/api/itinerary-items/', {
+            'itinerary': self.itinerary.id, 'description': "Pastel de nata", 'order': 5,
+        }, format='json')
+        self.assertEqual(response.status_code, 403)
+        # Bob cannot see Alice's items, so he cannot reorder them either
+        self.assertEqual(self.move(self.items[0], 4).status_code, 404)
+        self.assertEqual(self.descriptions(), ["Castle", "Tram 28", "Fado", "Belem", "LX Factory"])
+
+
+class ChatSessionStoreTests(TestCase):
+    """Bounds of the per-worker chat session store (user-026)."""
+
+    def setUp(self):
+        self.now = 0.0
+        self.store = ChatSessionStore(max_sessions=2, idle_seconds=60, clock=lambda: self.now)
+
+    def session(self):
+        return RefinementSession(chat=object(), owner_id=1)
+
+    def test_idle_sessions_are_evicted(self):
+        self.store.put('a', self.session())
+        self.now = 30
+        self.store.put('b', self.session())
+        self.now = 61
+        self.assertIsNone(self.store.get('a'))
+        self.assertIsNotNone(self.store.get('b'))
+        self.assertEqual(len(self.store), 1)
+
+    def test_least_recently_used_is_dropped_when_full(self):
+        for key in ('a', 'b'):
+            self.store.put(key, self.session())
+        self.store.get('a')
+        self.store.put('c', self.session())
+        self.assertIsNone(self.store.get('b'))
+        self.assertEqual(len(self.store), 2)
+
+    def test_get_or_create_replaces_stale_sessions(self):
+        first, created = self.store.get_or_create('a', lambda s: True, self.session)
+        self.assertTrue(created)
+        self.assertEqual(self.store.get_or_create('a', lambda s: True, self.session), (first, False))
+        second, created = self.store.get_or_create('a', lambda s: False, self.session)
+        self.assertTrue(created)
+        self.assertIsNot(second, first)
+
+
+class ItineraryRefineTests(TestCase):
+    """POST /api/itineraries/<id>/refine/ with the fake transport (user-026)."""
+
+    def setUp(self):
+        set_transport(GenAITransport(mode='fake'))
+        self.addCleanup(set_transport, None)
+        store = mock.patch('api.chat_sessions._store', ChatSessionStore(max_sessions=10, idle_seconds=600))
+        store.start()
+        self.addCleanup(store.stop)
+
+        self.user = User.objects.create_user('alice', password='pw')
+        self.itinerary = Itinerary.objects.create(owner=self.user, ai_generated_data={
+            'itinerary': fake_itinerary({'destination': 'Lisbon', 'tripLength': 2}),
+        })
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def refine(self, message):
+        response = self.client.post(f'/api/itineraries/{self.itinerary.id}/refine/',
+                                    {'message': message}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['refinement']
+
+    def test_follow_up_reuses_the_session(self):
+        first = self.refine("Make day 2 cheaper")
+        second = self.refine("Add a museum")
+
+        self.assertFalse(first['session_reused'])
+        self.assertTrue(second['session_reused'])
+        self.assertEqual(second['session_tokens']['turns'], 2)
+        self.assertEqual(second['session_tokens']['total_tokens'],
+                         first['tokens']['total_tokens'] + second['tokens']['total_tokens'])
+
+    def test_follow_up_on_another_worker_continues_from_the_shared_cache(self):
+        first = self.refine("Make day 2 cheaper")
+        # A different worker: same shared cache, empty session store
+        with mock.patch('api.chat_sessions._store', ChatSessionStore(max_sessions=10, idle_seconds=600)):
+            second = self.refine("Add a museum")
+
+        self.assertTrue(second['session_reused'])
+        self.assertEqual(second['session_tokens']['turns'], 2)
+        self.assertEqual(second['session_tokens']['prompt_tokens'],
+                         first['tokens']['prompt_tokens'] + second['tokens']['prompt_tokens'])
+        self.itinerary.refresh_from_db()
+        summary = self.itinerary.ai_generated_data['itinerary']['summary']
+        self.assertIn("Make day 2 cheaper", summary)
+        self.assertIn("Add a museum", summary)
+
+    def test_edit_outside_the_chat_starts_a_new_session(self):
+        self.refine("Make day 2 cheaper")
+        self.itinerary.refresh_from_db()
+        self.itinerary.title = "Renamed"
+        self.itinerary.save()
+        self.assertFalse(self.refine("Add a museum")['session_reused'])
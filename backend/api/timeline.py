@@ -0,0 +1,132 @@
+"""
+Running balance of every group member over time, computed in SQL.
+
+Per-bucket balance changes come from GROUP BY queries over Expense (paid),
+ExpenseSplit (owed) and Settlement (paid back / received), combined with
+UNION ALL. A window SUM() OVER (PARTITION BY user ORDER BY bucket) turns
+them into running balances, so the database does the replay instead of
+Python. Results are cached (in the cache shared by all workers, see
+CACHES in settings) under the group's ledger version, so they stay valid
+until the next write to the group.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+
+from .ledger import from_cents, ledger_version
+from .models import Expense, ExpenseSplit, Settlement
+
+BUCKETS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def _delta_queries(group, trunc):
+    """The four (bucket, user_id, amount) aggregates, signed."""
+    paid = Expense.objects.filter(group=group).annotate(
+        bucket=trunc('date'), user_id=F('payer_id')
+    ).values('bucket', 'user_id').annotate(amount=Sum('total_amount')).order_by()
+
+    owed = ExpenseSplit.objects.filter(expense__group=group).annotate(
+        bucket=trunc('expense__date'), user_id=F('user_owed_id')
+    ).values('bucket', 'user_id').annotate(amount=Sum(-F('amount_owed'))).order_by()
+
+    sent = Settlement.objects.filter(group=group).annotate(
+        bucket=trunc('date'), user_id=F('from_user_id')
+    ).values('bucket', 'user_id').annotate(amount=Sum('amount')).order_by()
+
+    received = Settlement.objects.filter(group=group).annotate(
+        bucket=trunc('date'), user_id=F('to_user_id')
+    ).values('bucket', 'user_id').annotate(amount=Sum(-F('amount'))).order_by()
+
+    return [paid, owed, sent, received]
+
+
+def running_balance_rows(group, bucket):
+    """
+    Rows of (bucket, user_id, delta_cents, running_cents), ordered by bucket.
+    A user only has a row in the buckets where their balance changed.
+    """
+    queries = _delta_queries(group, BUCKETS[bucket])
+    union = queries[0].union(*queries[1:], all=True)
+    union_sql, params = union.query.sql_with_params()
+
+    sql = f"""
+        SELECT bucket, user_id, delta,
+               SUM(delta) OVER (PARTITION BY user_id ORDER BY bucket) AS running
+        FROM (
+            SELECT bucket, user_id, CAST(ROUND(SUM(amount) * 100) AS BIGINT) AS delta
+            FROM ({union_sql}) AS deltas
+            GROUP BY bucket, user_id
+        ) AS per_bucket
+        ORDER BY bucket, user_id
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _period(value):
+    """Bucket start as an ISO date (SQLite returns text, others datetimes)."""
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return str(value)[:10]
+
+
+def group_timeline(group, bucket='week'):
+    """
+    Every member's running balance at the end of each bucket that had activity.
+
+    Returns:
+        {"bucket": "week", "members": [...],
+         "series": [{"period": "2025-10-20", "balances": {"alice": "12.00", ...}}, ...]}
+    """
+    cache_key = f"group-timeline:{group.id}:{bucket}:{ledger_version(group.id)}"
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    rows = running_balance_rows(group, bucket)
+
+    user_ids = {row[1] for row in rows}
+    members = dict(group.members.values_list('id', 'username'))
+    # Former members with history still show up
+    missing = user_ids - set(members)
+    if missing:
+        members.update(group.members.model.objects.filter(id__in=missing).values_list('id', 'username'))
+
+    # Carry each member's last running balance forward into buckets where it did not change
+    current = {user_id: 0 for user_id in members}
+    series = []
+
+    def close_period(period):
+        series.append({
+            'period': period,
+            'balances': {members[user_id]: f"{from_cents(cents):.2f}" for user_id, cents in current.items()},
+        })
+
+    period = None
+    for bucket_start, user_id, _, running in rows:
+        row_period = _period(bucket_start)
+        if period is not None and row_period != period:
+            close_period(period)
+        period = row_period
+        current[user_id] = running
+    if period is not None:
+        close_period(period)
+
+    timeline = {
+        'bucket': bucket,
+        'members': sorted(members.values()),
+        'series': series,
+    }
+    cache.set(cache_key, timeline, settings.TIMELINE_CACHE_SECONDS)
+    return timeline
@@ -1,9 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
-    UserCreateView, CustomAuthTokenLoginView, UserSearchView,
+    UserCreateView, CustomAuthTokenLoginView, UserSearchView, NetPositionView,
     ItineraryViewSet, ItineraryItemViewSet,
-    BillGroupViewSet, ExpenseViewSet, ParseReceiptView
+    BillGroupViewSet, ExpenseViewSet, SettlementViewSet, ParseReceiptView,
+    BatchParseReceiptView, ReceiptImageView, CountryRatingsView, BulkCountryRatingsView,
+    DestinationRecommendationView
 )
 
 # ... (urlpatterns = [...] is already here) ...
@@ -18,6 +20,7 @@ router.register(r'itinerary-items', ItineraryItemViewSet, basename='itineraryite
 # --- ADD THESE NEW ROUTES ---
 router.register(r'groups', BillGroupViewSet, basename='billgroup')
 router.register(r'expenses', ExpenseViewSet, basename='expense')
+router.register(r'payments', SettlementViewSet, basename='payment')
 
 urlpatterns = [
     # API endpoints from the router
@@ -25,13 +28,24 @@ urlpatterns = [
     # - /api/itineraries/ (list, create)
     # - /api/itineraries/<id>/ (retrieve, update, delete)
     # - /api/itineraries/generate/ (custom action)
+    # - /api/itineraries/<id>/refine/ (custom action)
     # - /api/itinerary-items/ (list, create)
     # - /api/itinerary-items/<id>/ (retrieve, update, delete)
+    # - /api/itinerary-items/<id>/move/ (custom action)
+    # - /api/itinerary-items/<id>/insert-before/ (custom action)
     # - /api/groups/ (list, create)
     # - /api/groups/<id>/ (retrieve, update, delete)
     # - /api/groups/<id>/balances/ (custom action)
+    # - /api/groups/<id>/import-expenses/ (custom action)
+    # - /api/groups/<id>/receipt-expense/ (custom action)
+    # - /api/groups/<id>/export/ (custom action)
+    # - /api/groups/<id>/timeline/ (custom action)
+    # - /api/groups/<id>/analytics/ (custom action)
+    # - /api/groups/<id>/item-spending/ (custom action)
     # - /api/expenses/ (list, create)
     # - /api/expenses/<id>/ (retrieve, update, delete)
+    # - /api/payments/ (list, create)
+    # - /api/payments/<id>/ (retrieve, delete)
     path('', include(router.urls)),
 
     # Auth endpoints
@@ -40,9 +54,22 @@ urlpatterns = [
     
     # User search endpoint
     path('users/search/', UserSearchView.as_view(), name='user-search'),
+
+    # Cross-group position of the current user
+    path('users/me/net-positions/', NetPositionView.as_view(), name='net-positions'),
     
-    # OCR endpoint
+    # OCR endpoints: one image, or a batch streamed back as NDJSON
     path('ocr/parse-receipt/', ParseReceiptView.as_view(), name='parse-receipt'),
+    path('ocr/parse-receipts/', BatchParseReceiptView.as_view(), name='parse-receipts'),
+
+    # Stored receipt photos and their thumbnails (cacheable for a year)
+    path('receipts/<str:sha256>/', ReceiptImageView.as_view(), name='receipt-image'),
+    path('receipts/<str:sha256>/thumbnail/', ReceiptImageView.as_view(thumbnail=True), name='receipt-thumbnail'),
+
+    # Country ratings from the in-memory index: several at once, or one by code or name
+    path('countries/ratings/', BulkCountryRatingsView.as_view(), name='country-ratings-bulk'),
+    path('countries/recommend/', DestinationRecommendationView.as_view(), name='country-recommend'),
+    path('countries/<str:code>/ratings/', CountryRatingsView.as_view(), name='country-ratings'),
 ]
 
 
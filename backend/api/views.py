@@ -1,7 +1,8 @@
-from rest_framework import generics, viewsets, status, serializers
+from rest_framework import generics, mixins, viewsets, status, serializers
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.authtoken.views import ObtainAuthToken
@@ -9,19 +10,41 @@ from rest_framework.authtoken.models import Token
 from django.conf import settings # To get the API key
 from django.contrib.auth.models import User
 from .models import (
-    Itinerary, ItineraryItem, BillGroup, Expense, ExpenseSplit # Add new models
+    Itinerary, ItineraryItem, BillGroup, Expense, ExpenseSplit, Settlement # Add new models
 )
 from .serializers import (
     UserSerializer, UserSimpleSerializer, ItineraryDetailSerializer, ItineraryListSerializer,
-    ItineraryItemSerializer, BillGroupSerializer, BillGroupDetailSerializer,
-    ExpenseSerializer, ExpenseReadSerializer # Add new serializers
+    ItineraryItemSerializer, ItineraryItemCreateSerializer,
+    BillGroupSerializer, BillGroupDetailSerializer,
+    ExpenseSerializer, ExpenseReadSerializer, ExpenseImportRowSerializer,
+    SettlementSerializer # Add new serializers
 )
+from django.db import connection, transaction
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.db.models import Sum, Q, F, DecimalField
-import decimal, requests, json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import decimal, json, logging, threading, time
 
-import google.generativeai as genai
-import PIL.Image
-from .schema import Receipt # Import our Pydantic schema
+from .ledger import (
+    from_cents, to_cents, group_balances, group_net_cents, invalidate_checkpoints, record_expenses,
+    reverse_expense, reverse_settlement, user_positions
+)
+from .settlements import plan_settlements
+from .splits import SplitError, assign_receipt_items
+from .exports import ledger_rows, stream_csv, stream_ndjson
+from .timeline import BUCKETS, group_timeline
+from .analytics import group_analytics
+from .lineitems import item_spending, write_line_items
+from .fx import FXUnavailable, get_fx_service
+from .receiptimage import ImageRejected, limit_upload_size, server_timing
+from .receiptparse import GeminiNotConfigured, configure_gemini, log_parse, parse_receipt
+from .receiptstore import accessible_images, ensure_thumbnail, original_path, receipt_urls, save_receipt_image
+from .countries import MAX_BULK_KEYS, countries_body, country_body
+from .recommend import InvalidQuery, parse_query, ratings_matrix, recommendation
+
+logger = logging.getLogger(__name__)
 
 
 # ============================================
@@ -90,6 +113,100 @@ class UserSearchView(generics.ListAPIView):
         return queryset.order_by('username')[:20] # Return max 20 results
 
 
+class NetPositionView(APIView):
+    """
+    The requesting user's position against everyone they share a group with.
+    GET /api/users/me/net-positions/
+    GET /api/users/me/net-positions/?netted=true   (adds a settlement plan)
+    GET /api/users/me/net-positions/?currency=EUR  (totals currency, default CAD)
+
+    Positive amounts mean the other user owes you. Positions follow who paid
+    for whom (minus recorded payments), summed over all of your groups.
+    Per-group amounts are in the group's currency; totals are converted to
+    `currency` (one rate per group currency, not per expense).
+    Returns:
+    {
+        "currency": "CAD",
+        "net": "12.50",
+        "counterparties": [
+            {"user_id": 2, "username": "bob", "net": "20.00",
+             "groups": [{"group_id": 1, "group_name": "NYC Trip Crew", "currency": "CAD", "net": "20.00"}]},
+            ...
+        ],
+        "transfers_without_netting": 3,
+        "netted_settlements": [{"from": "bob", "to": "alice", "amount": "20.00"}, ...]
+    }
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        user = request.user
+
+        # Step 1: (counterparty, group) -> cents in one aggregate query per table
+        positions = user_positions(user)
+
+        counterparty_ids = {counterparty_id for counterparty_id, _ in positions}
+        group_ids = {group_id for _, group_id in positions}
+        usernames = dict(User.objects.filter(id__in=counterparty_ids).values_list('id', 'username'))
+        groups = {
+            group_id: (name, currency)
+            for group_id, name, currency in BillGroup.objects.filter(id__in=group_ids).values_list('id', 'name', 'currency')
+        }
+
+        # Step 2: One exchange rate per group currency
+        target = request.query_params.get('currency', 'CAD').upper()
+        try:
+            rates = {
+                currency: decimal.Decimal(str(get_fx_service().rate(currency, target)))
+                for currency in {currency for _, currency in groups.values()}
+            }
+        except FXUnavailable as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Step 3: Collapse the groups into one position per counterparty
+        totals = {}
+        per_group = {}
+        for (counterparty_id, group_id), cents in sorted(positions.items()):
+            name, currency = groups[group_id]
+            converted = cents if rates[currency] == 1 else to_cents(from_cents(cents) * rates[currency])
+            totals[counterparty_id] = totals.get(counterparty_id, 0) + converted
+            per_group.setdefault(counterparty_id, []).append({
+                "group_id": group_id,
+                "group_name": name,
+                "currency": currency,
+                "net": f"{from_cents(cents):.2f}",
+            })
+
+        counterparties = [
+            {
+                "user_id": counterparty_id,
+                "username": usernames.get(counterparty_id),
+                "net": f"{from_cents(cents):.2f}",
+                "groups": per_group[counterparty_id],
+            }
+            for counterparty_id, cents in sorted(totals.items(), key=lambda item: -abs(item[1]))
+        ]
+
+        data = {
+            "currency": target,
+            "net": f"{from_cents(sum(totals.values())):.2f}",
+            "counterparties": counterparties,
+            # Settling every group separately takes one transfer per (group, counterparty)
+            "transfers_without_netting": len(positions),
+        }
+
+        # Step 4 (optional): settle everything at once. Debts cancel across
+        # groups, and the plan may route money directly between counterparties.
+        if request.query_params.get('netted', '').lower() in ('1', 'true', 'yes'):
+            balances = {usernames.get(counterparty_id): -cents for counterparty_id, cents in totals.items()}
+            balances[user.username] = sum(totals.values())
+            plan = plan_settlements(balances)
+            data["netted_settlements"] = plan.as_list()
+            data["strategy"] = plan.strategy
+
+        return Response(data)
+
+
 # ============================================
 # ITINERARY VIEWS
 # Corresponds to "select region", "input detailed needs", "edit itinerary"
@@ -104,6 +221,7 @@ class ItineraryViewSet(viewsets.ModelViewSet):
     - Update itinerary: PUT/PATCH /api/itineraries/<id>/
     - Delete itinerary: DELETE /api/itineraries/<id>/
     - Generate itinerary (custom): POST /api/itineraries/generate/
+    - Refine itinerary (custom): POST /api/itineraries/<id>/refine/
     """
     permission_classes = [IsAuthenticated]  # User must be logged in
 
@@ -188,6 +306,119 @@ class ItineraryViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=True, methods=['post'])
+    def refine(self, request, pk=None):
+        """
+        CUSTOM ACTION: /api/itineraries/<id>/refine/
+        Conversational refinement of an AI-generated itinerary.
+
+        Request body:
+        {
+            "message": "Make day 2 cheaper"
+        }
+
+        The first refinement opens a chat session seeded with the full itinerary.
+        Follow-up refinements reuse that session, so only the message is sent.
+        Each worker keeps its chats in memory; the history and token totals are
+        also kept in the shared cache, so a follow-up handled by another worker
+        continues the same conversation. Sessions are dropped when idle.
+
+        Returns: The updated itinerary plus token counts for this refinement
+        and for the whole session.
+        """
+        itinerary = self.get_object()
+        message = request.data.get('message')
+
+        if not message or not str(message).strip():
+            return Response(
+                {"error": "Missing required field: 'message'"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        ai_data = itinerary.ai_generated_data or {}
+        if not ai_data.get('itinerary'):
+            return Response(
+                {"error": "This itinerary has no AI-generated data to refine."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            from .chat_sessions import (
+                RefinementSession, drop_snapshot, get_session_store, load_snapshot, save_snapshot,
+            )
+            from .genaiitinerary import build_refinement_context, chat_history, refine_itinerary, start_chat
+
+            # Step 1: Reuse this worker's chat if it belongs to the user and has
+            # seen the current itinerary. Otherwise rebuild it from the shared
+            # snapshot another worker left, or start a new one.
+            def is_current(session):
+                return (session.owner_id == request.user.id and
+                        session.itinerary_version == itinerary.updated_at)
+
+            def create_session():
+                snapshot = load_snapshot(itinerary.id, itinerary.updated_at)
+                if snapshot is not None and snapshot['owner_id'] != request.user.id:
+                    snapshot = None
+                session = RefinementSession(
+                    chat=start_chat(
+                        build_refinement_context(ai_data['itinerary']),
+                        history=snapshot['history'] if snapshot else None
+                    ),
+                    owner_id=request.user.id,
+                    itinerary_version=itinerary.updated_at,
+                )
+                if snapshot:
+                    session.restore_totals(snapshot['totals'])
+                return session
+
+            session, _ = get_session_store().get_or_create(itinerary.id, is_current, create_session)
+
+            # Step 2: Send the message, save the itinerary and share the new history
+            with session.lock:
+                # A request that waited for the lock sees the itinerary as the
+                # previous refinement left it
+                if session.itinerary_version != itinerary.updated_at:
+                    itinerary.refresh_from_db()
+                    ai_data = itinerary.ai_generated_data or {}
+                session_reused = session.turns > 0
+                previous_version = session.itinerary_version
+                result = refine_itinerary(session.chat, str(message).strip())
+                session.record_usage(result['usage'])
+
+                refined = result['itinerary']
+                itinerary.ai_generated_data = {
+                    **ai_data,
+                    'itinerary': refined,
+                    'itineraryJson': result['itineraryJson'],
+                }
+                itinerary.title = refined.get('tripTitle', itinerary.title)
+                itinerary.save()
+                session.itinerary_version = itinerary.updated_at
+
+                save_snapshot(itinerary.id, session, chat_history(session.chat))
+                drop_snapshot(itinerary.id, previous_version)
+
+            serializer = ItineraryDetailSerializer(itinerary)
+            return Response({
+                'itinerary': serializer.data,
+                'refinement': {
+                    'session_reused': session_reused,
+                    'tokens': result['usage'],
+                    'session_tokens': session.totals(),
+                }
+            })
+
+        except ImportError:
+            return Response(
+                {'error': 'AI generation module not available. Please ensure genaiitinerary.py is in the api folder.'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        except Exception as e:
+            return Response(
+                {'error': f'Failed to refine itinerary: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
 
 class ItineraryItemViewSet(viewsets.ModelViewSet):
     """
@@ -199,6 +430,8 @@ class ItineraryItemViewSet(viewsets.ModelViewSet):
     - Create item: POST /api/itinerary-items/
     - Update item: PUT/PATCH /api/itinerary-items/<id>/
     - Delete item: DELETE /api/itinerary-items/<id>/
+    - Move item: POST /api/itinerary-items/<id>/move/
+    - Insert before item: POST /api/itinerary-items/<id>/insert-before/
     """
     permission_classes = [IsAuthenticated]
 
@@ -208,6 +441,77 @@ class ItineraryItemViewSet(viewsets.ModelViewSet):
     
     serializer_class = ItineraryItemSerializer
 
+    def get_serializer_class(self):
+        # Creating an item needs the itinerary it belongs to
+        if self.action == 'create':
+            return ItineraryItemCreateSerializer
+        return ItineraryItemSerializer
+
+    def perform_create(self, serializer):
+        # Only allow adding items to the user's own itineraries
+        if serializer.validated_data['itinerary'].owner_id != self.request.user.id:
+            raise PermissionDenied("You can only add items to your own itineraries.")
+        serializer.save()
+
+    @action(detail=True, methods=['post'])
+    def move(self, request, pk=None):
+        """
+        CUSTOM ACTION: /api/itinerary-items/<id>/move/
+        Moves the item to a new position; the items in between shift by one.
+
+        Request body:
+        {
+            "order": 0
+        }
+
+        Returns: The itinerary's items in their new order
+        """
+        item = self.get_object()
+        last_order = item.itinerary.items.count() - 1
+        try:
+            new_order = int(request.data.get('order'))
+        except (TypeError, ValueError):
+            new_order = None
+        if new_order is None or not 0 <= new_order <= last_order:
+            return Response(
+                {"error": f"'order' must be a position from 0 to {last_order}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        with transaction.atomic():
+            item.move_to(new_order)
+        return Response(ItineraryItemSerializer(item.itinerary.items.all(), many=True).data)
+
+    @action(detail=True, methods=['post'], url_path='insert-before')
+    def insert_before(self, request, pk=None):
+        """
+        CUSTOM ACTION: /api/itinerary-items/<id>/insert-before/
+        Creates a new item at this item's position; this item and every
+        item after it shift down by one.
+
+        Request body:
+        {
+            "description": "Coffee break",
+            "location_name": "Cafe",          (optional)
+            "start_time": "...", "end_time": "..."   (optional)
+        }
+
+        Returns: The new item (201)
+        """
+        item = self.get_object()
+        data = {key: request.data.get(key) for key in ('description', 'location_name', 'start_time', 'end_time')
+                if key in request.data}
+        serializer = ItineraryItemSerializer(data={**data, 'order': item.order})
+        serializer.is_valid(raise_exception=True)
+        fields = serializer.validated_data
+
+        with transaction.atomic():
+            new_item = item.insert_before(
+                fields['description'], location_name=fields.get('location_name', ''),
+                start_time=fields.get('start_time'), end_time=fields.get('end_time')
+            )
+        return Response(ItineraryItemSerializer(new_item).data, status=status.HTTP_201_CREATED)
+
 # --- LEDGER APP VIEWS ---
 
 class BillGroupViewSet(viewsets.ModelViewSet):
@@ -253,6 +557,326 @@ class BillGroupViewSet(viewsets.ModelViewSet):
             users_to_add = User.objects.filter(id__in=member_ids).exclude(id=self.request.user.id) # Exclude self if passed
             group.members.add(*users_to_add) # Add the valid users
     
+    @action(detail=True, methods=['post'], url_path='import-expenses')
+    def import_expenses(self, request, pk=None):
+        """
+        CUSTOM ACTION: /api/groups/<id>/import-expenses/
+        Creates many expenses (with their splits) in one request.
+        Rows use the same fields as POST /api/expenses/, minus 'group'.
+
+        Body:
+        {
+            "expenses": [
+                {"description": "Dinner", "total_amount": "30.00", "payer_id": 1,
+                 "date": "2025-10-03T19:30:00Z",   # optional, default: now
+                 "split_type": "E", "splits": [{"user_owed_id": 1, "amount_owed": "15.00"}, ...]},
+                ...
+            ],
+            "all_or_nothing": true   # default; false imports the valid rows only
+        }
+
+        Returns:
+        {"created": 2, "expense_ids": [10, 11], "errors": [{"row": 3, "errors": {...}}]}
+        """
+        group = self.get_object()
+        rows = request.data.get('expenses')
+        all_or_nothing = request.data.get('all_or_nothing', True)
+        if isinstance(all_or_nothing, str):
+            all_or_nothing = all_or_nothing.lower() in ('1', 'true', 'yes')
+
+        if not isinstance(rows, list) or not rows:
+            return Response(
+                {"error": "'expenses' must be a non-empty list."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(rows) > settings.EXPENSE_IMPORT_MAX_ROWS:
+            return Response(
+                {"error": f"At most {settings.EXPENSE_IMPORT_MAX_ROWS} expenses per import."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Step 1: Validate every row against one shared copy of the member ids
+        context = {
+            'request': request,
+            'group': group,
+            'member_ids': set(group.members.values_list('id', flat=True)),
+        }
+        valid_rows = []
+        errors = []
+        for index, row in enumerate(rows):
+            row_serializer = ExpenseImportRowSerializer(data=row, context=context)
+            if row_serializer.is_valid():
+                valid_rows.append(row_serializer.validated_data)
+            else:
+                errors.append({"row": index, "errors": row_serializer.errors})
+
+        if errors and (all_or_nothing or not valid_rows):
+            return Response(
+                {"created": 0, "expense_ids": [], "errors": errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Step 2: Write all expenses, then all splits, in one transaction
+        batch_size = 500
+        now = timezone.now()
+        with transaction.atomic():
+            expenses = Expense.objects.bulk_create([
+                Expense(
+                    group=group,
+                    payer_id=row['payer_id'],
+                    description=row['description'],
+                    date=row.get('date') or now,
+                    total_amount=row['total_amount'],
+                    currency=row['currency'],
+                    original_amount=row['original_amount'],
+                    fx_rate=row['fx_rate'],
+                    split_type=row.get('split_type', 'E'),
+                    receipt_image=row.get('receipt_image'),
+                    item_data_json=row.get('item_data_json'),
+                )
+                for row in valid_rows
+            ], batch_size=batch_size)
+
+            splits_per_expense = [
+                [
+                    ExpenseSplit(expense=expense, user_owed_id=split['user_owed_id'],
+                                 amount_owed=split['amount_owed'], original_amount=split['original_amount'])
+                    for split in row['splits']
+                ]
+                for expense, row in zip(expenses, valid_rows)
+            ]
+            ExpenseSplit.objects.bulk_create(
+                [split for splits in splits_per_expense for split in splits],
+                batch_size=batch_size
+            )
+
+            # Step 3: One balance update for the whole import, then the receipt line items
+            record_expenses(group.id, zip(expenses, splits_per_expense))
+            write_line_items(expenses, batch_size=batch_size)
+
+        logger.info("Imported %d expenses into group %d (%d rows rejected)", len(expenses), group.id, len(errors))
+
+        return Response(
+            {
+                "created": len(expenses),
+                "expense_ids": [expense.id for expense in expenses],
+                "errors": errors,
+            },
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(detail=True, methods=['post'], url_path='receipt-expense',
+            parser_classes=[MultiPartParser, FormParser])
+    def receipt_expense(self, request, pk=None):
+        """
+        CUSTOM ACTION: /api/groups/<id>/receipt-expense/
+        Parses a receipt photo and records it as an itemized ('I') expense
+        in one request. Multipart fields:
+        - image: the receipt photo (required)
+        - assignments: JSON, who shares each item, by position:
+          [[1, 2], [2], ...] or {"0": [1, 2], "3": [2]}
+        - participants: JSON list of user ids sharing unassigned items (default: every member)
+        - payer_id (default: you), description (default: "Receipt"),
+          tax, tip (in `currency`), currency (default: the items' currency)
+
+        Items in another currency than `currency` are converted at the current
+        rate. Once everything validates, the photo is stored (see
+        api/receiptstore.py) and attached to the expense.
+
+        The expense, its splits and the balance updates are written in one
+        transaction; nothing is written if the assignment does not validate.
+
+        Returns (201):
+        {"expense": {...}, "receipt": {"items": [...]}, "image": {"id", "url", "thumbnail_url"}, "cached": false}
+        """
+        group = self.get_object()
+
+        # Step 1: Check the upload and the other fields, so bad input fails before Gemini is called
+        upload_limit, too_large = limit_upload_size(request)
+        image_file = None if too_large else request.data.get('image')
+        if too_large or upload_limit.exceeded:
+            return Response(
+                {"error": f"The image must be at most {settings.RECEIPT_MAX_UPLOAD_BYTES // (1024 * 1024)} MB."},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        if not image_file:
+            return Response(
+                {"error": "No image file provided in 'image' field."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            assignments = json.loads(request.data.get('assignments') or 'null')
+            participants = json.loads(request.data.get('participants') or 'null')
+        except json.JSONDecodeError:
+            return Response(
+                {"error": "'assignments' and 'participants' must be JSON."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if participants is not None and not (
+            isinstance(participants, list)
+            and all(isinstance(user_id, int) and not isinstance(user_id, bool) for user_id in participants)
+        ):
+            return Response(
+                {"error": "'participants' must be a list of user ids."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Step 2: Parse the receipt (outside any transaction: Gemini can take seconds)
+        raw = image_file.read()
+        try:
+            configure_gemini()
+            parsed = parse_receipt(request.user, raw)
+        except ImageRejected as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response(
+                {"error": f"Failed to parse receipt: {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        log_parse(parsed)
+        receipt = parsed.data
+
+        # Step 3: Turn the items and their assignment into an itemized expense,
+        # with every item in the expense currency
+        currencies = {item['currency'].upper() for item in receipt['items']}
+        currency = (request.data.get('currency') or (currencies.pop() if len(currencies) == 1 else '')).upper()
+        if not currency:
+            return Response(
+                {"error": "The receipt has items in several currencies; send 'currency'.", "receipt": receipt},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            items = _items_in_currency(receipt['items'], currency)
+        except FXUnavailable as e:
+            return Response({"error": str(e), "receipt": receipt}, status=status.HTTP_400_BAD_REQUEST)
+        if participants is None:
+            participants = list(group.members.values_list('id', flat=True))
+        try:
+            item_data, total_cents = assign_receipt_items(
+                items, assignments, participants,
+                tax=request.data.get('tax'), tip=request.data.get('tip')
+            )
+        except SplitError as e:
+            return Response({"error": str(e), "receipt": receipt}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Step 4: Validate it like any other expense
+        serializer = ExpenseSerializer(data={
+            'group': group.id,
+            'description': request.data.get('description') or "Receipt",
+            'total_amount': str(from_cents(total_cents)),
+            'payer_id': request.data.get('payer_id') or request.user.id,
+            'split_type': 'I',
+            'item_data_json': json.dumps(item_data),
+            'currency': currency,
+        }, context={'request': request})
+        if not serializer.is_valid():
+            return Response(
+                {"error": serializer.errors, "receipt": receipt},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Step 5: Store the photo only now, so rejected requests leave no file
+        # behind, and write the expense (one transaction)
+        image = _store_upload(request.user, raw)
+        expense = serializer.save(receipt_id=image["id"] if image else None)
+
+        return Response(
+            {
+                "expense": ExpenseReadSerializer(expense).data,
+                "receipt": receipt,
+                "image": image,
+                "cached": parsed.cached,
+            },
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """
+        CUSTOM ACTION: /api/groups/<id>/export/?output=csv|ndjson
+        Streams the group's whole expense history, one row per split,
+        oldest first. Rows are fetched and written in chunks, so memory
+        use does not grow with the size of the group.
+        """
+        group = self.get_object()
+        output = request.query_params.get('output', 'csv').lower()
+
+        if output == 'csv':
+            content, content_type = stream_csv(ledger_rows(group)), 'text/csv'
+        elif output == 'ndjson':
+            content, content_type = stream_ndjson(ledger_rows(group)), 'application/x-ndjson'
+        else:
+            return Response(
+                {"error": "'output' must be 'csv' or 'ndjson'."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="group-{group.id}-ledger.{output}"'
+        return response
+
+    @action(detail=True, methods=['get'])
+    def timeline(self, request, pk=None):
+        """
+        CUSTOM ACTION: /api/groups/<id>/timeline/?bucket=day|week|month
+        Every member's running balance over time, one point per bucket with
+        activity. Computed in SQL and cached until the group's next write.
+
+        Returns:
+        {"bucket": "week", "members": ["alice", "bob"],
+         "series": [{"period": "2025-10-20", "balances": {"alice": "15.00", "bob": "-15.00"}}, ...]}
+        """
+        group = self.get_object()
+        bucket = request.query_params.get('bucket', 'week').lower()
+        if bucket not in BUCKETS:
+            return Response(
+                {"error": f"'bucket' must be one of: {', '.join(BUCKETS)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(group_timeline(group, bucket))
+
+    @action(detail=True, methods=['get'])
+    def analytics(self, request, pk=None):
+        """
+        CUSTOM ACTION: /api/groups/<id>/analytics/?from=2025-01-01&to=2025-12-31&top=10
+        Spending totals by payer, by member share, by day and by month,
+        plus the largest expenses. Served from the daily rollup table.
+        """
+        group = self.get_object()
+
+        try:
+            start = parse_date(request.query_params['from']) if request.query_params.get('from') else None
+            end = parse_date(request.query_params['to']) if request.query_params.get('to') else None
+            top = min(int(request.query_params.get('top', 10)), 100)
+        except ValueError:
+            start = end = top = None
+        if top is None or top < 0 or (request.query_params.get('from') and not start) \
+                or (request.query_params.get('to') and not end):
+            return Response(
+                {"error": "'from'/'to' must be YYYY-MM-DD dates and 'top' a non-negative number."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(group_analytics(group, start, end, top))
+
+    @action(detail=True, methods=['get'], url_path='item-spending')
+    def item_spending(self, request, pk=None):
+        """
+        CUSTOM ACTION: /api/groups/<id>/item-spending/?mine=true&category=drinks
+        Spending on receipt line items per category ('drinks', 'food',
+        'desserts', 'fees', 'other'), from the itemized expenses.
+        With ?mine=true only your share of each item counts.
+
+        Returns:
+        {"currency": "CAD", "categories": [{"category": "drinks", "total": "42.50", "items": 7}, ...]}
+        """
+        group = self.get_object()
+        mine = request.query_params.get('mine', '').lower() in ('1', 'true', 'yes')
+        categories = item_spending(
+            group, user=request.user if mine else None, category=request.query_params.get('category')
+        )
+        return Response({"currency": group.currency, "categories": categories})
+
     @action(detail=True, methods=['get'])
     def balances(self, request, pk=None):
         """
@@ -261,33 +885,7 @@ class BillGroupViewSet(viewsets.ModelViewSet):
         This is the "Settle Up" logic.
         """
         group = self.get_object()
-        
-        # 1. Get total amount *paid* by each user
-        total_paid = group.expenses.filter(group=group).values(
-            'payer__username'
-        ).annotate(
-            paid=Sum('total_amount')
-        ).order_by() # payer__username, paid
-
-        # 2. Get total amount *owed* by each user
-        total_owed = ExpenseSplit.objects.filter(expense__group=group).values(
-            'user_owed__username'
-        ).annotate(
-            owed=Sum('amount_owed')
-        ).order_by() # user_owed__username, owed
-
-        # 3. Combine them in a dictionary, initializing all members
-        balances = {}
-        for member in group.members.all():
-            balances[member.username] = decimal.Decimal('0.00')
-
-        # Add payments
-        for paid_data in total_paid:
-            balances[paid_data['payer__username']] += paid_data['paid']
-            
-        # Subtract debts
-        for owed_data in total_owed:
-            balances[owed_data['user_owed__username']] -= owed_data['owed']
+        balances = group_balances(group)
 
         # Format: [ {"username": "alice", "balance": "15.50"}, ... ]
         final_balances = [
@@ -301,85 +899,41 @@ class BillGroupViewSet(viewsets.ModelViewSet):
     def settlements(self, request, pk=None):
         """
         CUSTOM ACTION: /api/groups/<id>/settlements/
-        Calculates the optimal settlement plan - who owes whom.
-        Uses a greedy algorithm to minimize the number of transactions.
+        Calculates the settlement plan with the fewest transfers - who owes whom.
+        Small groups get an exact search, large ones a fast heuristic
+        (see api/settlements.py).
         
         Returns:
         [
             {"from": "bob", "to": "alice", "amount": "30.00"},
             {"from": "charlie", "to": "alice", "amount": "20.00"}
         ]
+
+        Amounts are in the group's currency.
+
+        With ?detail=true the list is wrapped with how it was found:
+        {"settlements": [...], "currency": "CAD", "strategy": "exact", "transfers": 2,
+         "lower_bound": 2, "gap": 0}
         """
         group = self.get_object()
-        
-        # Step 1: Calculate net balances for each member (same as balances endpoint)
-        total_paid = group.expenses.filter(group=group).values(
-            'payer__username'
-        ).annotate(
-            paid=Sum('total_amount')
-        ).order_by()
-
-        total_owed = ExpenseSplit.objects.filter(expense__group=group).values(
-            'user_owed__username'
-        ).annotate(
-            owed=Sum('amount_owed')
-        ).order_by()
-
-        balances = {}
-        for member in group.members.all():
-            balances[member.username] = decimal.Decimal('0.00')
-
-        for paid_data in total_paid:
-            balances[paid_data['payer__username']] += paid_data['paid']
-            
-        for owed_data in total_owed:
-            balances[owed_data['user_owed__username']] -= owed_data['owed']
-        
-        # Step 2: Separate creditors (positive balance) and debtors (negative balance)
-        creditors = []  # People who are owed money
-        debtors = []    # People who owe money
-        
-        for username, balance in balances.items():
-            if balance > decimal.Decimal('0.01'):  # Use small epsilon for floating point comparison
-                creditors.append({"username": username, "amount": balance})
-            elif balance < decimal.Decimal('-0.01'):
-                debtors.append({"username": username, "amount": abs(balance)})
-        
-        # Step 3: Match debtors to creditors using greedy algorithm
-        settlements = []
-        
-        # Sort by amount (largest first) for better distribution
-        creditors.sort(key=lambda x: x['amount'], reverse=True)
-        debtors.sort(key=lambda x: x['amount'], reverse=True)
-        
-        i = 0  # creditor index
-        j = 0  # debtor index
-        
-        while i < len(creditors) and j < len(debtors):
-            creditor = creditors[i]
-            debtor = debtors[j]
-            
-            # Calculate the settlement amount (minimum of what's owed and what's due)
-            settlement_amount = min(creditor['amount'], debtor['amount'])
-            
-            # Only record transactions that are meaningful (> $0.01)
-            if settlement_amount > decimal.Decimal('0.01'):
-                settlements.append({
-                    "from": debtor['username'],
-                    "to": creditor['username'],
-                    "amount": f"{settlement_amount:.2f}"
-                })
-            
-            # Update remaining amounts
-            creditor['amount'] -= settlement_amount
-            debtor['amount'] -= settlement_amount
-            
-            # Move to next creditor/debtor if current one is settled
-            if creditor['amount'] < decimal.Decimal('0.01'):
-                i += 1
-            if debtor['amount'] < decimal.Decimal('0.01'):
-                j += 1
-        
+
+        # Step 1: Net balances for each member, in cents
+        balances = group_net_cents(group)
+
+        # Step 2: Find the plan with the fewest transfers
+        plan = plan_settlements(balances)
+        settlements = plan.as_list()
+
+        if request.query_params.get('detail', '').lower() in ('1', 'true', 'yes'):
+            return Response({
+                "settlements": settlements,
+                "currency": group.currency,
+                "strategy": plan.strategy,
+                "transfers": len(plan.transfers),
+                "lower_bound": plan.lower_bound,
+                "gap": plan.gap,
+            })
+
         return Response(settlements)
 
 
@@ -415,74 +969,403 @@ class ExpenseViewSet(viewsets.ModelViewSet):
     # correctly handled by ExpenseSerializer.
     # We don't need a perform_create() method here at all.
 
+    def perform_destroy(self, instance):
+        # Take the expense out of the group balances before deleting it
+        with transaction.atomic():
+            reverse_expense(instance)
+            invalidate_checkpoints(instance.group_id, expense_id=instance.id)
+            instance.delete()
+
+
+class SettlementViewSet(mixins.CreateModelMixin, mixins.ListModelMixin,
+                        mixins.RetrieveModelMixin, mixins.DestroyModelMixin,
+                        viewsets.GenericViewSet):
+    """
+    API endpoint for recording payments that settle debts.
+    GET /api/payments/?group=<id>  - list (optionally for one group)
+    POST /api/payments/            - {"group": 1, "from_user": 2, "to_user": 1, "amount": "30.00", "note": ""}
+    DELETE /api/payments/<id>/     - undo a payment recorded by mistake
+
+    Payments cannot be edited; delete and record them again instead.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = SettlementSerializer
+
+    def get_queryset(self):
+        # Only payments in groups the user is in
+        queryset = Settlement.objects.filter(group__members=self.request.user).select_related(
+            'from_user', 'to_user'
+        )
+        group_id = self.request.query_params.get('group')
+        if group_id:
+            queryset = queryset.filter(group_id=group_id)
+        return queryset
+
+    def get_serializer_context(self):
+        return {'request': self.request}
+
+    def perform_destroy(self, instance):
+        # Take the payment out of the group balances before deleting it
+        with transaction.atomic():
+            reverse_settlement(instance)
+            invalidate_checkpoints(instance.group_id, settlement_id=instance.id)
+            instance.delete()
+
 
 class ParseReceiptView(APIView):
     """
     An endpoint that accepts an uploaded image, sends it to Gemini
     for OCR and structured JSON extraction, and returns the JSON.
     
-    The image is *not* saved on the server.
+    The photo is stored once under its content hash (see api/receiptstore.py)
+    and returned as "image": {"id", "url", "thumbnail_url"}; send the id as
+    an expense's "receipt" to attach it. Gemini gets a grayscale JPEG shrunk
+    from it (see api/receiptimage.py); the Server-Timing header reports
+    how long preprocessing, Gemini and FX conversion took.
+
+    Parse results are cached (see api/receiptcache.py): a resubmitted photo
+    is answered without calling Gemini, with "cached": true and an
+    X-Receipt-Cache header of 'exact' or 'miss'.
     """
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser] # Must-have for file uploads
 
     def post(self, request, *args, **kwargs):
-        # 1. Get the uploaded image from the request
-        image_file = request.data.get('image')
-        
+        # 1. Get the uploaded image from the request, refusing oversized
+        # uploads before they are buffered
+        upload_limit, too_large = limit_upload_size(request)
+        image_file = None if too_large else request.data.get('image')
+
+        if too_large or upload_limit.exceeded:
+            return Response(
+                {"error": f"The image must be at most {settings.RECEIPT_MAX_UPLOAD_BYTES // (1024 * 1024)} MB."},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
         if not image_file:
             return Response(
                 {"error": "No image file provided in 'image' field."},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        # 2. Configure Gemini with the API key from settings.py
+        # (replay/fake transports never reach Gemini, so no key is needed)
         try:
-            # 2. Configure Gemini with the API key from settings.py
-            api_key = settings.GEMINI_API_KEY
-            if not api_key:
-                return Response(
-                    {"error": "GEMINI_API_KEY not configured on server."},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-            genai.configure(api_key=api_key)
-            
-            # 3. Open the uploaded image in memory
-            # The uploaded file is a Django UploadedFile, open it with PIL
-            img = PIL.Image.open(image_file)
-
-            # 4. Set up the model and prompt
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            prompt = "Extract all line items from this receipt. Follow the schema."
-
-            # 5. Call Gemini and enforce the JSON schema
-            response = model.generate_content(
-                [prompt, img],
-                generation_config=genai.GenerationConfig(
-                    response_schema=Receipt,  # <-- Enforce your Pydantic schema
-                    response_mime_type="application/json"
+            configure_gemini()
+        except GeminiNotConfigured as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        # 3. Preprocess, check the cache, call Gemini, convert prices (api/receiptparse.py)
+        raw = image_file.read()
+        try:
+            parsed = parse_receipt(request.user, raw)
+        except ImageRejected as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            # Handle API errors or validation errors
+            return Response(
+                {"error": f"Failed to parse receipt: {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        log_parse(parsed)
+
+        # 4. Send the clean, validated JSON back to the Android app,
+        # with the stored photo to attach to the expense
+        data = parsed.data
+        data["cached"] = parsed.cached
+        data["image"] = _store_upload(request.user, raw)
+        response = Response(data, status=status.HTTP_200_OK)
+        response["Server-Timing"] = server_timing(parsed.timings)
+        response["X-Receipt-Cache"] = parsed.cache_status
+        return response
+
+
+def _items_in_currency(items, currency):
+    """
+    The parsed receipt items with every price in `currency`. Items in another
+    currency are converted at the current rate (one FX pass) and keep their
+    original_price and original_currency.
+    """
+    foreign = [item for item in items if item['currency'].upper() != currency]
+    if not foreign:
+        return items
+    prices = iter(get_fx_service().convert_many(
+        [(item['price'], item['currency']) for item in foreign], target=currency
+    ))
+
+    converted = []
+    for item in items:
+        if item['currency'].upper() == currency:
+            converted.append(item)
+            continue
+        price = next(prices)
+        if price is None:
+            raise FXUnavailable(f"No exchange rate from {item['currency']} to {currency}.")
+        converted.append({
+            **item, 'price': price, 'currency': currency,
+            'original_price': item['price'], 'original_currency': item['currency'],
+        })
+    return converted
+
+
+def _store_upload(user, raw):
+    """Store a parsed photo; a full disk must not fail the parse. Returns its receipt_urls or None."""
+    try:
+        return receipt_urls(save_receipt_image(user, raw).sha256)
+    except OSError:
+        logger.exception("Could not store receipt image")
+        return None
+
+
+# One pool per worker process, shared by every batch request, so concurrent
+# batches together never run more than RECEIPT_BATCH_WORKERS parses.
+# Created on first use, after gunicorn has forked the worker.
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+
+def batch_executor():
+    global _batch_executor
+    if _batch_executor is None:
+        with _batch_executor_lock:
+            if _batch_executor is None:
+                _batch_executor = ThreadPoolExecutor(
+                    max_workers=settings.RECEIPT_BATCH_WORKERS, thread_name_prefix='receipt-parse'
                 )
+    return _batch_executor
+
+
+def _parse_in_worker(user, raw):
+    """Run one parse (and store the photo) on a pool thread, then release the thread's DB connection."""
+    try:
+        parsed = parse_receipt(user, raw)
+        return parsed, _store_upload(user, raw)
+    finally:
+        connection.close()
+
+
+class BatchParseReceiptView(APIView):
+    """
+    POST /api/ocr/parse-receipts/  (multipart, one or more 'images' files)
+    Parses several receipt photos concurrently on the process-wide thread pool
+    (RECEIPT_BATCH_WORKERS threads) and streams one NDJSON line per image as soon
+    as it finishes, in completion order, then a summary line:
+
+        {"index": 1, "filename": "b.jpg", "status": 200, "cached": false, "receipt": {...}, "image": {...}}
+        {"index": 0, "filename": "a.jpg", "status": 400, "error": "..."}
+        {"done": true, "parsed": 1, "failed": 1}
+
+    Each image goes through the same pipeline (and cache) as /api/ocr/parse-receipt/.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser, FormParser]
+
+    def post(self, request, *args, **kwargs):
+        # Step 1: Refuse oversized batches before they are buffered
+        max_images = settings.RECEIPT_BATCH_MAX_IMAGES
+        upload_limit, too_large = limit_upload_size(request, max_files=max_images)
+        image_files = [] if too_large else request.FILES.getlist('images')
+
+        if too_large or upload_limit.exceeded:
+            return Response(
+                {"error": f"Each image must be at most {settings.RECEIPT_MAX_UPLOAD_BYTES // (1024 * 1024)} MB."},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        if not image_files:
+            return Response(
+                {"error": "No image files provided in 'images' field."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(image_files) > max_images:
+            return Response(
+                {"error": f"At most {max_images} images per batch."},
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-            # 6. Validate the AI's JSON output (extra safety)
-            # This parses the JSON text and validates it with your Pydantic model
-            processed_receipt = Receipt.model_validate_json(response.text)
-            dict = processed_receipt.model_dump()
-            url = "https://api.fxratesapi.com/latest"
-            resp = requests.get(url=url).json()
+        try:
+            configure_gemini()
+        except GeminiNotConfigured as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            for item in dict["items"]:
-                item["price_in_cad"] = item["price"] / (resp["rates"][item["currency"]] / resp["rates"]["CAD"])
+        # Step 2: Read the uploads now; the request is gone by the time workers run
+        images = [(index, image_file.name, image_file.read()) for index, image_file in enumerate(image_files)]
 
+        response = StreamingHttpResponse(
+            self.stream_results(request.user, images), content_type='application/x-ndjson'
+        )
+        response['X-Accel-Buffering'] = 'no'  # let proxies pass lines through as they come
+        return response
 
-            # 7. Send the clean, validated JSON back to the Android app
-            # .model_dump() converts the Pydantic object to a dict
-            return Response(dict, status=status.HTTP_200_OK)
+    @staticmethod
+    def stream_results(user, images):
+        """Yield one NDJSON line per image as its parse finishes, then a summary."""
+        executor = batch_executor()
+        futures = {}
+        parsed_count = failed = 0
+        try:
+            for index, filename, raw in images:
+                futures[executor.submit(_parse_in_worker, user, raw)] = (index, filename)
+            for future in as_completed(futures):
+                index, filename = futures[future]
+                line = {"index": index, "filename": filename}
+                try:
+                    parsed, image = future.result()
+                except ImageRejected as e:
+                    line.update({"status": 400, "error": str(e)})
+                except Exception as e:
+                    line.update({"status": 500, "error": f"Failed to parse receipt: {str(e)}"})
+                else:
+                    log_parse(parsed, label=f"{index + 1}/{len(images)}")
+                    line.update({"status": 200, "cached": parsed.cached, "receipt": parsed.data, "image": image})
 
-        except Exception as e:
-            # Handle API errors or validation errors
+                if line["status"] == 200:
+                    parsed_count += 1
+                else:
+                    failed += 1
+                yield json.dumps(line) + '\n'
+
+            yield json.dumps({"done": True, "parsed": parsed_count, "failed": failed}) + '\n'
+        finally:
+            # If the client went away, drop its images not started yet
+            for future in futures:
+                future.cancel()
+
+
+class ReceiptImageView(APIView):
+    """
+    GET /api/receipts/<id>/                     the stored photo as uploaded
+    GET /api/receipts/<id>/thumbnail/?size=160  a JPEG thumbnail (RECEIPT_THUMBNAIL_SIZES)
+
+    Visible to whoever uploaded the photo and to the members of groups with
+    an expense using it. The id is the SHA-256 of the photo, so the content
+    behind a URL never changes: responses carry an ETag and may be cached
+    for a year, and If-None-Match gets 304 without touching the disk.
+    Thumbnails are generated on first request and kept.
+    """
+    permission_classes = [IsAuthenticated]
+    thumbnail = False  # set by the URL conf
+
+    def get(self, request, sha256):
+        # Step 1: Unknown and inaccessible photos look the same
+        image = accessible_images(request.user).filter(sha256=sha256).first()
+        if image is None:
+            raise Http404
+
+        size = None
+        if self.thumbnail:
+            sizes = settings.RECEIPT_THUMBNAIL_SIZES
+            try:
+                size = int(request.query_params.get('size', sizes[0]))
+            except ValueError:
+                size = None
+            if size not in sizes:
+                return Response(
+                    {"error": f"'size' must be one of {', '.join(str(s) for s in sizes)}."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        # Step 2: The client already has it
+        etag = f'"{sha256}-{size}"' if size else f'"{sha256}"'
+        cache_control = 'private, max-age=31536000, immutable'
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+        else:
+            # Step 3: Serve the file (making the thumbnail the first time)
+            try:
+                if size:
+                    path, content_type = ensure_thumbnail(sha256, size), 'image/jpeg'
+                else:
+                    path, content_type = original_path(sha256), image.content_type
+                response = FileResponse(open(path, 'rb'), content_type=content_type)
+            except FileNotFoundError:
+                logger.warning("Receipt image %s is missing from RECEIPT_STORAGE_DIR", sha256)
+                raise Http404
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+        return response
+
+
+# ============================================
+# COUNTRY VIEWS
+# Ratings shown when a country is clicked on the globe
+# ============================================
+
+def _encoded_response(request, body):
+    """
+    Send a precomputed EncodedBody: gzipped when the client accepts it,
+    304 when its ETag matches, cacheable by browsers and CDNs.
+    """
+    use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+    etag = f'"{body.etag}-gzip"' if use_gzip else f'"{body.etag}"'
+
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body.gzipped if use_gzip else body.raw, content_type='application/json')
+        if use_gzip:
+            response['Content-Encoding'] = 'gzip'
+    response['ETag'] = etag
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = f'public, max-age={settings.COUNTRY_RATINGS_CACHE_SECONDS}'
+    return response
+
+
+class CountryRatingsView(APIView):
+    """
+    GET /api/countries/<code>/ratings/
+    The ratings of one country, by ISO alpha-2 code ('FR') or name
+    ('France', 'Côte d'Ivoire'), in the shape of an entry of
+    static/countryratings.json plus its "code".
+    Served from the in-memory index (see api/countries.py).
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request, code):
+        body = country_body(code)
+        if body is None:
+            return Response({"error": f"No ratings for '{code}'."}, status=status.HTTP_404_NOT_FOUND)
+        return _encoded_response(request, body)
+
+
+class BulkCountryRatingsView(APIView):
+    """
+    GET /api/countries/ratings/?codes=FR,DE,Japan
+    Several countries in one request: {"countries": [...], "missing": [...]}.
+    Without 'codes', every country (the whole file, precompressed).
+    At most MAX_BULK_KEYS codes per request.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        keys = [key.strip() for key in request.query_params.get('codes', '').split(',') if key.strip()]
+        if len(keys) > MAX_BULK_KEYS:
             return Response(
-                {"error": f"Failed to parse receipt: {str(e)}"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {"error": f"'codes' may list at most {MAX_BULK_KEYS} countries."},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        except KeyboardInterrupt:
-            pass
+        return _encoded_response(request, countries_body(keys))
+
+
+class DestinationRecommendationView(APIView):
+    """
+    GET /api/countries/recommend/?min_budget=4&safety=caution&weights=cultural:2,natural:1&k=5
+    The best destinations for a traveller's priorities: countries passing
+    every filter, ranked by the weighted average of their ratings.
+    Computed over the NumPy ratings matrix (see api/recommend.py); the
+    Server-Timing header gives the time taken.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        started = time.perf_counter()
+        try:
+            query = parse_query(request.query_params, max_k=settings.RECOMMEND_MAX_RESULTS)
+            matrix = ratings_matrix()
+            ranked = matrix.recommend(**query)
+        except InvalidQuery as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        results = [recommendation(matrix, row, score) for row, score in ranked]
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        response = Response({"count": len(results), "results": results})
+        response["Server-Timing"] = server_timing({"recommend": elapsed_ms})
+        return response
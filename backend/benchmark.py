@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the CPU-bound hot paths of the backend.
+
+Measures, on realistic and worst-case sizes:
+- the settlement engine (api/settlements.py) and balance reads/recomputation (api/ledger.py)
+- ItineraryItem.insert_before / move_to / delete renumbering
+- extract_and_parse_json, validate_itinerary, calculate_total_transport_cost
+- BillGroupDetailSerializer rendering of large groups
+- receipt photo preprocessing (api/receiptimage.py) against a plain full decode
+- destination recommendations over the ratings matrix (api/recommend.py)
+
+Database benchmarks run against a throwaway in-memory SQLite database, so
+this never touches db.sqlite3. Gemini is never called (GENAI_TRANSPORT=fake).
+
+Every run is appended to benchmark_results/history.json together with the
+git commit. Each benchmark's median is compared with the median of the
+previous runs; slowdowns beyond --threshold are flagged as regressions.
+
+Usage:
+    python benchmark.py                      # run everything
+    python benchmark.py -k settle            # only benchmarks matching 'settle'
+    python benchmark.py --fail-on-regression # exit 1 if anything regressed (CI)
+"""
+import argparse
+import contextlib
+import decimal
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent
+RESULTS_FILE = BACKEND_DIR / "benchmark_results" / "history.json"
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "my_backend.settings")
+os.environ["GENAI_TRANSPORT"] = "fake"
+sys.path.insert(0, str(BACKEND_DIR))
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+
+
+# --- TIMING ---
+
+def measure(fn, repeat=7, min_time=0.05):
+    """
+    Time `fn` and return per-call statistics in microseconds.
+
+    The number of calls per repeat is calibrated so each repeat takes at
+    least `min_time` seconds; the median of the repeats is reported.
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(min_time / elapsed) + 1)
+
+    # Very slow cases (worst-case sizes) get fewer repeats
+    if elapsed > 1.0:
+        repeat = min(repeat, 3)
+
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+
+    return {
+        "median_us": round(statistics.median(samples) * 1e6, 3),
+        "min_us": round(min(samples) * 1e6, 3),
+        "stdev_us": round(statistics.pstdev(samples) * 1e6, 3),
+        "calls": number * repeat,
+    }
+
+
+# --- FIXTURES ---
+
+def random_balances(n_members, rng):
+    """Zero-sum balances in cents for `n_members` users."""
+    cents = [rng.randint(-50000, 50000) for _ in range(n_members - 1)]
+    cents.append(-sum(cents))
+    return {f"user{i}": c for i, c in enumerate(cents)}
+
+
+def itinerary_text(days, activities_per_day, fenced=True, single_quotes=False):
+    """An AI response containing an itinerary of the given size."""
+    from api.genaifakes import fake_itinerary
+
+    itinerary = fake_itinerary({"destination": "Benchmark City", "tripLength": f"{days} days"})
+    base = itinerary["dailyPlan"][0]["activities"]
+    for day_plan in itinerary["dailyPlan"]:
+        day_plan["activities"] = [dict(base[i % len(base)]) for i in range(activities_per_day)]
+    text = json.dumps(itinerary, indent=2)
+    if single_quotes:
+        text = text.replace('"', "'")
+    return f"Here is your trip:\n```json\n{text}\n```" if fenced else text, itinerary
+
+
+def build_group(n_members, n_expenses, splits_per_expense, rng):
+    """A BillGroup with expenses and splits, created with bulk_create."""
+    from api.ledger import rebuild_group_balances
+    from api.models import BillGroup, Expense, ExpenseSplit
+
+    suffix = f"{n_members}_{n_expenses}_{rng.random()}"
+    users = User.objects.bulk_create([User(username=f"bench_{suffix}_{i}") for i in range(n_members)])
+    group = BillGroup.objects.create(name=f"Bench group {suffix}")
+    group.members.add(*users)
+
+    expenses = Expense.objects.bulk_create([
+        Expense(group=group, description=f"Expense {i}", total_amount=decimal.Decimal("100.00"),
+                payer=rng.choice(users), split_type="E")
+        for i in range(n_expenses)
+    ])
+    share = decimal.Decimal("100.00") / splits_per_expense
+    ExpenseSplit.objects.bulk_create([
+        ExpenseSplit(expense=expense, user_owed=user, amount_owed=share.quantize(decimal.Decimal("0.01")))
+        for expense in expenses
+        for user in rng.sample(users, splits_per_expense)
+    ])
+    rebuild_group_balances([group.id])
+    return group
+
+
+def receipt_photo(width, height, rng, quality=90):
+    """A phone-sized JPEG with enough texture to compress like a photo."""
+    import PIL.Image
+
+    noise = bytes(rng.getrandbits(8) for _ in range((width // 16) * (height // 16) * 3))
+    img = PIL.Image.frombytes("RGB", (width // 16, height // 16), noise).resize((width, height))
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=quality)
+    return out.getvalue()
+
+
+def build_itinerary(n_items):
+    from api.models import Itinerary, ItineraryItem
+
+    owner = User.objects.create(username=f"bench_itinerary_{n_items}_{random.random()}")
+    itinerary = Itinerary.objects.create(owner=owner, title=f"Bench {n_items}")
+    ItineraryItem.objects.bulk_create([
+        ItineraryItem(itinerary=itinerary, description=f"Stop {i}", order=i) for i in range(n_items)
+    ])
+    return itinerary
+
+
+# --- BENCHMARKS ---
+# Each suite takes `wanted(name)` and skips building the fixtures of cases
+# that -k filtered out, so running one case never builds the worst-case groups.
+
+def bench_ledger(rng, wanted):
+    from api.ledger import compute_net_cents, group_balances
+    from api.settlements import plan_settlements
+
+    for label, n in (("realistic_8", 8), ("exact_14", 14)):
+        if not wanted(f"settlements.exact[{label}]"):
+            continue
+        balances = random_balances(n, rng)
+        yield f"settlements.exact[{label}]", lambda b=balances, n=n: plan_settlements(b, exact_max_members=n)
+
+    for label, n in (("realistic_8", 8), ("worst_5000", 5000)):
+        if not wanted(f"settlements.heuristic[{label}]"):
+            continue
+        balances = random_balances(n, rng)
+        yield f"settlements.heuristic[{label}]", lambda b=balances: plan_settlements(b, exact_max_members=-1)
+
+    for label, members, expenses, splits in (("realistic_6x200", 6, 200, 4),
+                                             ("worst_30x5000", 30, 5000, 10)):
+        if not (wanted(f"balances.read[{label}]") or wanted(f"balances.recompute[{label}]")):
+            continue
+        group = build_group(members, expenses, splits, rng)
+        # The materialised read should stay flat while the recomputation grows with history
+        yield f"balances.read[{label}]", lambda g=group: group_balances(g)
+        yield f"balances.recompute[{label}]", lambda g=group: compute_net_cents([g.id])
+
+
+def bench_renumbering(rng, wanted):
+    from api.models import ItineraryItem
+
+    for label, n in (("realistic_20", 20), ("worst_500", 500)):
+        if not (wanted(f"itinerary.insert_before+delete[{label}]") or wanted(f"itinerary.move_to_roundtrip[{label}]")):
+            continue
+        itinerary = build_itinerary(n)
+
+        def insert_and_delete(itinerary=itinerary):
+            # insert_before shifts every item; delete shifts them back
+            first = ItineraryItem.objects.get(itinerary=itinerary, order=0)
+            new_item = first.insert_before("Inserted stop")
+            new_item.delete()
+
+        def move_there_and_back(itinerary=itinerary, n=n):
+            item = ItineraryItem.objects.get(itinerary=itinerary, order=0)
+            item.move_to(n - 1)
+            item.move_to(0)
+
+        yield f"itinerary.insert_before+delete[{label}]", insert_and_delete
+        yield f"itinerary.move_to_roundtrip[{label}]", move_there_and_back
+
+
+def bench_itinerary_json(rng, wanted):
+    from api.genaiitinerary import (
+        calculate_total_transport_cost, extract_and_parse_json, validate_itinerary
+    )
+
+    realistic_text, realistic = itinerary_text(3, 9)
+    worst_text, worst = itinerary_text(30, 40)
+    # Unfenced with single quotes takes the failing-then-cleanup path
+    cleanup_text, _ = itinerary_text(7, 9, fenced=False, single_quotes=True)
+
+    yield "extract_and_parse_json[realistic_3d]", lambda: extract_and_parse_json(realistic_text)
+    yield "extract_and_parse_json[worst_30d_x40]", lambda: extract_and_parse_json(worst_text)
+    yield "extract_and_parse_json[cleanup_path_7d]", lambda: extract_and_parse_json(cleanup_text)
+    yield "validate_itinerary[realistic_3d]", lambda: validate_itinerary(realistic)
+    yield "validate_itinerary[worst_30d_x40]", lambda: validate_itinerary(worst)
+    yield "transport_cost[realistic_3d]", lambda: calculate_total_transport_cost(realistic)
+    yield "transport_cost[worst_30d_x40]", lambda: calculate_total_transport_cost(worst)
+
+
+def bench_serializers(rng, wanted):
+    from api.models import BillGroup
+    from api.serializers import BillGroupDetailSerializer
+
+    for label, members, expenses, splits in (("realistic_6x200", 6, 200, 4),
+                                             ("worst_30x2000", 30, 2000, 10)):
+        if not wanted(f"serializer.group_detail[{label}]"):
+            continue
+        group_id = build_group(members, expenses, splits, rng).id
+
+        def render(group_id=group_id):
+            group = BillGroup.objects.get(id=group_id)
+            return BillGroupDetailSerializer(group).data
+
+        yield f"serializer.group_detail[{label}]", render
+
+
+def bench_receipt_images(rng, wanted):
+    import PIL.Image
+    from api.receiptimage import preprocess_receipt
+
+    for label, width, height in (("phone_12mp", 4000, 3000), ("worst_48mp", 8000, 6000)):
+        if not (wanted(f"receipt.decode_full[{label}]") or wanted(f"receipt.preprocess[{label}]")):
+            continue
+        photo = receipt_photo(width, height, rng)
+        prepared = preprocess_receipt(photo)
+        print(f"  receipt[{label}]: {len(photo):,} bytes uploaded -> {prepared.sent_bytes:,} bytes sent to Gemini")
+
+        def decode_full(photo=photo):
+            # What the view did before: decode every pixel of the original
+            img = PIL.Image.open(io.BytesIO(photo))
+            img.load()
+
+        yield f"receipt.decode_full[{label}]", decode_full
+        yield f"receipt.preprocess[{label}]", lambda photo=photo: preprocess_receipt(photo)
+
+
+def bench_recommend(rng, wanted):
+    from api.recommend import parse_query, ratings_matrix
+
+    matrix = ratings_matrix()
+    for label, params in (("default", {}),
+                          ("filtered_weighted", {"min_budget": "4", "safety": "caution",
+                                                 "weights": "cultural:2,natural:1", "k": "5"}),
+                          ("worst_all_50", {"safety": "avoid-all", "k": "50"})):
+        query = parse_query(params)
+        yield f"recommend[{label}]", lambda query=query: matrix.recommend(**query)
+
+
+SUITES = [bench_ledger, bench_renumbering, bench_itinerary_json, bench_serializers, bench_receipt_images,
+          bench_recommend]
+
+
+# --- HISTORY / REGRESSIONS ---
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    if path.exists():
+        return json.loads(path.read_text())
+    return []
+
+
+def find_regressions(results, history, threshold, window):
+    """
+    Compare each result with the median of its last `window` recorded medians.
+    Returns {name: (baseline_us, current_us, ratio)} for slowdowns over threshold.
+    """
+    regressions = {}
+    for name, result in results.items():
+        past = [run["results"][name]["median_us"] for run in history[-window:] if name in run["results"]]
+        if not past:
+            continue
+        baseline = statistics.median(past)
+        ratio = result["median_us"] / baseline if baseline else 1.0
+        if ratio > 1 + threshold:
+            regressions[name] = (baseline, result["median_us"], ratio)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", dest="pattern", default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--threshold", type=float, default=0.20,
+                        help="Flag a regression when the median is this much slower (0.20 = 20%%)")
+    parser.add_argument("--window", type=int, default=5, help="Number of past runs used as the baseline")
+    parser.add_argument("--history", default=str(RESULTS_FILE))
+    parser.add_argument("--no-save", action="store_true", help="Don't append this run to the history")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    connection.creation.create_test_db(verbosity=0)
+    rng = random.Random(args.seed)
+
+    def wanted(name):
+        return not args.pattern or args.pattern in name
+
+    results = {}
+    for suite in SUITES:
+        for name, fn in suite(rng, wanted):
+            if not wanted(name):
+                continue
+            # Silence the debug prints some of the measured functions make
+            with contextlib.redirect_stdout(io.StringIO()):
+                results[name] = measure(fn, repeat=args.repeat)
+            print(f"{name:<48}{results[name]['median_us']:>14,.1f} us")
+
+    history_path = Path(args.history)
+    history = load_history(history_path)
+    regressions = find_regressions(results, history, args.threshold, args.window)
+
+    if regressions:
+        print(f"\nREGRESSIONS (> {args.threshold:.0%} slower than the median of the last {args.window} runs):")
+        for name, (baseline, current, ratio) in regressions.items():
+            print(f"  {name}: {baseline:,.1f} us -> {current:,.1f} us ({ratio:.2f}x)")
+    elif history:
+        print("\nNo regressions.")
+
+    if not args.no_save:
+        history.append({
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "results": results,
+        })
+        history_path.parent.mkdir(parents=True, exist_ok=True)
+        history_path.write_text(json.dumps(history, indent=2))
+        print(f"Saved to {history_path}")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
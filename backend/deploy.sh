@@ -7,13 +7,20 @@ echo "Stopping any existing Gunicorn processes..."
 pkill gunicorn || true
 sleep 2
 
+echo "Applying migrations and creating the cache table..."
+# The cache table holds what the workers share (ledger versions, FX rates)
+python manage.py migrate --noinput
+python manage.py createcachetable
+
 echo "Starting Gunicorn as a background daemon..."
 
 # --workers 3: Number of worker processes. A good starting point is (2 x number_of_cores) + 1.
 # --daemon: Runs the process in the background.
 # --log-file gunicorn.log: Specifies the file to log output to.
 # --log-level info: Sets the logging level.
+# -c gunicorn.conf.py: Worker hooks (each worker loads the country ratings before serving).
 gunicorn my_backend.wsgi:application \
+    -c gunicorn.conf.py \
     --workers 3 \
     --bind 127.0.0.1:8000 \
     --daemon \
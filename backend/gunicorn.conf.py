@@ -0,0 +1,13 @@
+"""
+Gunicorn settings shared by every deployment (see deploy.sh).
+"""
+
+
+def post_worker_init(worker):
+    """
+    Build the per-worker ratings index and matrix before the worker takes
+    requests, so the first recommendation is as fast as the others.
+    Management commands never run this, so migrate does not load the ratings.
+    """
+    from api.recommend import ratings_matrix
+    ratings_matrix()
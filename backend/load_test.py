@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+End-to-end HTTP load test for the backend API.
+
+Unlike the test_*.py scripts (which drive the server one request at a time
+to check correctness), this runs many virtual users concurrently with asyncio
+and measures throughput, latency percentiles and error rates per endpoint.
+
+Each virtual user repeatedly picks a scenario from a weighted mix:
+login, itinerary CRUD + reorder, expense creation, balances, settlements,
+AI itinerary generation and receipt OCR.
+
+The generate/OCR scenarios should be run against a server with a stubbed
+LLM, so results measure the backend and not Gemini:
+
+    GENAI_TRANSPORT=fake GENAI_TRANSPORT_LATENCY_MS=itinerary=200,receipt=100 \\
+        python manage.py runserver --noreload
+
+    python load_test.py --concurrency 20 --duration 60
+
+Results are written as JSON (including the git commit) so runs can be
+compared across commits:
+
+    python load_test.py --compare loadtest_results/<older>.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+BASE_URL = "http://127.0.0.1:8000/api"
+PASSWORD = "loadtest-pass-123"
+RESULTS_DIR = Path(__file__).resolve().parent / "loadtest_results"
+
+# Relative weight of each scenario in the default mix
+DEFAULT_MIX = {
+    "login": 5,
+    "itinerary_crud": 15,
+    "expense_create": 30,
+    "balances": 20,
+    "settlements": 15,
+    "generate": 5,
+    "ocr": 10,
+}
+
+
+# --- STATS ---
+
+class Stats:
+    """Collects latencies and errors per endpoint label."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.status_codes = defaultdict(lambda: defaultdict(int))
+
+    def record(self, label, seconds, status_code, ok):
+        self.latencies[label].append(seconds)
+        self.status_codes[label][str(status_code)] += 1
+        if not ok:
+            self.errors[label] += 1
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(stats, wall_seconds):
+    endpoints = {}
+    total_count = 0
+    total_errors = 0
+    for label in sorted(stats.latencies):
+        values = sorted(stats.latencies[label])
+        count = len(values)
+        errors = stats.errors[label]
+        total_count += count
+        total_errors += errors
+        endpoints[label] = {
+            "count": count,
+            "errors": errors,
+            "error_rate": round(errors / count, 4) if count else 0.0,
+            "throughput_rps": round(count / wall_seconds, 2) if wall_seconds else 0.0,
+            "mean_ms": round(1000 * sum(values) / count, 2),
+            "p50_ms": round(1000 * percentile(values, 50), 2),
+            "p95_ms": round(1000 * percentile(values, 95), 2),
+            "p99_ms": round(1000 * percentile(values, 99), 2),
+            "max_ms": round(1000 * values[-1], 2),
+            "status_codes": dict(stats.status_codes[label]),
+        }
+    return {
+        "endpoints": endpoints,
+        "totals": {
+            "requests": total_count,
+            "errors": total_errors,
+            "error_rate": round(total_errors / total_count, 4) if total_count else 0.0,
+            "throughput_rps": round(total_count / wall_seconds, 2) if wall_seconds else 0.0,
+            "wall_seconds": round(wall_seconds, 2),
+        },
+    }
+
+
+# --- HTTP HELPERS ---
+
+async def timed(client, stats, label, method, url, expected=(200, 201, 204), **kwargs):
+    """Send one request, record its latency under `label`, return the response."""
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+    except httpx.HTTPError:
+        stats.record(label, time.perf_counter() - start, "exception", ok=False)
+        return None
+    stats.record(label, time.perf_counter() - start, response.status_code,
+                 ok=response.status_code in expected)
+    return response
+
+
+def auth(token):
+    return {"Authorization": f"Token {token}"}
+
+
+def receipt_image_bytes(seed):
+    """A small generated PNG, different per seed so OCR requests aren't identical."""
+    import PIL.Image
+    import PIL.ImageDraw
+
+    img = PIL.Image.new("RGB", (400, 600), "white")
+    draw = PIL.ImageDraw.Draw(img)
+    rng = random.Random(seed)
+    for line in range(12):
+        draw.text((20, 20 + 40 * line), f"ITEM {rng.randint(1, 99)}   {rng.uniform(1, 40):.2f}", fill="black")
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+# --- SETUP ---
+
+async def setup_users(client, n_users, group_size, run_id):
+    """Register and log in test users, then put them into groups."""
+    users = []
+    for i in range(n_users):
+        username = f"load_{run_id}_{i}"
+        await client.post("/register/", json={"username": username, "password": PASSWORD})
+        response = await client.post("/login/", json={"username": username, "password": PASSWORD})
+        response.raise_for_status()
+        data = response.json()
+        users.append({"username": username, "id": data["user"]["id"], "token": data["token"]})
+
+    for start in range(0, n_users, group_size):
+        members = users[start:start + group_size]
+        owner = members[0]
+        response = await client.post(
+            "/groups/", headers=auth(owner["token"]),
+            json={"name": f"Load group {run_id}-{start}", "members": [m["id"] for m in members[1:]]}
+        )
+        response.raise_for_status()
+        group = {"id": response.json()["id"], "member_ids": [m["id"] for m in members]}
+        for member in members:
+            member["group"] = group
+    return users
+
+
+# --- SCENARIOS ---
+
+async def scenario_login(client, stats, user, rng):
+    await timed(client, stats, "POST /login/", "POST", "/login/",
+                json={"username": user["username"], "password": PASSWORD})
+
+
+async def scenario_itinerary_crud(client, stats, user, rng):
+    headers = auth(user["token"])
+    response = await timed(client, stats, "POST /itineraries/", "POST", "/itineraries/",
+                           headers=headers, json={"title": "Load test trip", "region": "Toronto"})
+    if response is None or response.status_code != 201:
+        return
+    itinerary_id = response.json()["id"]
+
+    item_ids = []
+    for order in range(3):
+        response = await timed(client, stats, "POST /itinerary-items/", "POST", "/itinerary-items/",
+                               headers=headers,
+                               json={"itinerary": itinerary_id, "description": f"Stop {order}",
+                                     "location_name": f"Place {order}", "order": order})
+        if response is not None and response.status_code == 201:
+            item_ids.append(response.json()["id"])
+
+    # Reorder through the renumbering paths (ItineraryItem.move_to / insert_before):
+    # move the first stop to the end, then insert a stop before the new first one
+    if len(item_ids) == 3:
+        await timed(client, stats, "POST /itinerary-items/<id>/move/", "POST",
+                    f"/itinerary-items/{item_ids[0]}/move/", headers=headers, json={"order": 2})
+        await timed(client, stats, "POST /itinerary-items/<id>/insert-before/", "POST",
+                    f"/itinerary-items/{item_ids[1]}/insert-before/", headers=headers,
+                    json={"description": "Coffee break", "location_name": "Cafe"})
+        await timed(client, stats, "PATCH /itinerary-items/<id>/", "PATCH",
+                    f"/itinerary-items/{item_ids[2]}/", headers=headers, json={"description": "Last stop"})
+
+    await timed(client, stats, "GET /itineraries/<id>/", "GET", f"/itineraries/{itinerary_id}/",
+                headers=headers)
+    await timed(client, stats, "GET /itineraries/", "GET", "/itineraries/", headers=headers)
+    await timed(client, stats, "DELETE /itineraries/<id>/", "DELETE", f"/itineraries/{itinerary_id}/",
+                headers=headers)
+
+
+async def scenario_expense_create(client, stats, user, rng):
+    group = user["group"]
+    members = group["member_ids"]
+    participants = rng.sample(members, rng.randint(1, len(members)))
+    total_cents = rng.randint(500, 30000)
+    share, remainder = divmod(total_cents, len(participants))
+    splits = [
+        {"user_owed_id": member_id, "amount_owed": f"{(share + (1 if i < remainder else 0)) / 100:.2f}"}
+        for i, member_id in enumerate(participants)
+    ]
+    await timed(client, stats, "POST /expenses/", "POST", "/expenses/", headers=auth(user["token"]),
+                json={"group": group["id"], "description": "Load test expense",
+                      "total_amount": f"{total_cents / 100:.2f}", "payer_id": user["id"],
+                      "split_type": "E", "splits": splits})
+
+
+async def scenario_balances(client, stats, user, rng):
+    await timed(client, stats, "GET /groups/<id>/balances/", "GET",
+                f"/groups/{user['group']['id']}/balances/", headers=auth(user["token"]))
+
+
+async def scenario_settlements(client, stats, user, rng):
+    await timed(client, stats, "GET /groups/<id>/settlements/", "GET",
+                f"/groups/{user['group']['id']}/settlements/", headers=auth(user["token"]))
+
+
+async def scenario_generate(client, stats, user, rng):
+    destination = rng.choice(["Montreal", "Vancouver", "Quebec City", "Niagara Falls", "Ottawa"])
+    await timed(client, stats, "POST /itineraries/generate/", "POST", "/itineraries/generate/",
+                headers=auth(user["token"]),
+                json={"destination": destination, "tripLength": f"{rng.randint(1, 3)} days",
+                      "budget": str(rng.randint(200, 2000))})
+
+
+async def scenario_ocr(client, stats, user, rng):
+    image = receipt_image_bytes(rng.randint(0, 50))
+    await timed(client, stats, "POST /ocr/parse-receipt/", "POST", "/ocr/parse-receipt/",
+                headers=auth(user["token"]), files={"image": ("receipt.png", image, "image/png")})
+
+
+SCENARIOS = {
+    "login": scenario_login,
+    "itinerary_crud": scenario_itinerary_crud,
+    "expense_create": scenario_expense_create,
+    "balances": scenario_balances,
+    "settlements": scenario_settlements,
+    "generate": scenario_generate,
+    "ocr": scenario_ocr,
+}
+
+
+# --- RUNNER ---
+
+async def virtual_user(client, stats, users, mix, deadline, rng, remaining):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    while time.perf_counter() < deadline:
+        if remaining is not None:
+            if remaining[0] <= 0:
+                return
+            remaining[0] -= 1
+        scenario = rng.choices(names, weights=weights)[0]
+        await SCENARIOS[scenario](client, stats, rng.choice(users), rng)
+
+
+async def run(args):
+    mix = parse_mix(args.mix)
+    run_id = uuid.uuid4().hex[:6]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        print(f"Setting up {args.users} users in groups of {args.group_size}...")
+        users = await setup_users(client, args.users, args.group_size, run_id)
+
+        stats = Stats()
+        remaining = [args.iterations] if args.iterations else None
+        deadline = time.perf_counter() + args.duration
+        print(f"Running {args.concurrency} virtual users for up to {args.duration}s...")
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            virtual_user(client, stats, users, mix, deadline, random.Random(args.seed + worker), remaining)
+            for worker in range(args.concurrency)
+        ])
+        wall = time.perf_counter() - start
+
+    result = summarize(stats, wall)
+    result["meta"] = {
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "base_url": args.base_url,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "iterations": args.iterations,
+        "users": args.users,
+        "group_size": args.group_size,
+        "seed": args.seed,
+        "mix": mix,
+    }
+    return result
+
+
+def parse_mix(spec):
+    """Parse "balances=5,ocr=1" into scenario weights (default mix if empty)."""
+    if not spec:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in spec.split(","):
+        name, weight = part.split("=")
+        if name.strip() not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario '{name}'. Choose from: {', '.join(SCENARIOS)}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=Path(__file__).resolve().parent,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# --- REPORTING ---
+
+def print_report(result, baseline=None):
+    header = f"{'ENDPOINT':<34}{'COUNT':>7}{'ERR%':>7}{'RPS':>8}{'P50':>9}{'P95':>9}{'P99':>9}"
+    if baseline:
+        header += f"{'P95 Δ':>10}"
+    print("\n" + header)
+    print("-" * len(header))
+    for label, row in result["endpoints"].items():
+        line = (f"{label:<34}{row['count']:>7}{100 * row['error_rate']:>6.1f}%{row['throughput_rps']:>8.1f}"
+                f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}")
+        if baseline:
+            old = baseline["endpoints"].get(label)
+            if old:
+                line += f"{100 * (row['p95_ms'] - old['p95_ms']) / old['p95_ms']:>+9.1f}%"
+        print(line)
+    totals = result["totals"]
+    print("-" * len(header))
+    print(f"{totals['requests']} requests in {totals['wall_seconds']}s "
+          f"({totals['throughput_rps']} req/s), error rate {100 * totals['error_rate']:.2f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--concurrency", type=int, default=10, help="Number of concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run")
+    parser.add_argument("--iterations", type=int, default=0,
+                        help="Stop after this many scenarios in total (0 = run for --duration)")
+    parser.add_argument("--users", type=int, default=12, help="Test accounts to create")
+    parser.add_argument("--group-size", type=int, default=4, help="Members per bill group")
+    parser.add_argument("--mix", default="", help="Scenario weights, e.g. 'balances=5,expense_create=3'")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", help="Where to write the JSON results "
+                                         "(default: loadtest_results/<timestamp>-<commit>.json)")
+    parser.add_argument("--compare", help="Earlier results JSON to compare p95 latencies against")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    output = Path(args.output) if args.output else RESULTS_DIR / (
+        f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{result['meta']['commit'] or 'nogit'}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2))
+    print(f"\nResults saved to {output}")
+
+    if result["totals"]["requests"] == 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -29,6 +29,70 @@ load_dotenv(BASE_DIR / '.env')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 # Load environment variables from .env file
 
+# Itinerary refinement chat sessions (live chats per worker process, history in the shared cache)
+CHAT_SESSION_MAX = int(os.getenv('CHAT_SESSION_MAX', '200'))
+CHAT_SESSION_IDLE_SECONDS = int(os.getenv('CHAT_SESSION_IDLE_SECONDS', '1800'))
+
+# Settlement plans: exact minimum-transfer search up to this many unpaired
+# non-zero balances, within this time budget; otherwise a fast heuristic
+SETTLEMENT_EXACT_MAX_MEMBERS = int(os.getenv('SETTLEMENT_EXACT_MAX_MEMBERS', '16'))
+SETTLEMENT_TIME_BUDGET_MS = int(os.getenv('SETTLEMENT_TIME_BUDGET_MS', '200'))
+
+# Balance checkpoints (see api/ledger.py): how many to keep per group, and how
+# many new expenses/settlements make `manage.py checkpoint_balances` take a new one
+BALANCE_CHECKPOINTS_KEPT = int(os.getenv('BALANCE_CHECKPOINTS_KEPT', '2'))
+BALANCE_CHECKPOINT_MIN_ACTIVITY = int(os.getenv('BALANCE_CHECKPOINT_MIN_ACTIVITY', '200'))
+
+# How long a group's balance timeline stays cached (it is also invalidated on every write)
+TIMELINE_CACHE_SECONDS = int(os.getenv('TIMELINE_CACHE_SECONDS', '3600'))
+
+# Largest number of rows accepted by POST /api/groups/<id>/import-expenses/
+EXPENSE_IMPORT_MAX_ROWS = int(os.getenv('EXPENSE_IMPORT_MAX_ROWS', '5000'))
+
+# Receipt photos (see api/receiptimage.py): uploads over the byte limit are
+# refused before buffering; the rest are shrunk to a grayscale JPEG whose
+# longest side is RECEIPT_MAX_DIMENSION before going to Gemini
+RECEIPT_MAX_UPLOAD_BYTES = int(os.getenv('RECEIPT_MAX_UPLOAD_BYTES', str(15 * 1024 * 1024)))
+RECEIPT_MAX_PIXELS = int(os.getenv('RECEIPT_MAX_PIXELS', '50000000'))
+RECEIPT_MAX_DIMENSION = int(os.getenv('RECEIPT_MAX_DIMENSION', '1600'))
+RECEIPT_JPEG_QUALITY = int(os.getenv('RECEIPT_JPEG_QUALITY', '80'))
+
+# Receipt parse cache (see api/receiptcache.py): how long results are reused
+RECEIPT_CACHE_DAYS = int(os.getenv('RECEIPT_CACHE_DAYS', '30'))
+
+# POST /api/ocr/parse-receipts/: images per request, and how many are parsed at once
+# per worker process (one thread pool shared by every batch request)
+RECEIPT_BATCH_MAX_IMAGES = int(os.getenv('RECEIPT_BATCH_MAX_IMAGES', '10'))
+RECEIPT_BATCH_WORKERS = int(os.getenv('RECEIPT_BATCH_WORKERS', '4'))
+
+# Stored receipt photos (see api/receiptstore.py), and the thumbnail sizes
+# (longest side, px) served by /api/receipts/<id>/thumbnail/?size= (first is the default)
+RECEIPT_STORAGE_DIR = os.getenv('RECEIPT_STORAGE_DIR', str(BASE_DIR / 'media' / 'receipts'))
+RECEIPT_THUMBNAIL_SIZES = [int(size) for size in os.getenv('RECEIPT_THUMBNAIL_SIZES', '160,480').split(',')]
+
+# How long browsers and CDNs may cache /api/countries/.../ratings/ responses
+# (the ratings only change with a deploy; ETags revalidate after that)
+COUNTRY_RATINGS_CACHE_SECONDS = int(os.getenv('COUNTRY_RATINGS_CACHE_SECONDS', str(7 * 24 * 3600)))
+
+# Most results one GET /api/countries/recommend/ may ask for ('k')
+RECOMMEND_MAX_RESULTS = int(os.getenv('RECOMMEND_MAX_RESULTS', '50'))
+
+# FX rates for receipt conversion (see api/fx.py). Rates older than
+# FX_CACHE_SECONDS are still served but refreshed in the background; the
+# snapshot file keeps the last good rates across restarts and outages.
+FX_RATES_URL = os.getenv('FX_RATES_URL', 'https://api.fxratesapi.com/latest')
+FX_CACHE_SECONDS = int(os.getenv('FX_CACHE_SECONDS', '3600'))
+FX_TIMEOUT_SECONDS = float(os.getenv('FX_TIMEOUT_SECONDS', '5'))
+FX_SNAPSHOT_PATH = os.getenv('FX_SNAPSHOT_PATH', str(BASE_DIR / 'fx_snapshot.json'))
+
+# Transport for Gemini / FX calls: 'live', 'record', 'replay' or 'fake'
+# (see api/genaitransport.py). Replay and fake modes need no network or API key.
+GENAI_TRANSPORT = os.getenv('GENAI_TRANSPORT', 'live')
+GENAI_CASSETTE_DIR = os.getenv('GENAI_CASSETTE_DIR', str(BASE_DIR / 'cassettes'))
+# Synthetic latency for replay/fake, e.g. "250" or "itinerary=8000,receipt=3000,fx=150"
+GENAI_TRANSPORT_LATENCY_MS = os.getenv('GENAI_TRANSPORT_LATENCY_MS', '0')
+GENAI_TRANSPORT_JITTER = os.getenv('GENAI_TRANSPORT_JITTER', '0')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
@@ -110,6 +174,18 @@ DATABASES = {
     }
 }
 
+# Cache shared by every gunicorn worker: ledger versions (which invalidate the
+# cached timelines and analytics of a group on every write, see api/ledger.py)
+# and FX rates must be the same in all of them, so it cannot be per-process.
+# The table is created by `python manage.py createcachetable` (deploy.sh runs it).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': os.getenv('CACHE_TABLE', 'django_cache'),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '10000'))},
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -242,3 +318,16 @@ SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 # if not DEBUG:
 #     SECURE_SSL_REDIRECT = True
 #     SESSION_COOKIE_SECURE = True
+
+# Logging: messages from the api app (receipt parse timings, imports, FX
+# refresh failures) go to the console, at API_LOG_LEVEL and above
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api': {'handlers': ['console'], 'level': os.getenv('API_LOG_LEVEL', 'INFO')},
+    },
+}
@@ -15,6 +15,7 @@ python manage.py makemigrations --check --dry-run 2>&1 | grep -q "No changes det
     python manage.py makemigrations
     python manage.py migrate
 }
+python manage.py createcachetable
 
 # Run the development server
 echo ""
@@ -27,13 +27,14 @@ export default function CountryDetailsOverlay({ country, onClose }) {
   useEffect(() => {
     async function fetchRatings() {
       try {
-        const res = await fetch("https://evenonvodkathiswill.work/static/countryratings.json");
-        const data = await res.json();
-
-        const countryData = data.find(
-          (item) => item.destination_name.toLowerCase() === country.properties.name.toLowerCase()
+        // Only this country's ratings (~1 KB gzipped, cached by the browser), by ISO code or else by name
+        const alpha2 = getAlpha2(country.properties.name);
+        const key = alpha2 !== "UN" ? alpha2 : country.properties.name;
+        const res = await fetch(
+          `https://evenonvodkathiswill.work/api/countries/${encodeURIComponent(key)}/ratings/`
         );
-    
+        const countryData = res.ok ? await res.json() : null;
+
         if (!countryData) {
           console.warn(`No data found for ${country.properties.name}`);
           setRatings({});